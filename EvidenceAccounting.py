@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Evidence accounting for flashing circles trials: how much evidence had been shown when the participant responded?
+
+Online, the evidence shown up to any frame is looked up in per-trial cumulative sums that are made when the trials
+are prepared (see cumulative_evidence()). Offline, recompute_evidence_at_rt() rebuilds the same measures for a saved
+session, from the evidence streams and RTs in the data file (vectorized over all trials).
+
+Usage: python EvidenceAccounting.py <data file.csv> [frame rate]
+"""
+from __future__ import division
+import sys
+import numpy as np
+import pandas as pd
+
+
+def cumulative_evidence(evidence_arrays):
+    """
+    Cumulative sum of the per-frame evidence of every flasher of a single trial.
+
+    Parameters
+    ----------
+    evidence_arrays: list of np.array
+        Per flasher, the opacity (0 or 1) of every frame
+
+    Returns
+    -------
+    cumulative: np.array of shape (n_flashers, n_frames + 1)
+        cumulative[:, n] is the number of flash frames shown per flasher in the first n frames
+    """
+
+    evidence_arrays = np.asarray(evidence_arrays)
+    cumulative = np.zeros((evidence_arrays.shape[0], evidence_arrays.shape[1] + 1), dtype=np.int32)
+    np.cumsum(evidence_arrays, axis=1, out=cumulative[:, 1:])
+    return cumulative
+
+
+def evidence_at_frame(cumulative, n_frames):
+    """ Number of flash frames shown per flasher in the first n_frames frames """
+    return cumulative[:, min(n_frames, cumulative.shape[1] - 1)]
+
+
+def _parse_stream(stream):
+    """ Evidence streams are saved as the string representation of a numpy array, e.g. '[1 0 1 1]' """
+    if isinstance(stream, str):
+        return np.fromstring(stream.strip('[]').replace('\n', ' '), sep=' ')
+    return np.asarray(stream, dtype=float)
+
+
+def recompute_evidence_at_rt(data, frame_rate, flash_length, increment_length, n_flashers=2):
+    """
+    Recomputes, for every decision-making trial in data, the evidence shown at the moment of response.
+
+    The number of frames shown is taken from the RT (stimulus phase duration for trials without response), so
+    these values reflect the intended stimulus, independent of frames dropped during the session.
+
+    Parameters
+    ----------
+    data: pd.DataFrame
+        Data of a session, as saved by FlashSession (needs columns 'rt', 'phase_4' and 'evidence stream <i>')
+    frame_rate: float
+        Frame rate during the session
+    flash_length: int
+        Number of frames per flash
+    increment_length: int
+        Number of frames per increment (flash + pause)
+    n_flashers: int
+
+    Returns
+    -------
+    evidence: pd.DataFrame
+        With index of data, columns 'evidence shown at rt <i>' (number of flashes, fractional for partially
+        shown flashes) per flasher, and 'total increments shown at rt'
+    """
+
+    stream_cols = ['evidence stream %d' % i for i in range(n_flashers)]
+    data = data.dropna(subset=stream_cols)
+
+    # Streams of all trials in a single (n_trials, n_flashers, n_increments) array, padded with zeros
+    streams = [[_parse_stream(stream) for stream in row] for row in data[stream_cols].values]
+    n_increments = max(stream.shape[0] for row in streams for stream in row)
+    stream_array = np.zeros((len(streams), n_flashers, n_increments + 1))
+    for trial_n, row in enumerate(streams):
+        for flasher, stream in enumerate(row):
+            stream_array[trial_n, flasher, :stream.shape[0]] = stream
+
+    cumulative = np.zeros((len(streams), n_flashers, n_increments + 2))
+    cumulative[:, :, 1:] = np.cumsum(stream_array, axis=2)
+
+    # Frames shown, and therefore the number of complete increments and the frames of the current increment
+    duration = data['rt'].astype(float).fillna(data['phase_4'].astype(float)).values
+    n_frames = np.floor(duration * frame_rate).astype(int)
+    full_increments = np.minimum(n_frames // increment_length, n_increments)
+    partial_frames = n_frames - full_increments * increment_length
+    partial_flash = np.minimum(partial_frames, flash_length) / flash_length
+
+    trial_idx = np.arange(len(streams))[:, np.newaxis]
+    flasher_idx = np.arange(n_flashers)[np.newaxis, :]
+    evidence = cumulative[trial_idx, flasher_idx, full_increments[:, np.newaxis]] + \
+        stream_array[trial_idx, flasher_idx, full_increments[:, np.newaxis]] * partial_flash[:, np.newaxis]
+
+    out = pd.DataFrame(evidence, index=data.index, columns=['evidence shown at rt %d' % i for i in range(n_flashers)])
+    out['total increments shown at rt'] = n_frames / increment_length
+    return out
+
+
+if __name__ == '__main__':
+    from standard_parameters import parameters as standard_parameters
+
+    data_fn = sys.argv[1]
+    frame_rate = float(sys.argv[2]) if len(sys.argv) > 2 else 60
+
+    # Flash and increment durations in frames, as rounded by the session
+    flash_length = int(np.round(standard_parameters['flash_duration'] * frame_rate / 1000))
+    increment_length = int(np.round(standard_parameters['increment_duration'] * frame_rate / 1000))
+
+    evidence = recompute_evidence_at_rt(pd.read_csv(data_fn), frame_rate=frame_rate,
+                                        flash_length=flash_length,
+                                        increment_length=increment_length,
+                                        n_flashers=standard_parameters['n_flashers'])
+    evidence.to_csv(data_fn.replace('.csv', '_evidence.csv'))
+    print(evidence.describe())
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Evidence streams for flashing circles trials, drawn directly from the distribution the session wants: every flasher
+flashes in each increment with its own probability (prop_correct for the correct flasher, prop_incorrect for the
+others), conditional on the correct flasher flashing at least as often in total as every other flasher.
+
+Drawing streams and redrawing them all until the condition holds (rejection_sample_increments()) takes many
+attempts when prop_correct and prop_incorrect are close, or with more flashers. sample_increments() has a constant
+cost instead: it draws the total of the correct flasher from its conditional distribution, then the totals of the
+other flashers (independent binomials, truncated at that total), and then places every flasher's flashes in
+uniformly random increments. As the increments of a flasher are exchangeable, this is exactly the same distribution.
+
+Usage: python EvidenceSampler.py [n_samples]
+    compares the two samplers statistically (see compare_samplers())
+"""
+from __future__ import division
+import sys
+import numpy as np
+from scipy import stats
+
+# (n_increments, prop_correct, prop_incorrect, n_flashers): cumulative distributions of the totals
+_distribution_cache = {}
+
+
+def total_distributions(n_increments, prop_correct, prop_incorrect, n_flashers):
+    """
+    Cumulative distributions of the total number of flashes, under the condition that the correct flasher's total
+    is at least every other flasher's total.
+
+    Returns
+    -------
+    correct_cdf: np.array of length n_increments + 1
+        Cumulative distribution of the total of the correct flasher
+    incorrect_cdf: np.array of length n_increments + 1
+        Cumulative (unconditional binomial) distribution of the total of an incorrect flasher. Given the correct
+        total k, every incorrect total is drawn from this distribution truncated at k
+    """
+
+    key = (n_increments, prop_correct, prop_incorrect, n_flashers)
+    if key not in _distribution_cache:
+        totals = np.arange(n_increments + 1)
+        incorrect_cdf = stats.binom.cdf(totals, n_increments, prop_incorrect)
+
+        # P(correct total = k and all others <= k)
+        joint = stats.binom.pmf(totals, n_increments, prop_correct) * incorrect_cdf ** (n_flashers - 1)
+        if joint.sum() <= 0:
+            raise ValueError('The correct flasher can never have most evidence with prop_correct %s and '
+                             'prop_incorrect %s' % (prop_correct, prop_incorrect))
+        correct_cdf = np.cumsum(joint) / joint.sum()
+        _distribution_cache[key] = (correct_cdf, incorrect_cdf)
+
+    return _distribution_cache[key]
+
+
+def sample_totals(n_increments, prop_correct, prop_incorrect, n_flashers, correct_answer, random_state=np.random):
+    """ Total number of flashes per flasher, with the correct flasher's total at least every other's """
+
+    correct_cdf, incorrect_cdf = total_distributions(n_increments, prop_correct, prop_incorrect, n_flashers)
+    correct_total = min(np.searchsorted(correct_cdf, random_state.uniform(), side='right'), n_increments)
+
+    # Inverse transform sampling of the incorrect totals, truncated at correct_total
+    u = random_state.uniform(size=n_flashers - 1) * incorrect_cdf[correct_total]
+    incorrect_totals = np.minimum(np.searchsorted(incorrect_cdf, u, side='right'), correct_total)
+
+    return np.insert(incorrect_totals, correct_answer, correct_total)
+
+
+def sample_increments(n_increments, prop_correct, prop_incorrect, n_flashers, correct_answer,
+                      random_state=np.random):
+    """
+    Evidence per increment (0 or 1) of every flasher of a single trial.
+
+    Parameters
+    ----------
+    n_increments: int
+    prop_correct: float
+        Probability of a flash in an increment, for the correct flasher
+    prop_incorrect: float
+        Probability of a flash in an increment, for every other flasher
+    n_flashers: int
+    correct_answer: int
+        Index of the correct flasher
+    random_state: np.random.RandomState or the np.random module
+
+    Returns
+    -------
+    increments: np.array of shape (n_flashers, n_increments), dtype int8
+    """
+
+    totals = sample_totals(n_increments, prop_correct, prop_incorrect, n_flashers, correct_answer, random_state)
+
+    # Every flasher flashes in the increments with its totals[i] smallest random keys
+    ranks = random_state.uniform(size=(n_flashers, n_increments)).argsort(axis=1).argsort(axis=1)
+    return (ranks < totals[:, np.newaxis]).astype(np.int8)
+
+
+def sample_increments_batch(n_increments, prop_correct, prop_incorrect, n_flashers, correct_answers,
+                            random_state=np.random):
+    """
+    sample_increments() for many trials (of the same difficulty) at once.
+
+    Parameters
+    ----------
+    correct_answers: np.array of int
+        Index of the correct flasher of every trial
+    (others: see sample_increments())
+
+    Returns
+    -------
+    increments: np.array of shape (n_trials, n_flashers, n_increments), dtype int8
+    """
+
+    correct_answers = np.asarray(correct_answers, dtype=int)
+    n_trials = len(correct_answers)
+    correct_cdf, incorrect_cdf = total_distributions(n_increments, prop_correct, prop_incorrect, n_flashers)
+
+    correct_totals = np.minimum(np.searchsorted(correct_cdf, random_state.uniform(size=n_trials), side='right'),
+                                n_increments)
+    u = random_state.uniform(size=(n_trials, n_flashers)) * incorrect_cdf[correct_totals][:, np.newaxis]
+    totals = np.minimum(np.searchsorted(incorrect_cdf, u, side='right'), correct_totals[:, np.newaxis])
+    totals[np.arange(n_trials), correct_answers] = correct_totals
+
+    ranks = random_state.uniform(size=(n_trials, n_flashers, n_increments)).argsort(axis=2).argsort(axis=2)
+    return (ranks < totals[:, :, np.newaxis]).astype(np.int8)
+
+
+def rejection_sample_increments(n_increments, prop_correct, prop_incorrect, n_flashers, correct_answer,
+                                random_state=np.random):
+    """ The same as sample_increments(), by redrawing all streams until the correct flasher has most evidence.
+    Returns the increments and the number of attempts """
+
+    n_attempts = 0
+    while True:
+        n_attempts += 1
+        p = np.where(np.arange(n_flashers) == correct_answer, prop_correct, prop_incorrect)
+        increments = (random_state.uniform(size=(n_flashers, n_increments)) < p[:, np.newaxis]).astype(np.int8)
+        totals = increments.sum(axis=1)
+        if (totals[correct_answer] >= totals).all():
+            return increments, n_attempts
+
+
+def compare_samplers(n_increments, prop_correct, prop_incorrect, n_flashers=2, correct_answer=0, n_samples=20000,
+                     random_state=None):
+    """
+    Tests whether sample_increments() and rejection_sample_increments() draw from the same distribution, with
+    chi-square tests of homogeneity on n_samples draws of each, of
+        1. the joint distribution of the totals of all flashers
+        2. the number of flashes per increment of every flasher (flashes should be placed uniformly)
+
+    Returns
+    -------
+    result: dict
+        p-values of both tests ('p_totals', 'p_positions'), and the mean number of attempts of the rejection sampler
+    """
+
+    if random_state is None:
+        random_state = np.random.RandomState()
+
+    exact = np.array([sample_increments(n_increments, prop_correct, prop_incorrect, n_flashers, correct_answer,
+                                        random_state) for _ in range(n_samples)])
+    rejection, n_attempts = zip(*[rejection_sample_increments(n_increments, prop_correct, prop_incorrect,
+                                                              n_flashers, correct_answer, random_state)
+                                  for _ in range(n_samples)])
+    rejection = np.array(rejection)
+
+    # 1. Joint totals, as one code per draw. Totals that are rare in both samples are pooled
+    def total_codes(increments):
+        totals = increments.sum(axis=2)
+        return np.ravel_multi_index(totals.T, (n_increments + 1,) * n_flashers)
+
+    exact_codes, rejection_codes = total_codes(exact), total_codes(rejection)
+    codes = np.union1d(exact_codes, rejection_codes)
+    table = np.array([np.bincount(np.searchsorted(codes, c), minlength=len(codes))
+                      for c in [exact_codes, rejection_codes]])
+    rare = table.sum(axis=0) < 10
+    if rare.any():
+        table = np.column_stack((table[:, ~rare], table[:, rare].sum(axis=1)))
+    p_totals = stats.chi2_contingency(table[:, table.sum(axis=0) > 0])[1]
+
+    # 2. Flashes per increment and flasher, conditional on the totals: compare the flash counts per increment
+    table = np.array([exact.sum(axis=0).ravel(), rejection.sum(axis=0).ravel()])
+    p_positions = stats.chi2_contingency(table[:, table.sum(axis=0) > 0])[1]
+
+    return {'p_totals': p_totals, 'p_positions': p_positions, 'mean_attempts': np.mean(n_attempts)}
+
+
+if __name__ == '__main__':
+    n_samples = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    random_state = np.random.RandomState(0)
+
+    for n_increments, prop_correct, prop_incorrect, n_flashers in [(20, 0.8, 0.2, 2), (20, 0.6, 0.4, 2),
+                                                                   (20, 0.55, 0.45, 2), (30, 0.55, 0.45, 4),
+                                                                   (10, 0.5, 0.5, 3)]:
+        result = compare_samplers(n_increments, prop_correct, prop_incorrect, n_flashers, n_samples=n_samples,
+                                  random_state=random_state)
+        print('%d increments, p = %.2f / %.2f, %d flashers: p(totals) = %.3f, p(positions) = %.3f '
+              '(rejection sampler: %.1f attempts per trial)' % (n_increments, prop_correct, prop_incorrect,
+                                                               n_flashers, result['p_totals'],
+                                                               result['p_positions'], result['mean_attempts']))
@@ -1,4 +1,5 @@
 from psychopy import visual
+from StaticLayer import StaticLayer
 
 
 class FixationCross(object):
@@ -20,10 +21,13 @@ class FixationCross(object):
         Radius of inner circle (bulls eye), in degrees of visual angle. Defaults to 0.3
     bg : tuple
         RGB of background color. Defaults to (0.5, 0.5, 0.5) - gray screen.
+    prerender : bool
+        Render the four parts once into a single texture (StaticLayer), so that draw() is a single draw call.
+        Defaults to True
     """
 
 
-    def __init__(self, win, outer_radius=.3, inner_radius=.15, bg=(0.5, 0.5, 0.5)):
+    def __init__(self, win, outer_radius=.3, inner_radius=.15, bg=(0.5, 0.5, 0.5), prerender=True):
 
         self.fixation_circle = visual.Circle(win,
                                              radius=outer_radius,
@@ -37,12 +41,23 @@ class FixationCross(object):
         self.fixation_bulls = visual.Circle(win, radius=inner_radius/2,
                                             units='deg', fillColor='black',
                                             lineColor='black')
+        self.parts = [self.fixation_circle, self.fixation_vertical_bar, self.fixation_horizontal_bar,
+                      self.fixation_bulls]
+
+        # Capture a little more than the outer circle, so that its anti-aliased edge is included
+        self.layer = None
+        if prerender:
+            self.layer = StaticLayer(win, self.parts, size=(outer_radius * 2.5, outer_radius * 2.5), units='deg')
 
     def draw(self):
         """
         Draws the fixation cross
         """
 
+        if self.layer is not None:
+            self.layer.draw()
+            return
+
         self.fixation_circle.draw()
         self.fixation_vertical_bar.draw()
         self.fixation_horizontal_bar.draw()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # encoding: utf-8
 from exp_tools import Trial
-from psychopy import visual, event
+from psychopy import visual
 
 
 class FlashInstructions(Trial):
@@ -40,8 +40,9 @@ class FlashInstructions(Trial):
         self.response_time = 0
 
     def draw(self):
+        """ Instruction screens are static: composed into a single texture in the first frame, which is drawn after """
 
-        self.session.current_instruction.draw()
+        self.session.scenes.draw((self.session.current_instruction, ), compose=True)
         super(FlashInstructions, self).draw()
 
     def event(self):
@@ -49,7 +50,7 @@ class FlashInstructions(Trial):
         Only listen for space (skip instructions), escape (kill session), and scanner pulses
         """
 
-        for i, (ev, ev_time) in enumerate(event.getKeys(timeStamped=self.session.clock)):
+        for i, (ev, ev_time) in enumerate(self.session.input_poller.get_keys()):
             # ev_time is the event timestamp relative to the Session Clock
 
             if len(ev) > 0:
@@ -100,7 +101,7 @@ class FlashInstructionsPractice(FlashInstructions):
         Only listen for space (skip instructions), escape (kill session), and scanner pulses
         """
 
-        for i, (ev, ev_time) in enumerate(event.getKeys(timeStamped=self.session.clock)):
+        for i, (ev, ev_time) in enumerate(self.session.input_poller.get_keys()):
             # ev_time is the event timestamp relative to the Session Clock
 
             if len(ev) > 0:
@@ -149,7 +150,7 @@ class FlashEndBlockInstructions(FlashInstructions):
     #     super(FlashInstructions, self).draw()
 
     def event(self):
-        for i, (ev, ev_time) in enumerate(event.getKeys(timeStamped=self.session.clock)):
+        for i, (ev, ev_time) in enumerate(self.session.input_poller.get_keys()):
             # ev_time is the event timestamp relative to the Session Clock
 
             if len(ev) > 0:
@@ -184,7 +185,7 @@ class FlashInstructionsNoResp(FlashInstructions):
         Only listen for space (skip instructions), escape (kill session), and scanner pulses
         """
 
-        for i, (ev, ev_time) in enumerate(event.getKeys(timeStamped=self.session.clock)):
+        for i, (ev, ev_time) in enumerate(self.session.input_poller.get_keys()):
             # ev_time is the event timestamp relative to the Session Clock
 
             if len(ev) > 0:
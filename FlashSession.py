@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # encoding: utf-8
 from __future__ import division
-from exp_tools import EyelinkSession
+from exp_tools import EyelinkSession, PulseRecorder, TrialPool, DriftEstimator, AdaptiveDifficulty
 from psychopy import monitors, data, info, logging
 from standard_parameters import *
 from warnings import warn
@@ -10,6 +10,7 @@ import pandas as pd
 import os
 import sys
 from glob import glob
+from functools import partial
 import cPickle as pickle
 
 from FlashTrial import *
@@ -18,6 +19,10 @@ from FlashStim import FlashStim
 from LocalizerTrial import *
 from NullTrial import *
 from FixationCross import *
+from StaticLayer import StaticLayer, SceneCache
+from ScoreFeedback import ScoreFeedback
+from EvidenceAccounting import cumulative_evidence, evidence_at_frame
+from EvidenceSampler import sample_increments
 
 import pylink
 
@@ -53,10 +58,13 @@ class FlashSession(EyelinkSession):
     start_score: int
         With what participant score should we start? Usually 0, but if the session is restarted in a later block,
         might be some number.
+    replay_file: str or None
+        If given (and tracker_on), a recorded gaze trace is played back instead of connecting to the eye-link
+        tracker (see exp_tools/eyelink/_eyetracker/libreplay.py), e.g. to test saccade responses without a tracker.
     """
 
     def __init__(self, subject_initials, index_number, scanner, tracker_on, sound_system=False, language='en',
-                 mirror=False, start_block=0, start_score=0):
+                 mirror=False, start_block=0, start_score=0, replay_file=None):
         super(FlashSession, self).__init__(subject_initials, index_number, sound_system)
 
         # Set-up screen
@@ -75,11 +83,15 @@ class FlashSession(EyelinkSession):
 
         self.trial_handlers = []
         self.participant_score = start_score
+        self.scored_trial_ID = None
+        self.prefetched_trial = None
+        self.trial_pool = TrialPool()   # Trial objects are reused: at most two (current, next) per trial class
         self.n_instructions_shown = -1
         self.start_block = start_block
 
-        # TR of MRI
+        # TR of MRI, and a record of all scanner pulses (one block = one run)
         self.TR = TR
+        self.pulse_recorder = PulseRecorder(TR=self.TR, n_blocks=5)
 
         # If we're running in debug mode, only show the instruction screens for 1 sec each.
         if self.subject_initials == 'DEBUG':
@@ -90,7 +102,7 @@ class FlashSession(EyelinkSession):
 
         # Set-up eye tracker OR dummy
         if tracker_on:
-            self.create_tracker(auto_trigger_calibration=1, calibration_type='HV9')
+            self.create_tracker(auto_trigger_calibration=1, calibration_type='HV9', replay_file=replay_file)
 
             if self.tracker_on:  # If it found an Eyelink tracker connected, set it up
                 self.dummy_tracker = False
@@ -137,6 +149,7 @@ class FlashSession(EyelinkSession):
         self.trial_arrays = None
         self.flasher_positions = None
         self.first_frame_idx = None
+        self.trial_cumulative_evidence = None
         self.last_ID_this_block = None
 
         # Get session information about flashers
@@ -147,11 +160,15 @@ class FlashSession(EyelinkSession):
         # Initialize psychopy.visual objects attributes and language
         self.language = language
         self.feedback_text_objects = None
+        self.correct_feedback_object = None
+        self.score_feedback_objects = None
         self.fixation_cross = None
         self.stimulus = None
         self.cue_object = None
+        self.cue_objects = None
         self.arrow_stimuli = None
         self.scanner_wait_screen = None
+        self.scenes = None
         self.localizer_instructions_eye = None
         self.localizer_instructions_hand = None
         self.cognitive_eye_instructions = None
@@ -168,12 +185,28 @@ class FlashSession(EyelinkSession):
         # Radius for eye movement detection: 1.5 degrees?
         self.eye_travel_threshold = 1.5
 
+        # Drift of the eye tracker, estimated from gaze during the fixation phases (1 and 3) of saccade trials
+        self.drift_estimator = DriftEstimator(fixation_pos=(self.screen_pix_size[0] / 2, self.screen_pix_size[1] / 2),
+                                              pixels_per_degree=self.pixels_per_degree)
+        self.outputDict['drift'] = self.drift_estimator.block_log
+
         # Load design and prepare all trials
         self.block_types = []
         self.load_design()
         self.prepare_visual_objects()
         self.prepare_trials()
 
+        # Event markers go to the EDF file and the marker file from a background thread (see Session.mark), and blinks
+        # are detected in another. Like the other background threads, they are started here, before the real-time
+        # profile is applied to this thread (threads inherit it, see setup_realtime)
+        self.setup_marker_bus()
+        self.setup_blink_monitor()
+
+        # Key presses and scanner pulses are read from a separate polling thread. It is started here, before the
+        # real-time profile is applied to this thread (threads inherit it), but only polls from run() on: until then,
+        # launchScan reads the keyboard itself to wait for the first scanner pulse
+        self.setup_input_poller(backend=input_backend, paused=True)
+
     def load_design(self):
         """ Loads all trials (blocks, conditions). The design files are created in a separate notebook. """
 
@@ -260,6 +293,10 @@ class FlashSession(EyelinkSession):
         self.cue_object = visual.TextStim(win=self.screen, text='Cue here', units='cm', height=visual_sizes[
             'cue_object'])
 
+        # Text cues are rendered once here, so that a trial only has to pick one (setting .text is slow)
+        self.cue_objects = {cue: visual.TextStim(win=self.screen, text=cue, units='cm',
+                                                 height=visual_sizes['cue_object']) for cue in ['SPD', 'ACC']}
+
         # Prepare feedback stimuli
         self.feedback_text_objects = [
             # 0 = Too slow
@@ -279,6 +316,16 @@ class FlashSession(EyelinkSession):
                             height=visual_sizes['fb_text'], flipHoriz=self.mirror),
         ]
 
+        # In limbic blocks, correct-feedback also shows the points earned and the new score. Per trial, one of these
+        # is swapped in as feedback_text_objects[1]. They are not composed into scenes, but drawn directly (their text
+        # is pre-rendered, so that setting the score costs nothing)
+        self.correct_feedback_object = self.feedback_text_objects[1]
+        self.score_feedback_objects = {
+            points: ScoreFeedback(win=self.screen, header=self.feedback_txt[1] + ' +%d' % points,
+                                  score_label=self.feedback_txt[6], height=visual_sizes['fb_text'],
+                                  mirror=self.mirror)
+            for points in [8, 2]}
+
         self.block_end_instructions = [
             visual.TextStim(win=self.screen, text='End of block reached. Waiting for operator...\n\nPress R to '
                                                   'recalibrate, or space to proceed.',
@@ -333,6 +380,14 @@ class FlashSession(EyelinkSession):
             visual.TextStim(win=self.screen, text='+', pos=(10, 0), height=visual_sizes['crosses'], units='deg')
         ]
 
+        # The fixation cross and the target crosses are pre-rendered, alone and together, into single textures (see
+        # StaticLayer). fixation_layers[draw_crosses] is the fixation cross with or without the target crosses
+        crosses_size = (2 * (max(abs(cross.pos[0]) for cross in self.crosses) + visual_sizes['crosses']),
+                        2 * visual_sizes['crosses'])
+        self.crosses_layer = StaticLayer(self.screen, self.crosses, size=crosses_size)
+        self.fixation_layers = {False: self.fixation_cross,
+                                True: StaticLayer(self.screen, [self.fixation_cross] + self.crosses, size=crosses_size)}
+
         # Prepare waiting for scanner-screen
         self.scanner_wait_screen = visual.TextStim(win=self.screen,
                                                    text=scanner_wait_txt,
@@ -455,6 +510,16 @@ class FlashSession(EyelinkSession):
                             italic=False, height=30, alignHoriz='center', units='pix', flipHoriz=self.mirror)
         ]
 
+        # Compose the static screens of trials (cue, feedback, scanner wait screen) once, alone and with the target
+        # crosses, so that each is drawn with a single draw call (see StaticLayer). Instruction screens are composed
+        # when they are first shown.
+        self.scenes = SceneCache(self.screen)
+        self.scene_size = (crosses_size[0], 6)
+        for stimulus in self.arrow_stimuli + list(self.cue_objects.values()) + self.feedback_text_objects:
+            self.scenes.compose((stimulus, ), size=self.scene_size)
+            self.scenes.compose((self.crosses_layer, stimulus), size=self.scene_size)
+        self.scenes.compose((self.scanner_wait_screen, ))
+
     def prepare_trials(self):
         """
         Prepares everything necessary to make flashing circles trials:
@@ -469,9 +534,6 @@ class FlashSession(EyelinkSession):
         # Some shortcuts
         prop_correct = self.standard_parameters['prop_correct']
         prop_incorrect = self.standard_parameters['prop_incorrect']
-        increment_length = self.standard_parameters['increment_length']
-        flash_length = self.standard_parameters['flash_length']
-        pause_length = increment_length - flash_length
 
         # Determine positions of flashers, simple trigonometry
         if self.n_flashers == 2:  # start from 0*pi (== (0,1)) if there are only two flashers (horizontal)
@@ -500,8 +562,18 @@ class FlashSession(EyelinkSession):
         if self.frame_rate is None:
             warn('Could not automatically detect frame rate! Guessing it is 60...')
             self.frame_rate = 60
+        self.stimulus.frame_period = 1 / self.frame_rate
         self.frame_rate = np.round(self.frame_rate)  # Rounding to nearest integer
 
+        # Flash and increment durations are given in ms: round these to whole frames at this frame rate, once
+        increment_length = int(np.round(self.standard_parameters['increment_duration'] * self.frame_rate / 1000))
+        flash_length = int(np.round(self.standard_parameters['flash_duration'] * self.frame_rate / 1000))
+        pause_length = increment_length - flash_length
+        self.standard_parameters['increment_length'] = increment_length
+        self.standard_parameters['flash_length'] = flash_length
+        print('Frame rate %dHz: increments of %d frames, flashes of %d frames' % (self.frame_rate, increment_length,
+                                                                                 flash_length))
+
         # Get the number of trials from the design; this is the the number of rows in the DataFrame.
         self.n_trials = self.design.shape[0]
 
@@ -542,59 +614,79 @@ class FlashSession(EyelinkSession):
                 continue
             corr_answer_this_trial = self.correct_answers[trial_n]   # shortcut
 
-            # Ensure that, at the end of the trial, there is more evidence for the correct choice alternative than for
-            # any of the other choice alternatives
-            good_evidence_streams = False
-            while not good_evidence_streams:
-                evidence_streams_this_trial = []
-                total_evidence_per_flasher = []
-                for i in range(self.n_flashers):
-
-                    # First, create initial evidence stream
-                    if i == corr_answer_this_trial:
-                        evidence_stream_this_flasher = np.random.binomial(n=1, p=prop_correct,
-                                                                          size=n_increments).astype(np.int8)
-                    else:
-                        evidence_stream_this_flasher = np.random.binomial(n=1, p=prop_incorrect,
-                                                                          size=n_increments).astype(np.int8)
-
-                    # How many pieces of evidence are shown in total for this flasher?
-                    total_evidence_per_flasher.append(np.sum(evidence_stream_this_flasher))
-
-                    # Repeat every increment for n_frames
-                    evidence_stream_this_flasher = np.repeat(evidence_stream_this_flasher, increment_length)
-                    evidence_stream_this_flasher[mask_idx] = 0   # add pause
+            # Evidence per increment, such that at the end of the trial, there is at least as much evidence for the
+            # correct choice alternative as for any of the other choice alternatives (drawn directly from this
+            # conditional distribution, see EvidenceSampler)
+            increments = sample_increments(n_increments, prop_correct, prop_incorrect, self.n_flashers,
+                                           corr_answer_this_trial)
 
-                    evidence_streams_this_trial.append(evidence_stream_this_flasher)
+            evidence_streams_this_trial = []
+            for increments_this_flasher in increments:
+                # Repeat every increment for n_frames
+                evidence_stream_this_flasher = np.repeat(increments_this_flasher, increment_length)
+                evidence_stream_this_flasher[mask_idx] = 0   # add pause
 
-                # Check if the evidence for the correct flasher is at least the evidence for each other flasher
-                total_evidence_per_flasher = np.array(total_evidence_per_flasher)
-                mask = np.ones(total_evidence_per_flasher.shape[0], np.bool)  # Create mask: compare correct to others
-                mask[corr_answer_this_trial] = 0
-                if (total_evidence_per_flasher[corr_answer_this_trial] >= total_evidence_per_flasher)[mask].all():
-                    good_evidence_streams = True
+                evidence_streams_this_trial.append(evidence_stream_this_flasher)
 
             self.trial_arrays.append(evidence_streams_this_trial)
 
         # Create new mask to select only first frame of every increment
         self.first_frame_idx = np.arange(0, mask_idx.shape[0], increment_length)
 
-    def run_null_trial(self, trial, phases, draw_crosses=False):
-        """ Runs a single null trial """
+        # Cumulative evidence per frame, so that the evidence shown at the response is a single lookup
+        self.trial_cumulative_evidence = [None if evidence_arrays is None else cumulative_evidence(evidence_arrays)
+                                          for evidence_arrays in self.trial_arrays]
+
+    def trial_phases(self, trial):
+        """ Returns the phase durations of trial """
+
+        return (trial.phase_0,  # time to wait for scanner
+                trial.phase_1,  # pre-cue fixation cross
+                trial.phase_2,  # cue
+                trial.phase_3,  # post-cue fixation cross [0 for localizer]
+                trial.phase_4,  # stimulus
+                trial.phase_5,  # post-stimulus time (after response, before feedback)
+                trial.phase_6,  # feedback time
+                trial.phase_7)  # ITI
+
+    def make_trial(self, trial, block_n):
+        """ Makes (but does not run) the trial object of any trial type """
+
+        if trial.null_trial:
+            # No target crosses in null trials, also not in eye blocks
+            return self.make_null_trial(trial, phases=self.trial_phases(trial), draw_crosses=False)
+        elif block_n == 0:
+            return self.make_localizer_trial(trial, phases=self.trial_phases(trial))
+        else:
+            return self.make_experimental_trial(trial, phases=self.trial_phases(trial))
+
+    def prefetch_trial(self, trial, block_n):
+        """ Makes the trial object of the next trial, so that it can start as soon as the current one stops """
+        self.prefetched_trial = self.make_trial(trial, block_n)
+
+    def make_null_trial(self, trial, phases, draw_crosses=False):
+        """ Makes a single null trial """
+
+        return self.trial_pool.get(NullTrial,
+                                   ID=trial.trial_ID,
+                                   block_trial_ID=trial.block_trial_ID,
+                                   parameters={'draw_crosses': draw_crosses},
+                                   phase_durations=phases,
+                                   session=self,
+                                   screen=self.screen,
+                                   tracker=self.tracker)
 
-        trial_object = NullTrial(ID=trial.trial_ID,
-                                 block_trial_ID=trial.block_trial_ID,
-                                 parameters={'draw_crosses': draw_crosses},
-                                 phase_durations=phases,
-                                 session=self,
-                                 screen=self.screen,
-                                 tracker=self.tracker)
+    def run_null_trial(self, trial, phases, draw_crosses=False, trial_object=None):
+        """ Runs a single null trial. If trial_object is None, it is made first. """
+
+        if trial_object is None:
+            trial_object = self.make_null_trial(trial, phases, draw_crosses=draw_crosses)
         trial_object.run()
 
         return trial_object
 
-    def run_localizer_trial(self, trial, phases):
-        """ Runs a single localizer trial """
+    def make_localizer_trial(self, trial, phases):
+        """ Makes a single localizer trial """
 
         if trial.response_modality == 'hand':
             trial_pointer = LocalizerTrialKeyboard
@@ -605,21 +697,28 @@ class FlashSession(EyelinkSession):
                               'hand'' is expected. Trial n: %d, block n: 0' % (trial.response_modality,
                                                                                trial.trial_ID)))
 
-        trial_object = trial_pointer(ID=trial.trial_ID,
-                                     block_trial_ID=trial.block_trial_ID,
-                                     parameters={'correct_answer': trial.correct_answer,
-                                                 'cue': trial.cue,
-                                                 'trial_type': trial.trial_type},
-                                     phase_durations=phases,
-                                     session=self,
-                                     screen=self.screen,
-                                     tracker=self.tracker)
+        return self.trial_pool.get(trial_pointer,
+                                   ID=trial.trial_ID,
+                                   block_trial_ID=trial.block_trial_ID,
+                                   parameters={'correct_answer': trial.correct_answer,
+                                               'cue': trial.cue,
+                                               'trial_type': trial.trial_type},
+                                   phase_durations=phases,
+                                   session=self,
+                                   screen=self.screen,
+                                   tracker=self.tracker)
+
+    def run_localizer_trial(self, trial, phases, trial_object=None):
+        """ Runs a single localizer trial. If trial_object is None, it is made first. """
+
+        if trial_object is None:
+            trial_object = self.make_localizer_trial(trial, phases)
         trial_object.run()
 
         return trial_object
 
-    def run_experimental_trial(self, trial, phases, block_n):
-        """ Runs a single experimental trial """
+    def make_experimental_trial(self, trial, phases):
+        """ Makes a single experimental trial, and prepares its feedback """
 
         # shortcut
         this_trial_type = trial.trial_type
@@ -637,35 +736,49 @@ class FlashSession(EyelinkSession):
         # In a limbic trial, prepare / update feedback
         if 'limbic' in trial.block_type:
             if this_trial_type in [0, 1]:  # Neutral condition
-                self.feedback_text_objects[1].text = self.feedback_txt[1]
+                self.feedback_text_objects[1] = self.correct_feedback_object
             elif this_trial_type in [2, 5]:  # Compatible cue condition
-                self.feedback_text_objects[1].text = self.feedback_txt[1] + ' +8\n' + self.feedback_txt[6] + ' %d' % (
-                    self.participant_score + 8)
+                self.score_feedback_objects[8].set_score(self.participant_score + 8)
+                self.feedback_text_objects[1] = self.score_feedback_objects[8]
             elif this_trial_type in [3, 4]:  # Incompatible cue condition
-                self.feedback_text_objects[1].text = self.feedback_txt[1] + ' +2\n' + self.feedback_txt[6] + ' %d' % (
-                    self.participant_score + 2)
-
-        trial_object = trial_pointer(ID=trial.trial_ID,
-                                     block_trial_ID=trial.block_trial_ID,
-                                     parameters={'trial_evidence_arrays': self.trial_arrays[trial.trial_ID],
-                                                 'correct_answer': trial.correct_answer.astype(int),
-                                                 'cue': trial.cue,
-                                                 'trial_type': trial.trial_type},
-                                     phase_durations=phases,
-                                     session=self,
-                                     screen=self.screen,
-                                     tracker=self.tracker)
+                self.score_feedback_objects[2].set_score(self.participant_score + 2)
+                self.feedback_text_objects[1] = self.score_feedback_objects[2]
+
+        return self.trial_pool.get(trial_pointer,
+                                   ID=trial.trial_ID,
+                                   block_trial_ID=trial.block_trial_ID,
+                                   parameters={'trial_evidence_arrays': self.trial_arrays[trial.trial_ID],
+                                               'correct_answer': trial.correct_answer.astype(int),
+                                               'cue': trial.cue,
+                                               'trial_type': trial.trial_type},
+                                   phase_durations=phases,
+                                   session=self,
+                                   screen=self.screen,
+                                   tracker=self.tracker)
+
+    def run_experimental_trial(self, trial, phases, block_n, trial_object=None):
+        """ Runs a single experimental trial. If trial_object is None, it is made first. """
+
+        if trial_object is None:
+            trial_object = self.make_experimental_trial(trial, phases)
         trial_object.run()
+        self.update_score(trial, trial_object)
+
+        return trial_object
+
+    def update_score(self, trial, trial_object):
+        """ If the response given is correct, update scores. Only done once per trial. """
+
+        if self.scored_trial_ID == trial.trial_ID:
+            return
+        self.scored_trial_ID = trial.trial_ID
 
-        # If the response given is correct, update scores
         if 'limbic' in trial.block_type and trial_object.response_type == 1:
-            if this_trial_type in [2, 5]:
+            if trial.trial_type in [2, 5]:
                 self.participant_score += 8
-            elif this_trial_type in [3, 4]:
+            elif trial.trial_type in [3, 4]:
                 self.participant_score += 2
 
-        return trial_object
-
     def show_instructions(self, trial_handler, end_block=False, phase_durations=None, respond_possible=True):
         """ Shows current instructions """
 
@@ -714,6 +827,16 @@ class FlashSession(EyelinkSession):
     def run(self):
         """ Run the trials that were prepared. The experimental design must be loaded. """
 
+        # From here on, key presses and scanner pulses are read from the polling thread. Anything before (such as the
+        # sync pulse launchScan waited for) is discarded. The scanner emulator of launchScan (a SyncGenerator) injects
+        # its pulses into psychopy.event, where the ioHub backend does not read keys otherwise
+        if hasattr(self.scanner, 'sync'):
+            self.input_poller.emulated_keys = (self.scanner.sync, )
+        self.input_poller.resume()
+
+        # No garbage collection during trial phases 1-6 from here on
+        self.setup_gc_control()
+
         # Loop through blocks
         for block_n in range(self.start_block, 5):
 
@@ -738,6 +861,8 @@ class FlashSession(EyelinkSession):
 
                 if self.tracker is not None:
                     if self.tracker.connected():
+                        # Recalibration is only advised if the drift in the last block was large
+                        print(self.drift_estimator.report())
                         self.tracker.stop_recording()
                         end_block_instr = self.show_instructions(trial_handler=trial_handler, end_block=True)
 
@@ -772,13 +897,17 @@ class FlashSession(EyelinkSession):
                 #         self.instructions_to_show = self.recalibration_error_screen
                 #         _ = self.show_instructions(trial_handler=trial_handler)
 
-            # Reset all feedback objects of which the text is dynamically changed
-            # text (SAT after limbic might otherwise show feedback points)
-            self.feedback_text_objects[1].text = 'Correct!'
+            # Reset all feedback objects that are dynamically swapped (SAT after limbic might otherwise show
+            # feedback points)
+            self.feedback_text_objects[1] = self.correct_feedback_object
 
             # It is useful to save the last trial ID for the current block.
             self.last_ID_this_block = self.design.loc[self.design['block'] == block_n, 'block_trial_ID'].iloc[-1]
 
+            # Every block is a separate scanner run
+            self.pulse_recorder.start_block(block_n)
+            self.drift_estimator.start_block(block_n)
+
             # Loop over block trials
             for trial in trial_handler:
 
@@ -816,52 +945,68 @@ class FlashSession(EyelinkSession):
                         break
 
                 # shortcut (needed in all trial types)
-                this_phases = (trial.phase_0,  # time to wait for scanner
-                               trial.phase_1,  # pre-cue fixation cross
-                               trial.phase_2,  # cue
-                               trial.phase_3,  # post-cue fixation cross [0 for localizer]
-                               trial.phase_4,  # stimulus
-                               trial.phase_5,  # post-stimulus time (after response, before feedback)
-                               trial.phase_6,  # feedback time
-                               trial.phase_7)  # ITI
+                this_phases = self.trial_phases(trial)
+
+                # Use the trial object that was made during the ITI of the previous trial, or make it now
+                if self.prefetched_trial is not None and self.prefetched_trial.ID == trial.trial_ID:
+                    trial_object = self.prefetched_trial
+                else:
+                    if self.prefetched_trial is not None:
+                        self.trial_pool.release(self.prefetched_trial)
+                    trial_object = self.make_trial(trial, block_n)
+                self.prefetched_trial = None
+
+                # In idle frames of this trial's ITI, settle the score, make the next trial and send its status
+                # message to the tracker, so that it can start as soon as the pulse arrives
+                next_trial = trial_handler.getFutureTrial(1)
+                if next_trial is not None:
+                    prefetch_steps = [partial(self.prefetch_trial, next_trial, block_n),
+                                      lambda: self.prefetched_trial.send_preamble()]
+                    if not trial.null_trial and block_n > 0:
+                        prefetch_steps.insert(0, partial(self.update_score, trial, trial_object))
+                    self.schedule_prefetch(prefetch_steps)
 
                 # What trial type to run?
                 if trial.null_trial:  # True or false
-                    if 'eye' in trial.block_type:
-                        draw_crosses = False  # True
-                    else:
-                        draw_crosses = False
-
                     # Run null trial
-                    trial_object = self.run_null_trial(trial, phases=this_phases, draw_crosses=draw_crosses)
+                    trial_object = self.run_null_trial(trial, phases=this_phases, trial_object=trial_object)
                 else:
                     if block_n == 0:
                         # Run localizer
-                        trial_object = self.run_localizer_trial(trial, phases=this_phases)
+                        trial_object = self.run_localizer_trial(trial, phases=this_phases, trial_object=trial_object)
                         trial_handler.addData('wrong_modality_answers', trial_object.wrong_modality_answers)
                     else:
                         # Run decision-making trials
-                        trial_object = self.run_experimental_trial(trial, phases=this_phases, block_n=block_n)
+                        trial_object = self.run_experimental_trial(trial, phases=this_phases, block_n=block_n,
+                                                                   trial_object=trial_object)
 
                         # Save evidence arrays (only in decision-making trials)
                         for flasher in range(self.n_flashers):
                             trial_handler.addData('evidence stream ' + str(flasher),
                                                   self.trial_arrays[trial.trial_ID][flasher][self.first_frame_idx])
                         trial_handler.addData('evidence shown at rt',
-                                              trial_object.evidence_shown / self.standard_parameters['flash_length'])
+                                              evidence_at_frame(self.trial_cumulative_evidence[trial.trial_ID],
+                                                                trial_object.n_stimulus_frames) /
+                                              self.standard_parameters['flash_length'])
                         trial_handler.addData('total increments shown at rt',
-                                              trial_object.total_increments / self.standard_parameters[
+                                              trial_object.n_stimulus_frames / self.standard_parameters[
                                                   'increment_length'])
                         trial_handler.addData('late responses', trial_object.late_responses)
+                        trial_handler.addData('increments shortened by dropped frames',
+                                              trial_object.shortened_increments)
+                        trial_handler.addData('blinks', trial_object.n_blinks)
 
                     # Save behavioral data (only in non-null trials)
                     trial_handler.addData('rt', trial_object.response_time)
                     trial_handler.addData('response', trial_object.response)
                     trial_handler.addData('response type', trial_object.response_type)
                     trial_handler.addData('correct', trial_object.response_type == 1)
-                    trial_handler.addData('feedback', self.feedback_text_objects[trial_object.feedback_type].text)
+                    trial_handler.addData('feedback', trial_object.feedback_text)
                     trial_handler.addData('score', self.participant_score)
 
+                # Finish preparing the next trial, if the ITI was too short
+                self.finish_prefetch()
+
                 if trial.block_trial_ID == 0:
                     block_start_time = trial_object.t_time
 
@@ -883,8 +1028,9 @@ class FlashSession(EyelinkSession):
                 trial_handler.addData('stimulus_onset_time_block_measured', trial_object.fix2_time - block_start_time)
                 # Counter-intuitive, but fix2_time is END of fixation cross 2 = onset of stim
 
-                # Trial finished, so on to the next entry
+                # Trial finished, so on to the next entry. The trial object can be reused
                 self.exp_handler.nextEntry()
+                self.trial_pool.release(trial_object)
 
                 # Check for stop flag in trial loop
                 if self.stopped:
@@ -895,6 +1041,12 @@ class FlashSession(EyelinkSession):
                 break
 
             # Save data of every block after every block!
+            print(self.pulse_recorder.summary(block_n))
+            self.drift_estimator.end_block()
+            print('Next-trial preparation ran past a frame flip %d times' % self.prefetch_overruns)
+            if len(self.gc_pauses) > 0:
+                print('%d garbage collections, longest took %.1f ms' % (
+                    len(self.gc_pauses), max(pause[2] for pause in self.gc_pauses) * 1000))
             self.save_data(block_n=block_n)
 
         self.close()
@@ -916,6 +1068,10 @@ class FlashSession(EyelinkSession):
             with open(output_fn_frames + '_outputDict.pickle', 'wb') as f:
                 pickle.dump(self.outputDict, f)
 
+        self.pulse_recorder.to_dataframe().to_csv(output_fn_frames + '_pulses.csv', index=False)
+        pd.DataFrame(self.gc_pauses, columns=['time', 'frame_n', 'duration', 'generation', 'collected']).to_csv(
+            output_fn_frames + '_gc_pauses.csv', index=False)
+
         if self.screen.recordFrameIntervals:
 
             # Save frame intervals to file
@@ -930,13 +1086,18 @@ class FlashSession(EyelinkSession):
             dist_string = msg % (m, sd, m - 2.58 * sd, m + 2.58 * sd)
             n_total = len(intervals_ms)
             n_dropped = sum(intervals_ms > (1.5 * m))
-            msg = "Dropped/Frames = %i/%i = %.3f%%"
-            dropped_string = msg % (n_dropped, n_total, 100 * n_dropped / float(n_total))
+
+            # Frames during which the garbage collector ran
+            gc_frames = [pause[1] for pause in self.gc_pauses if 0 <= pause[1] < n_total]
+            n_dropped_gc = sum(intervals_ms[gc_frames] > (1.5 * m))
+            msg = "Dropped/Frames = %i/%i = %.3f%% (%i during GC)"
+            dropped_string = msg % (n_dropped, n_total, 100 * n_dropped / float(n_total), n_dropped_gc)
 
             # plot the frame intervals
             pylab.figure(figsize=[12, 8])
             pylab.subplot(1, 2, 1)
             pylab.plot(intervals_ms, '-')
+            pylab.plot(gc_frames, intervals_ms[gc_frames], 'r.')  # garbage collections
             pylab.ylabel('t (ms)')
             pylab.xlabel('frame N')
             pylab.title(dropped_string)
@@ -961,7 +1122,8 @@ class FlashSession(EyelinkSession):
 class FlashPracticeSession(EyelinkSession):
     """ Practice session of the FlashTask """
 
-    def __init__(self, subject_initials, index_number, scanner, tracker_on, sound_system=False, language='en'):
+    def __init__(self, subject_initials, index_number, scanner, tracker_on, sound_system=False, language='en',
+                 replay_file=None):
         super(FlashPracticeSession, self).__init__(subject_initials, index_number, sound_system)
 
         # Set-up screen
@@ -992,12 +1154,14 @@ class FlashPracticeSession(EyelinkSession):
                                                   autoLog=True)
         self.trial_handlers = []
         self.participant_score = 0
+        self.trial_pool = TrialPool()
         self.n_instructions_shown = -1
         self.current_block = 0
         self.current_block_trial = 0
 
-        # TR of MRI
+        # TR of MRI, and a record of all scanner pulses (one block = one run)
         self.TR = TR
+        self.pulse_recorder = PulseRecorder(TR=self.TR, n_blocks=8)
 
         # If we're running in debug mode, only show the instruction screens for 1 sec each.
         if self.subject_initials == 'DEBUG':
@@ -1008,7 +1172,7 @@ class FlashPracticeSession(EyelinkSession):
 
         # Set-up eye tracker OR dummy
         if tracker_on:
-            self.create_tracker(auto_trigger_calibration=1, calibration_type='HV9')
+            self.create_tracker(auto_trigger_calibration=1, calibration_type='HV9', replay_file=replay_file)
 
             if self.tracker_on:  # If it found an Eyelink tracker connected, set it up
                 self.dummy_tracker = False
@@ -1035,6 +1199,15 @@ class FlashPracticeSession(EyelinkSession):
         self.trial_arrays = None
         self.flasher_positions = None
         self.first_frame_idx = None
+        self.trial_cumulative_evidence = None
+        self.n_increments = None
+        self.mask_idx = None
+
+        # In adaptive blocks, the difficulty (flash probabilities) of every trial is chosen by the responses so far,
+        # until the difficulty for the target accuracy is known (see AdaptiveDifficulty)
+        self.adaptive_blocks = [3]
+        self.adaptive_difficulty = None
+        self.trial_difficulty = None
 
         # Get session information about flashers
         self.n_flashers = self.standard_parameters['n_flashers']
@@ -1044,11 +1217,15 @@ class FlashPracticeSession(EyelinkSession):
         # Initialize psychopy.visual objects attributes
         self.language = language
         self.feedback_text_objects = None
+        self.correct_feedback_object = None
+        self.score_feedback_objects = None
         self.fixation_cross = None
         self.stimulus = None
         self.cue_object = None
+        self.cue_objects = None
         self.arrow_stimuli = None
         self.scanner_wait_screen = None
+        self.scenes = None
         self.localizer_instructions = None
         self.cognitive_eye_instructions = None
         self.cognitive_hand_instructions = None
@@ -1063,6 +1240,11 @@ class FlashPracticeSession(EyelinkSession):
         # Radius for eye movement detection: 3 cm?
         self.eye_travel_threshold = 3
 
+        # Drift of the eye tracker, estimated from gaze during the fixation phases (1 and 3) of saccade trials
+        self.drift_estimator = DriftEstimator(fixation_pos=(self.screen_pix_size[0] / 2, self.screen_pix_size[1] / 2),
+                                              pixels_per_degree=self.pixels_per_degree)
+        self.outputDict['drift'] = self.drift_estimator.block_log
+
         # Load design and prepare all trials
         self.block_types = []
         self.load_design()
@@ -1088,6 +1270,17 @@ class FlashPracticeSession(EyelinkSession):
                                                   dataFileName=os.path.join(_thisDir, self.output_file),
                                                   autoLog=True)
 
+        # Event markers go to the EDF file and the marker file from a background thread (see Session.mark), and blinks
+        # are detected in another. Like the other background threads, they are started here, before the real-time
+        # profile is applied to this thread (threads inherit it, see setup_realtime)
+        self.setup_marker_bus()
+        self.setup_blink_monitor()
+
+        # Key presses and scanner pulses are read from a separate polling thread. It is started here, before the
+        # real-time profile is applied to this thread (threads inherit it), but only polls from run() on: until then,
+        # launchScan reads the keyboard itself to wait for the first scanner pulse
+        self.setup_input_poller(backend=input_backend, paused=True)
+
     def load_design(self):
         # Load full design in self.design
         self.design = pd.read_csv(os.path.join(design_path, 'practice', 'all_blocks', 'trials.csv'))
@@ -1162,6 +1355,10 @@ class FlashPracticeSession(EyelinkSession):
         self.cue_object = visual.TextStim(win=self.screen, text='Cue here', units='cm', height=visual_sizes[
             'cue_object'])
 
+        # Text cues are rendered once here, so that a trial only has to pick one (setting .text is slow)
+        self.cue_objects = {cue: visual.TextStim(win=self.screen, text=cue, units='cm',
+                                                 height=visual_sizes['cue_object']) for cue in ['SPD', 'ACC']}
+
         # Prepare feedback stimuli
         self.feedback_text_objects = [
             # 0 = Too slow
@@ -1181,6 +1378,15 @@ class FlashPracticeSession(EyelinkSession):
                             height=visual_sizes['fb_text']),
         ]
 
+        # In limbic blocks, correct-feedback also shows the points earned and the new score. Per trial, one of these
+        # is swapped in as feedback_text_objects[1]. They are not composed into scenes, but drawn directly (their text
+        # is pre-rendered, so that setting the score costs nothing)
+        self.correct_feedback_object = self.feedback_text_objects[1]
+        self.score_feedback_objects = {
+            points: ScoreFeedback(win=self.screen, header=self.feedback_txt[1] + ' +%d' % points,
+                                  score_label=self.feedback_txt[6], height=visual_sizes['fb_text'])
+            for points in [8, 2]}
+
         # Prepare localizer stimuli
         arrow_right_vertices = [(-0.2, 0.05), (-0.2, -0.05), (-.0, -0.05), (0, -0.1), (0.2, 0), (0, 0.1), (0, 0.05)]
         arrow_left_vertices = [(0.2, 0.05), (0.2, -0.05), (0.0, -0.05), (0, -0.1), (-0.2, 0), (0, 0.1), (0, 0.05)]
@@ -1209,6 +1415,14 @@ class FlashPracticeSession(EyelinkSession):
             visual.TextStim(win=self.screen, text='+', pos=(8, 0), height=visual_sizes['crosses'], units='deg')
         ]
 
+        # The fixation cross and the target crosses are pre-rendered, alone and together, into single textures (see
+        # StaticLayer). fixation_layers[draw_crosses] is the fixation cross with or without the target crosses
+        crosses_size = (2 * (max(abs(cross.pos[0]) for cross in self.crosses) + visual_sizes['crosses']),
+                        2 * visual_sizes['crosses'])
+        self.crosses_layer = StaticLayer(self.screen, self.crosses, size=crosses_size)
+        self.fixation_layers = {False: self.fixation_cross,
+                                True: StaticLayer(self.screen, [self.fixation_cross] + self.crosses, size=crosses_size)}
+
         # Prepare waiting for scanner-screen
         self.scanner_wait_screen = visual.TextStim(win=self.screen,
                                                    text=scanner_wait_txt,
@@ -1324,6 +1538,16 @@ class FlashPracticeSession(EyelinkSession):
                                 font='Helvetica Neue', pos=(0, 0),
                                 italic=False, height=30, alignHoriz='center', units='pix')
 
+        # Compose the static screens of trials (cue, feedback, scanner wait screen) once, alone and with the target
+        # crosses, so that each is drawn with a single draw call (see StaticLayer). Instruction screens are composed
+        # when they are first shown.
+        self.scenes = SceneCache(self.screen)
+        self.scene_size = (crosses_size[0], 6)
+        for stimulus in self.arrow_stimuli + list(self.cue_objects.values()) + self.feedback_text_objects:
+            self.scenes.compose((stimulus, ), size=self.scene_size)
+            self.scenes.compose((self.crosses_layer, stimulus), size=self.scene_size)
+        self.scenes.compose((self.scanner_wait_screen, ))
+
     def prepare_trials(self):
         """
                Prepares everything necessary to run trials:
@@ -1338,9 +1562,6 @@ class FlashPracticeSession(EyelinkSession):
         # Some shortcuts
         prop_correct = self.standard_parameters['prop_correct']
         prop_incorrect = self.standard_parameters['prop_incorrect']
-        increment_length = self.standard_parameters['increment_length']
-        flash_length = self.standard_parameters['flash_length']
-        pause_length = increment_length - flash_length
 
         # Determine positions of flashers, simple trigonometry
         if self.n_flashers == 2:  # start from 0*pi (== (0,1)) if there are only two flashers (horizontal)
@@ -1364,8 +1585,18 @@ class FlashPracticeSession(EyelinkSession):
         if self.frame_rate is None:
             warn('Could not automatically detect frame rate! Guessing it is 60...')
             self.frame_rate = 60
+        self.stimulus.frame_period = 1 / self.frame_rate
         self.frame_rate = np.round(self.frame_rate)  # Rounding to nearest integer
 
+        # Flash and increment durations are given in ms: round these to whole frames at this frame rate, once
+        increment_length = int(np.round(self.standard_parameters['increment_duration'] * self.frame_rate / 1000))
+        flash_length = int(np.round(self.standard_parameters['flash_duration'] * self.frame_rate / 1000))
+        pause_length = increment_length - flash_length
+        self.standard_parameters['increment_length'] = increment_length
+        self.standard_parameters['flash_length'] = flash_length
+        print('Frame rate %dHz: increments of %d frames, flashes of %d frames' % (self.frame_rate, increment_length,
+                                                                                 flash_length))
+
         # Get the number of trials from the design; this is the the number of rows in the DataFrame.
         self.n_trials = self.design.shape[0]
 
@@ -1397,66 +1628,79 @@ class FlashPracticeSession(EyelinkSession):
         # Initialize 'increment arrays' for correct and incorrect. These are arrays filled with 0s and 1s, determining
         # for each 'increment' whether a piece of evidence is shown or not.
         # (this is a bit loopy, but I can't be bothered to make nice matrices here)
-        current_difficulty = (0.9, 0.2)
-        self.trial_arrays = []
+        self.n_increments = n_increments
+        self.mask_idx = mask_idx
+        self.trial_arrays = [None] * self.n_trials
+        self.trial_cumulative_evidence = [None] * self.n_trials
+        self.trial_difficulty = [None] * self.n_trials
+
+        # The difficulty of trials in adaptive blocks is chosen for every trial, by the responses so far, around the
+        # mean flash probability of the experiment. The prior is centred on the difficulty of the experiment, and the
+        # first two trials are easy (0.85 / 0.25 and 0.775 / 0.325 with the standard parameters)
+        self.adaptive_difficulty = AdaptiveDifficulty(mean_prop=(prop_correct + prop_incorrect) / 2,
+                                                      prior_threshold=prop_correct - prop_incorrect,
+                                                      warmup=(0.6, 0.45))
+
         for trial_n in range(self.n_trials):
 
             # If the current trial is a null trial, or is a localizer trial, don't make an evidence array
             if self.design.iloc[trial_n]['null_trial'] or self.design.iloc[trial_n]['block_type'] == 'localizer':
-                self.trial_arrays.append(None)
                 continue
 
-            if self.design.iloc[trial_n]['block'] == 3:
-                # In the first block, we start out with very easy trials, and make it easier every 4 trials (total 16
-                #  trials).
-                if self.design.iloc[trial_n]['block_trial_ID'] % 4 == 0:
-                    current_difficulty = (current_difficulty[0]-0.05, current_difficulty[1]+0.05)
+            # Evidence of trials in adaptive blocks is made just before they run (see prepare_adaptive_trial)
+            if self.design.iloc[trial_n]['block'] in self.adaptive_blocks:
+                continue
 
-                prop_correct_this_trial = current_difficulty[0]
-                prop_incorrect_this_trial = current_difficulty[1]
-            else:
-                prop_correct_this_trial = prop_correct
-                prop_incorrect_this_trial = prop_incorrect
-
-            corr_answer_this_trial = self.correct_answers[trial_n]  # shortcut
-
-            # Ensure that, at the end of the trial, there is more evidence for the correct choice alternative than for
-            # any of the other choice alternatives
-            good_evidence_streams = False
-            while not good_evidence_streams:
-                evidence_streams_this_trial = []
-                total_evidence_per_flasher = []
-                for i in range(self.n_flashers):
-
-                    # First, create initial evidence stream
-                    if i == corr_answer_this_trial:
-                        evidence_stream_this_flasher = np.random.binomial(n=1, p=prop_correct_this_trial,
-                                                                          size=n_increments).astype(
-                            np.int8)
-                    else:
-                        evidence_stream_this_flasher = np.random.binomial(n=1, p=prop_incorrect_this_trial,
-                                                                          size=n_increments).astype(np.int8)
+            self.make_evidence(trial_n, prop_correct, prop_incorrect)
 
-                    # How many pieces of evidence are shown in total for this flasher?
-                    total_evidence_per_flasher.append(np.sum(evidence_stream_this_flasher))
+        # Create new mask to select only first frame of every increment
+        self.first_frame_idx = np.arange(0, mask_idx.shape[0], increment_length)
 
-                    # Repeat every increment for n_frames
-                    evidence_stream_this_flasher = np.repeat(evidence_stream_this_flasher, increment_length)
-                    evidence_stream_this_flasher[mask_idx] = 0  # add pause
+    def make_evidence(self, trial_n, prop_correct, prop_incorrect):
+        """ Makes the evidence arrays of a trial, and their cumulative sums """
 
-                    evidence_streams_this_trial.append(evidence_stream_this_flasher)
+        # Evidence per increment, such that at the end of the trial, there is at least as much evidence for the
+        # correct choice alternative as for any of the other choice alternatives (drawn directly from this
+        # conditional distribution, see EvidenceSampler)
+        increments = sample_increments(self.n_increments, prop_correct, prop_incorrect, self.n_flashers,
+                                       self.correct_answers[trial_n])
 
-                # Check if the evidence for the correct flasher is at least the evidence for each other flasher
-                total_evidence_per_flasher = np.array(total_evidence_per_flasher)
-                mask = np.ones(total_evidence_per_flasher.shape[0], np.bool)  # Create mask: compare correct to others
-                mask[corr_answer_this_trial] = 0
-                if (total_evidence_per_flasher[corr_answer_this_trial] >= total_evidence_per_flasher)[mask].all():
-                    good_evidence_streams = True
+        evidence_streams_this_trial = []
+        for increments_this_flasher in increments:
+            # Repeat every increment for n_frames
+            evidence_stream_this_flasher = np.repeat(increments_this_flasher,
+                                                     self.standard_parameters['increment_length'])
+            evidence_stream_this_flasher[self.mask_idx] = 0  # add pause
 
-            self.trial_arrays.append(evidence_streams_this_trial)
+            evidence_streams_this_trial.append(evidence_stream_this_flasher)
 
-        # Create new mask to select only first frame of every increment
-        self.first_frame_idx = np.arange(0, mask_idx.shape[0], increment_length)
+        self.trial_arrays[trial_n] = evidence_streams_this_trial
+        self.trial_difficulty[trial_n] = (prop_correct, prop_incorrect)
+
+        # Cumulative evidence per frame, so that the evidence shown at the response is a single lookup
+        self.trial_cumulative_evidence[trial_n] = cumulative_evidence(evidence_streams_this_trial)
+
+    def apply_difficulty(self, prop_correct, prop_incorrect, first_block):
+        """ Makes new evidence, at this difficulty, for all decision trials from first_block on (except those of
+        adaptive blocks) """
+        for trial_n in range(self.n_trials):
+            trial = self.design.iloc[trial_n]
+            if trial['block'] < first_block or trial['block'] in self.adaptive_blocks or trial['null_trial'] or \
+                    trial['block_type'] == 'localizer':
+                continue
+            self.make_evidence(trial_n, prop_correct, prop_incorrect)
+
+    def prepare_adaptive_trial(self, trial_n):
+        """ Makes the evidence of a trial in an adaptive block, at the most informative difficulty given all responses
+        so far. Cheap enough to run in a single frame of the previous trial's ITI """
+        self.make_evidence(trial_n, *self.adaptive_difficulty.next_difficulty())
+
+    def update_difficulty(self, trial_n, trial_object):
+        """ Updates the adaptive difficulty with the response on a trial of an adaptive block. Trials without a
+        response are ignored """
+        if trial_object.response_type in [1, 2]:
+            prop_correct, prop_incorrect = self.trial_difficulty[trial_n]
+            self.adaptive_difficulty.update(prop_correct - prop_incorrect, trial_object.response_type == 1)
 
     def run_localizer_trial(self, trial, phases, show_response_phase=False):
         """ Runs a single localizer trial """
@@ -1470,16 +1714,17 @@ class FlashPracticeSession(EyelinkSession):
                               'hand'' is expected. Trial n: %d, block n: 0' % (trial.response_modality,
                                                                                trial.trial_ID)))
 
-        trial_object = trial_pointer(ID=trial.trial_ID,
-                                     block_trial_ID=trial.block_trial_ID,
-                                     parameters={'correct_answer': trial.correct_answer,
-                                                 'cue': trial.cue,
-                                                 'trial_type': trial.trial_type,
-                                                 'show_response_phase': show_response_phase},
-                                     phase_durations=phases,
-                                     session=self,
-                                     screen=self.screen,
-                                     tracker=self.tracker)
+        trial_object = self.trial_pool.get(trial_pointer,
+                                           ID=trial.trial_ID,
+                                           block_trial_ID=trial.block_trial_ID,
+                                           parameters={'correct_answer': trial.correct_answer,
+                                                       'cue': trial.cue,
+                                                       'trial_type': trial.trial_type,
+                                                       'show_response_phase': show_response_phase},
+                                           phase_durations=phases,
+                                           session=self,
+                                           screen=self.screen,
+                                           tracker=self.tracker)
         trial_object.run()
 
         return trial_object
@@ -1503,27 +1748,40 @@ class FlashPracticeSession(EyelinkSession):
         # In a limbic trial, prepare / update feedback
         if 'limbic' in trial.block_type:
             if this_trial_type in [0, 1]:  # Neutral condition
-                self.feedback_text_objects[1].text = self.feedback_txt[1]
+                self.feedback_text_objects[1] = self.correct_feedback_object
             elif this_trial_type in [2, 5]:  # Compatible cue condition
-                self.feedback_text_objects[1].text = self.feedback_txt[1] + ' +8\n' + self.feedback_txt[6] + ' %d' % (
-                    self.participant_score + 8)
+                self.score_feedback_objects[8].set_score(self.participant_score + 8)
+                self.feedback_text_objects[1] = self.score_feedback_objects[8]
             elif this_trial_type in [3, 4]:  # Incompatible cue condition
-                self.feedback_text_objects[1].text = self.feedback_txt[1] + ' +2\n' + self.feedback_txt[6] + ' %d' % (
-                    self.participant_score + 2)
-
-        trial_object = trial_pointer(ID=trial.trial_ID,
-                                     block_trial_ID=trial.block_trial_ID,
-                                     parameters={'trial_evidence_arrays': self.trial_arrays[trial.trial_ID],
-                                                 'correct_answer': trial.correct_answer.astype(int),
-                                                 'cue': trial.cue,
-                                                 'trial_type': trial.trial_type},
-                                     phase_durations=phases,
-                                     session=self,
-                                     screen=self.screen,
-                                     tracker=self.tracker)
+                self.score_feedback_objects[2].set_score(self.participant_score + 2)
+                self.feedback_text_objects[1] = self.score_feedback_objects[2]
+
+        if trial.block in self.adaptive_blocks and self.trial_difficulty[trial.trial_ID] is None:
+            # Not prepared in the ITI of the previous trial (e.g. the first trial of the block)
+            self.prepare_adaptive_trial(trial.trial_ID)
+
+        trial_object = self.trial_pool.get(trial_pointer,
+                                           ID=trial.trial_ID,
+                                           block_trial_ID=trial.block_trial_ID,
+                                           parameters={'trial_evidence_arrays': self.trial_arrays[trial.trial_ID],
+                                                       'correct_answer': trial.correct_answer.astype(int),
+                                                       'cue': trial.cue,
+                                                       'trial_type': trial.trial_type},
+                                           phase_durations=phases,
+                                           session=self,
+                                           screen=self.screen,
+                                           tracker=self.tracker)
 
         trial_object.n_TRs = 3  # Allow skipping of ITI (not really necessary in practice sess)
+        if trial.block in self.adaptive_blocks:
+            # In the ITI, update the difficulty with the response, and prepare the next trial of the block
+            prefetch_steps = [partial(self.update_difficulty, trial.trial_ID, trial_object)]
+            next_ID = trial.trial_ID + 1
+            if next_ID < self.n_trials and self.design.iloc[next_ID]['block'] == trial.block:
+                prefetch_steps.append(partial(self.prepare_adaptive_trial, next_ID))
+            self.schedule_prefetch(prefetch_steps)
         trial_object.run()
+        self.finish_prefetch()
 
         # If the response given is correct, update scores
         if 'limbic' in trial.block_type and trial_object.response_type == 1:
@@ -1563,6 +1821,16 @@ class FlashPracticeSession(EyelinkSession):
     def run(self):
         """ Run the trials that were prepared. The experimental design must be loaded. """
 
+        # From here on, key presses and scanner pulses are read from the polling thread. Anything before (such as the
+        # sync pulse launchScan waited for) is discarded. The scanner emulator of launchScan (a SyncGenerator) injects
+        # its pulses into psychopy.event, where the ioHub backend does not read keys otherwise
+        if hasattr(self.scanner, 'sync'):
+            self.input_poller.emulated_keys = (self.scanner.sync, )
+        self.input_poller.resume()
+
+        # No garbage collection during trial phases 1-6 from here on
+        self.setup_gc_control()
+
         # Show DEBUG screen first, if we're in debug mode.
         if self.subject_initials == 'DEBUG':
             self.current_instruction = self.debug_screen
@@ -1592,13 +1860,17 @@ class FlashPracticeSession(EyelinkSession):
             trial_handler = data.TrialHandler(data.importConditions(path), nReps=1, method='sequential')
             self.exp_handler.addLoop(trial_handler)
 
-            # Reset all feedback objects of which the text is dynamically changed
-            # text (SAT after limbic might otherwise show feedback points)
-            self.feedback_text_objects[1].text = 'Correct!'
+            # Reset all feedback objects that are dynamically swapped (SAT after limbic might otherwise show
+            # feedback points)
+            self.feedback_text_objects[1] = self.correct_feedback_object
 
             # It is useful to save the last trial ID for the current block.
             self.last_ID_this_block = self.design.loc[self.design['block'] == self.current_block, 'block_trial_ID'].iloc[-1]
 
+            # Every block is a separate scanner run
+            self.pulse_recorder.start_block(self.current_block)
+            self.drift_estimator.start_block(self.current_block)
+
             # Loop over block trials
             for trial in trial_handler:
 
@@ -1642,23 +1914,36 @@ class FlashPracticeSession(EyelinkSession):
                         trial_handler.addData('evidence stream ' + str(flasher),
                                               self.trial_arrays[trial.trial_ID][flasher][self.first_frame_idx])
                     trial_handler.addData('evidence shown at rt',
-                                          trial_object.evidence_shown / self.standard_parameters['flash_length'])
+                                          evidence_at_frame(self.trial_cumulative_evidence[trial.trial_ID],
+                                                            trial_object.n_stimulus_frames) /
+                                          self.standard_parameters['flash_length'])
+                    trial_handler.addData('increments shortened by dropped frames',
+                                          trial_object.shortened_increments)
+                    trial_handler.addData('blinks', trial_object.n_blinks)
+                    trial_handler.addData('prop_correct', self.trial_difficulty[trial.trial_ID][0])
+                    trial_handler.addData('prop_incorrect', self.trial_difficulty[trial.trial_ID][1])
 
                 # Save all data (only in non-null trials)
                 trial_handler.addData('rt', trial_object.response_time)
                 trial_handler.addData('response', trial_object.response)
                 trial_handler.addData('response type', trial_object.response_type)
                 trial_handler.addData('correct', trial_object.response_type == 1)
-                trial_handler.addData('feedback', self.feedback_text_objects[trial_object.feedback_type].text)
+                trial_handler.addData('feedback', trial_object.feedback_text)
                 trial_handler.addData('score', self.participant_score)
 
-                # Trial finished, so on to the next entry
+                # Trial finished, so on to the next entry. The trial object can be reused
                 self.exp_handler.nextEntry()
+                self.trial_pool.release(trial_object)
 
                 # Check for stop flag in trial loop
                 if self.stopped:
                     break
 
+                # An adaptive block ends as soon as the difficulty for the target accuracy is known
+                if self.current_block in self.adaptive_blocks and self.adaptive_difficulty.converged():
+                    print('Adaptive difficulty converged after %d trials' % len(self.adaptive_difficulty.history))
+                    break
+
             # Check for stop flag in block loop
             if self.stopped:
                 break
@@ -1666,6 +1951,20 @@ class FlashPracticeSession(EyelinkSession):
             if self.stop_instructions:
                 continue
 
+            self.drift_estimator.end_block()
+            print(self.drift_estimator.report())
+
+            if self.current_block in self.adaptive_blocks:
+                estimate = self.adaptive_difficulty.estimate()
+                self.outputDict['adaptive_difficulty'] = dict(estimate, history=self.adaptive_difficulty.history)
+                print('Accuracy %.2f expected at prop_correct %.3f, prop_incorrect %.3f (%d trials)' % (
+                    self.adaptive_difficulty.target, estimate['target_difficulty'][0],
+                    estimate['target_difficulty'][1], estimate['n_trials']))
+
+                # The later blocks are played at the difficulty found
+                if estimate['n_trials'] > 0:
+                    self.apply_difficulty(*estimate['target_difficulty'], first_block=self.current_block + 1)
+
             # Update block
             if self.current_block < 7:
                 self.current_block += 1
@@ -1688,6 +1987,9 @@ class FlashPracticeSession(EyelinkSession):
 
         self.exp_handler.saveAsPickle(output_fn_dat)
         self.exp_handler.saveAsWideText(output_fn_dat + '.csv')
+        self.pulse_recorder.to_dataframe().to_csv(output_fn_frames + '_pulses.csv', index=False)
+        pd.DataFrame(self.gc_pauses, columns=['time', 'frame_n', 'duration', 'generation', 'collected']).to_csv(
+            output_fn_frames + '_gc_pauses.csv', index=False)
 
         if self.screen.recordFrameIntervals:
 
@@ -1703,13 +2005,18 @@ class FlashPracticeSession(EyelinkSession):
             dist_string = msg % (m, sd, m - 2.58 * sd, m + 2.58 * sd)
             n_total = len(intervals_ms)
             n_dropped = sum(intervals_ms > (1.5 * m))
-            msg = "Dropped/Frames = %i/%i = %.3f%%"
-            dropped_string = msg % (n_dropped, n_total, 100 * n_dropped / float(n_total))
+
+            # Frames during which the garbage collector ran
+            gc_frames = [pause[1] for pause in self.gc_pauses if 0 <= pause[1] < n_total]
+            n_dropped_gc = sum(intervals_ms[gc_frames] > (1.5 * m))
+            msg = "Dropped/Frames = %i/%i = %.3f%% (%i during GC)"
+            dropped_string = msg % (n_dropped, n_total, 100 * n_dropped / float(n_total), n_dropped_gc)
 
             # plot the frame intervals
             pylab.figure(figsize=[12, 8])
             pylab.subplot(1, 2, 1)
             pylab.plot(intervals_ms, '-')
+            pylab.plot(gc_frames, intervals_ms[gc_frames], 'r.')  # garbage collections
             pylab.ylabel('t (ms)')
             pylab.xlabel('frame N')
             pylab.title(dropped_string)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 # encoding: utf-8
-from psychopy import visual
+from __future__ import division
+from psychopy import visual, core
 import numpy as np
 
 
@@ -8,6 +9,11 @@ class FlashStim(object):
     """
     Initializes and draws flashing circles stimuli.
 
+    The evidence arrays are played back by time rather than by counting frames: every frame, the predicted
+    presentation time (the next screen refresh after the last flip) determines which frame of the evidence arrays is
+    shown. If a frame is dropped, the frames that should have been shown in the meantime are skipped (and recorded in
+    dropped_frames), so that the stream stays in time.
+
     Parameters
     ----------
     screen: psychopy.visual.Window instance
@@ -25,7 +31,12 @@ class FlashStim(object):
         self.session = session
         self.n_flashers = n_flashers
         self.trial_evidence_arrays = None
-        self.shown_opacities = np.zeros(n_flashers)
+
+        # Playback: set frame_period to the measured refresh period before use
+        self.frame_period = 1 / 60
+        self.onset_time = None
+        self.last_frame_n = -1
+        self.dropped_frames = []
 
         self.flasher_objects = []
         for i in range(self.n_flashers):
@@ -35,6 +46,44 @@ class FlashStim(object):
                                                       lineColorSpace='rgb', fillColor=[1, 1, 1], fillColorSpace='rgb',
                                                       opacity=1, depth=-1.0, interpolate=True))
 
+    def start_playback(self):
+        """ Starts playing the evidence arrays from the beginning; the next frame drawn is the stimulus onset """
+        self.onset_time = None
+        self.last_frame_n = -1
+        self.dropped_frames = []
+
+    def predict_flip_time(self):
+        """ Predicted presentation time (psychopy.core time) of the frame that is currently being drawn """
+        last_flip_time = self.session.last_flip_time
+        now = core.getTime()
+        if last_flip_time is None:
+            return now
+
+        # If drawing started late, the next refresh we can make is a later one
+        n_periods = max(1, np.ceil((now - last_flip_time) / self.frame_period))
+        return last_flip_time + n_periods * self.frame_period
+
+    def playback_frame(self):
+        """ Returns the frame of the evidence arrays to draw now, based on the time since the stimulus onset """
+        flip_time = self.predict_flip_time()
+        if self.onset_time is None:
+            self.onset_time = flip_time
+
+        frame_n = max(self.last_frame_n, int(round((flip_time - self.onset_time) / self.frame_period)))
+        if frame_n > self.last_frame_n + 1:
+            self.dropped_frames.extend(range(self.last_frame_n + 1, frame_n))
+        self.last_frame_n = frame_n
+        return frame_n
+
+    def n_frames_played(self):
+        """ Number of frames of the evidence arrays played so far (including those skipped by dropped frames) """
+        return self.last_frame_n + 1
+
+    def shortened_increments(self):
+        """ Increments of which at least one frame was skipped because of a dropped frame """
+        increment_length = self.session.standard_parameters['increment_length']
+        return sorted(set(frame_n // increment_length for frame_n in self.dropped_frames))
+
     def draw(self, frame_n, continuous=0):
         """
         Draws the flashing circles on the screen.
@@ -73,10 +122,10 @@ class FlashStim(object):
             if self.trial_evidence_arrays is None:
                 raise(AttributeError('Oops! FlashStim does not have an evidence array yet... Did you initialize the '
                                      'FlashTrial correctly?'))
-            # Real stimulus
+            # Real stimulus. Beyond the end of the evidence arrays (only after a long stall), nothing is shown
             for i in range(self.n_flashers):
-                self.shown_opacities[i] = self.trial_evidence_arrays[i][frame_n]
-                self.flasher_objects[i].opacity = self.trial_evidence_arrays[i][frame_n]
+                if frame_n < self.trial_evidence_arrays[i].shape[0]:
+                    self.flasher_objects[i].opacity = self.trial_evidence_arrays[i][frame_n]
+                else:
+                    self.flasher_objects[i].opacity = 0
                 self.flasher_objects[i].draw()
-
-            return self.shown_opacities
\ No newline at end of file
@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 # encoding: utf-8
 from exp_tools import Trial
-from psychopy import event
 import numpy as np
 from scipy import stats
 
@@ -58,10 +57,23 @@ class FlashTrial(Trial):
         Reaction time. Note that, for the child class FlashTrialSaccade, this is NOT ACCURATE!
     """
 
+    __slots__ = ('block_trial_ID', 'frame_n', 'response', 'draw_crosses', 'response_type', 'feedback_type', 'stimulus',
+                 'feedback_text_objects', 'n_stimulus_frames', 'shortened_increments', 'cuetext', 'cue',
+                 'late_responses', 'n_TRs', 'run_time', 't_time', 'fix1_time', 'cue_time', 'fix2_time', 'stimulus_time',
+                 'post_stimulus_time', 'feedback_time', 'ITI_time', 'response_time', 'n_blinks', 'blink_count_start',
+                 'feedback_text', 'fixation')
+
     def __init__(self, ID, block_trial_ID=0, parameters={}, phase_durations=[], session=None, screen=None,
                  tracker=None):
         super(FlashTrial, self).__init__(parameters=parameters, phase_durations=phase_durations, session=session,
                                          screen=screen, tracker=tracker)
+        self.stimulus = self.session.stimulus
+        self.reset(ID, block_trial_ID=block_trial_ID, parameters=parameters, phase_durations=phase_durations)
+
+    def reset(self, ID, block_trial_ID=0, parameters={}, phase_durations=[]):
+        """ (Re)sets all per-trial state, so that this object can be reused for a new trial """
+
+        super(FlashTrial, self).reset(parameters=parameters, phase_durations=phase_durations)
         self.ID = ID
         self.block_trial_ID = block_trial_ID
         self.frame_n = -1
@@ -70,12 +82,16 @@ class FlashTrial(Trial):
 
         self.response_type = 0   # 0 = no response, 1 = correct, 2 = wrong, 3 = too early
         self.feedback_type = 0   # 0 = too late, 1 = correct, 2 = wrong, 3 = too early
-        self.stimulus = self.session.stimulus
+
+        # The session may swap feedback objects for the next trial while this one is in its ITI: keep our own
+        self.feedback_text_objects = list(self.session.feedback_text_objects)
+        self.feedback_text = None   # Text of the feedback shown, kept when it is shown (the score objects are shared)
         self.stimulus.trial_evidence_arrays = parameters['trial_evidence_arrays']
-        self.evidence_shown = np.repeat([0], self.session.n_flashers)
-        self.total_increments = 0
+        self.n_stimulus_frames = 0   # Number of stimulus frames shown before the response
+        self.shortened_increments = []   # Stimulus increments shortened by dropped frames
         self.cuetext = None
         self.late_responses = []
+        self.fixation = None   # Median gaze during the fixation crosses (see track_fixation)
 
         # keep track of number of TRs recorded. Only end trial if at least 2 TRs are recorded (3 TRs per trial).
         self.n_TRs = 0
@@ -90,6 +106,9 @@ class FlashTrial(Trial):
                     self.cue = self.session.arrow_stimuli[1]
                 elif self.cuetext == 'NEU':
                     self.cue = self.session.arrow_stimuli[2]
+            elif self.cuetext in self.session.cue_objects:
+                # Pre-rendered text cue (SPD/ACC)
+                self.cue = self.session.cue_objects[self.cuetext]
             else:
                 self.cue = self.session.cue_object
                 self.cue.text = self.cuetext
@@ -104,49 +123,40 @@ class FlashTrial(Trial):
             = self.feedback_time = self.ITI_time = 0.0
         self.response_time = None
 
+        # Blinks during the trial (counted by the session's blink monitor, if any)
+        self.n_blinks = 0
+        self.blink_count_start = 0
+
     def draw(self):
-        """ Draws the current frame """
+        """ Draws the current frame. The fixation cross and target crosses are pre-rendered layers, and static screens
+        (scanner wait screen, cue, feedback) are pre-composed scenes (see StaticLayer) """
 
         if self.phase == 0:   # waiting for scanner-time
             if self.block_trial_ID == 0:
-                self.session.scanner_wait_screen.draw()  # Only show this before the first trial
+                self.session.scenes.draw((self.session.scanner_wait_screen, ))  # Only show this before the first trial
             else:
-                self.session.fixation_cross.draw()
-                if self.draw_crosses:
-                    self.session.crosses[0].draw()
-                    self.session.crosses[1].draw()
+                self.session.fixation_layers[self.draw_crosses].draw()
         elif self.phase == 1:  # Pre-cue fix cross
-            self.session.fixation_cross.draw()
-            if self.draw_crosses:
-                self.session.crosses[0].draw()
-                self.session.crosses[1].draw()
-                # if not os.path.isfile('screenshot_trial_fixcross.png'):
+            self.session.fixation_layers[self.draw_crosses].draw()
+            # if not os.path.isfile('screenshot_trial_fixcross.png'):
             #     self.session.screen.flip()
             #     self.session.screen.getMovieFrame()
             #     self.session.screen.saveMovieFrames('screenshot_trial_fixcross.png')
         elif self.phase == 2:  # Cue
-            self.cue.draw()
             if self.draw_crosses:
-                self.session.crosses[0].draw()
-                self.session.crosses[1].draw()
-                # if not os.path.isfile('screenshot_trial_cue_' + self.cuetext + '.png'):
+                self.session.scenes.draw((self.session.crosses_layer, self.cue))
+            else:
+                self.session.scenes.draw((self.cue, ))
+            # if not os.path.isfile('screenshot_trial_cue_' + self.cuetext + '.png'):
             #     self.session.screen.flip()
             #     self.session.screen.getMovieFrame()
             #     self.session.screen.saveMovieFrames('screenshot_trial_cue_' + self.cuetext + '.png')
 
         elif self.phase == 3:  # post-cue fix cross
-            self.session.fixation_cross.draw()
-            if self.draw_crosses:
-                self.session.crosses[0].draw()
-                self.session.crosses[1].draw()
+            self.session.fixation_layers[self.draw_crosses].draw()
         elif self.phase == 4:  # stimulus
-            self.session.fixation_cross.draw()
-            shown_opacities = self.stimulus.draw(frame_n=self.frame_n)
-            self.evidence_shown = self.evidence_shown + shown_opacities
-            self.total_increments += 1
-            if self.draw_crosses:
-                self.session.crosses[0].draw()
-                self.session.crosses[1].draw()
+            self.session.fixation_layers[self.draw_crosses].draw()
+            self.stimulus.draw(frame_n=self.stimulus.playback_frame())
             # if self.stimulus.trial_evidence_arrays[0][self.frame_n] == 1 and self.stimulus.trial_evidence_arrays[1][
             #     self.frame_n] == 1:
             #     if not os.path.isfile('screenshot_trial_stim.png'):
@@ -155,26 +165,20 @@ class FlashTrial(Trial):
             #         self.session.screen.saveMovieFrames('screenshot_trial_stim.png')
 
         elif self.phase == 5:  # post-stimulus fill time
-            self.session.fixation_cross.draw()
-            self.stimulus.draw(frame_n=self.frame_n, continuous=False)  # Continuous creates constant streams of flashes
-            if self.draw_crosses:
-                self.session.crosses[0].draw()
-                self.session.crosses[1].draw()
-        elif self.phase == 6:  # feedback
-            self.session.feedback_text_objects[self.feedback_type].draw()
+            self.session.fixation_layers[self.draw_crosses].draw()
+            self.stimulus.draw(frame_n=self.stimulus.playback_frame(), continuous=False)  # Continuous creates constant streams of flashes
+        elif self.phase == 6:  # feedback (score feedback is not a composed scene: its parts are drawn one by one)
             if self.draw_crosses:
-                self.session.crosses[0].draw()
-                self.session.crosses[1].draw()
+                self.session.scenes.draw((self.session.crosses_layer, self.feedback_text_objects[self.feedback_type]))
+            else:
+                self.session.scenes.draw((self.feedback_text_objects[self.feedback_type], ))
             # fb_name = self.session.feedback_text_objects[self.feedback_type].text
             # if not os.path.isfile('screenshot_trial_feedback_' + fb_name[0] + fb_name[-2] + '.png'):
             #     self.session.screen.flip()
             #     self.session.screen.getMovieFrame()
             #     self.session.screen.saveMovieFrames('screenshot_trial_feedback_' + fb_name[0] + fb_name[-2] + '.png')
         elif self.phase == 7:
-            self.session.fixation_cross.draw()
-            if self.draw_crosses:
-                self.session.crosses[0].draw()
-                self.session.crosses[1].draw()
+            self.session.fixation_layers[self.draw_crosses].draw()
 
         super(FlashTrial, self).draw()
 
@@ -184,12 +188,45 @@ class FlashTrial(Trial):
 
     def phase_forward(self):
         """ Call the superclass phase_forward method first, and reset the current frame number to 0 """
+        if self.phase == 4:
+            # The stimulus phase ends (by a response or time-out)
+            self.n_stimulus_frames = self.stimulus.n_frames_played()
+            self.shortened_increments = self.stimulus.shortened_increments()
         super(FlashTrial, self).phase_forward()
         self.phase_time = self.session.clock.getTime()
         self.frame_n = 0
 
+        # Fixation ends with the stimulus: summarize this trial's gaze samples for the drift estimate
+        if self.phase == 4:
+            self.fixation = self.session.drift_estimator.end_trial()
+
+        # The (post-)stimulus phase plays the evidence arrays from their start
+        if self.phase in [4, 5]:
+            self.stimulus.start_playback()
+        elif self.phase == 6:
+            # The session sets the score of the next trial on the same ScoreFeedback objects during our ITI
+            self.feedback_text = self.feedback_text_objects[self.feedback_type].text
+
+    def gaze_masked(self):
+        """ Whether gaze is unusable now, because of a blink or a loss of tracking (see the session's blink monitor) """
+        return self.session.blink_monitor is not None and self.session.blink_monitor.masked()
+
+    def track_fixation(self):
+        """ Gaze during the fixation crosses (phases 1 and 3) feeds the session's drift estimate, whatever the
+        response modality. Called every frame """
+        if self.tracker and self.phase in [1, 3] and not self.gaze_masked():
+            self.session.drift_estimator.add_sample(self.session.eye_pos())
+
+    def stop(self):
+        if self.session.blink_monitor is not None:
+            self.n_blinks = self.session.blink_monitor.n_blinks - self.blink_count_start
+        super(FlashTrial, self).stop()
+
     def run(self):
         super(FlashTrial, self).run()
+        if self.session.blink_monitor is not None:
+            self.blink_count_start = self.session.blink_monitor.n_blinks
+        self.session.drift_estimator.start_trial()   # drop samples of a trial that was stopped during fixation
 
         while not self.stopped:
             self.frame_n += 1
@@ -244,6 +281,10 @@ class FlashTrial(Trial):
             if self.phase == 7:
                 self.ITI_time = self.session.clock.getTime()
 
+                # Use idle time to prepare the next trial, but not just before the pulse that may end the ITI
+                if not self.pulse_due():
+                    self.session.prefetch_step()
+
                 if self.block_trial_ID == self.session.last_ID_this_block or self.session.scanner == 'n':
                     # If this is the last trial of the block, show the FULL ITI
                     print('Trial number %d (block trial %d)' % (self.ID, self.block_trial_ID))
@@ -259,6 +300,8 @@ class FlashTrial(Trial):
 
             # events and draw
             if not self.stopped:
+                self.check_missed_pulse()
+                self.track_fixation()
                 self.event()
                 self.draw()
 
@@ -273,11 +316,11 @@ class FlashTrialSaccade(FlashTrial):
     Currently, can only handle TWO flashers / choice options!
     """
 
-    def __init__(self, ID, block_trial_ID=0, parameters={}, phase_durations=[], session=None, screen=None,
-                 tracker=None):
-        super(FlashTrialSaccade, self).__init__(ID, block_trial_ID=block_trial_ID, parameters=parameters,
-                                                phase_durations=phase_durations,
-                                                session=session, screen=screen, tracker=tracker)
+    __slots__ = ('correct_direction', 'directions_verbose', 'eye_movement_detected_in_phase', 'eye_pos_start_phase')
+
+    def reset(self, ID, block_trial_ID=0, parameters={}, phase_durations=[]):
+        super(FlashTrialSaccade, self).reset(ID, block_trial_ID=block_trial_ID, parameters=parameters,
+                                             phase_durations=phase_durations)
 
         self.correct_direction = parameters['correct_answer']
         self.directions_verbose = ['left saccade', 'right saccade']
@@ -289,7 +332,7 @@ class FlashTrialSaccade(FlashTrial):
         """ Checks for saccades as answers and keyboard responses for escape / scanner pulse """
 
         # First check keyboard responses for kill signals and/or scanner pulses
-        for i, (ev, ev_time) in enumerate(event.getKeys(timeStamped=self.session.clock)):
+        for i, (ev, ev_time) in enumerate(self.session.input_poller.get_keys()):
 
             if len(ev) > 0:
                 if ev in ['esc', 'escape']:
@@ -304,17 +347,26 @@ class FlashTrialSaccade(FlashTrial):
                     print('Trial canceled by user')
 
                 elif ev == 't':  # Scanner pulse
-                    self.events.append([99, ev_time, 'pulse'])
-                    self.n_TRs += 1
+                    self.handle_pulse(ev_time)
 
-                    if self.phase == 0:
-                        self.phase_forward()
+        # Gaze is not used during blinks (and while tracking is lost): the lid moves the measured gaze position
+        if self.gaze_masked():
+            return
 
         # Make sure to get eye position at the start of each phase
         if self.eye_pos_start_phase[self.phase] is None:
+            if self.phase == 4:
+                # The median gaze during fixation of this trial is a more robust reference for the response than the
+                # single sample at stimulus onset (falls back to that sample if there were too few fixation samples)
+                if self.fixation is not None:
+                    self.eye_pos_start_phase[4] = self.fixation
+
+        if self.eye_pos_start_phase[self.phase] is None:
+            # Distance from where fixation is expected, i.e. the center corrected for drift of the tracker
             eyepos = self.session.eye_pos()
-            distance_from_center = np.divide(np.sqrt((eyepos[0]-self.session.screen_pix_size[0]/2)**2 +
-                                                     (eyepos[1]-self.session.screen_pix_size[1]/2)**2),
+            expected = self.session.drift_estimator.expected_fixation()
+            distance_from_center = np.divide(np.sqrt((eyepos[0]-expected[0])**2 +
+                                                     (eyepos[1]-expected[1])**2),
                                              self.session.pixels_per_degree)
             if distance_from_center < 6:
                 # If the distance from the center is less than 6 degrees, we are probably not in a blink. We can
@@ -420,11 +472,11 @@ class FlashTrialKeyboard(FlashTrial):
     FlashTrial on which participants respond with a keypress
     """
 
-    def __init__(self, ID, block_trial_ID=0, parameters={}, phase_durations=[], session=None, screen=None,
-                 tracker=None):
-        super(FlashTrialKeyboard, self).__init__(ID, block_trial_ID=block_trial_ID, parameters=parameters,
-                                                 phase_durations=phase_durations,
-                                                 session=session, screen=screen, tracker=tracker)
+    __slots__ = ('correct_answer', 'correct_key')
+
+    def reset(self, ID, block_trial_ID=0, parameters={}, phase_durations=[]):
+        super(FlashTrialKeyboard, self).reset(ID, block_trial_ID=block_trial_ID, parameters=parameters,
+                                              phase_durations=phase_durations)
 
         self.correct_answer = parameters['correct_answer']
         self.correct_key = self.session.response_keys[self.correct_answer]
@@ -432,7 +484,7 @@ class FlashTrialKeyboard(FlashTrial):
     def event(self):
         """ Checks for the keyboard responses only """
 
-        for i, (ev, ev_time) in enumerate(event.getKeys(timeStamped=self.session.clock)):
+        for i, (ev, ev_time) in enumerate(self.session.input_poller.get_keys()):
             # ev_time is the event timestamp relative to the Session Clock
 
             if len(ev) > 0:
@@ -519,8 +571,4 @@ class FlashTrialKeyboard(FlashTrial):
                         self.events.append([ev, ev_time, 'late keypress (during ITI)'])
 
                 elif ev == 't':  # Scanner pulse
-                    self.events.append([99, ev_time, 'pulse'])
-                    self.n_TRs += 1
-
-                    if self.phase == 0:
-                        self.phase_forward()
+                    self.handle_pulse(ev_time)
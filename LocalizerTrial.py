@@ -1,5 +1,4 @@
 from exp_tools import Trial
-from psychopy import event
 import numpy as np
 
 
@@ -40,10 +39,21 @@ class LocalizerTrial(Trial):
         Passed on to parent class
     """
 
+    __slots__ = ('block_trial_ID', 'frame_n', 'response', 'correct_answer', 'response_type', 'feedback_type', 'cue',
+                 'feedback_text_objects', 'show_response_phase', 'n_TRs', 'run_time', 't_time', 'fix1_time',
+                 'cue_time', 'fix2_time', 'stimulus_time', 'post_stimulus_time', 'feedback_time', 'ITI_time',
+                 'response_time')
+
     def __init__(self, ID, block_trial_ID=0, parameters={}, phase_durations=[], session=None, screen=None,
                  tracker=None):
         super(LocalizerTrial, self).__init__(parameters=parameters, phase_durations=phase_durations, session=session,
                                              screen=screen, tracker=tracker)
+        self.reset(ID, block_trial_ID=block_trial_ID, parameters=parameters, phase_durations=phase_durations)
+
+    def reset(self, ID, block_trial_ID=0, parameters={}, phase_durations=[]):
+        """ (Re)sets all per-trial state, so that this object can be reused for a new trial """
+
+        super(LocalizerTrial, self).reset(parameters=parameters, phase_durations=phase_durations)
         self.ID = ID
         self.frame_n = -1
         self.response = None
@@ -54,6 +64,9 @@ class LocalizerTrial(Trial):
         self.feedback_type = 0   # 0 = too slow, 1 = correct, 2 = wrong, 3 = too fast, 4 = early phase
         self.cue = self.session.arrow_stimuli[parameters['correct_answer']]
 
+        # The session may swap feedback objects for the next trial while this one is in its ITI: keep our own
+        self.feedback_text_objects = list(self.session.feedback_text_objects)
+
         # Should we indicate when a response should be made?
         self.show_response_phase = False
         if 'show_response_phase' in parameters:
@@ -73,39 +86,31 @@ class LocalizerTrial(Trial):
         self.response_time = None
 
     def draw(self):
-        """ Draws the current frame """
+        """ Draws the current frame. The fixation cross and target crosses are pre-rendered layers, and static screens
+        (scanner wait screen, cue, feedback) are pre-composed scenes (see StaticLayer) """
 
         if self.phase == 0:   # waiting for scanner-time
             if self.block_trial_ID == 0:
-                self.session.scanner_wait_screen.draw()
+                self.session.scenes.draw((self.session.scanner_wait_screen, ))
             else:
-                self.session.fixation_cross.draw()
-                self.session.crosses[0].draw()
-                self.session.crosses[1].draw()
+                self.session.fixation_layers[True].draw()
         elif self.phase == 1:  # Pre-cue fix cross
-            self.session.fixation_cross.draw()
-            self.session.crosses[0].draw()
-            self.session.crosses[1].draw()
+            self.session.fixation_layers[True].draw()
 
             # self.session.screen.getMovieFrame()  # Defaults to front buffer, I.e. what's on screen now.
             # self.session.screen.saveMovieFrames('screenshot_localizer_fixcross.png')
         elif self.phase == 2:  # Cue
-            self.cue.draw()
-            self.session.crosses[0].draw()
-            self.session.crosses[1].draw()
+            self.session.scenes.draw((self.session.crosses_layer, self.cue))
             # if not os.path.isfile('screenshot_localizer_cue_' + str(self.correct_answer) + '.png'):
             #     self.session.screen.flip()
             #     self.session.screen.getMovieFrame()
             #     self.session.screen.saveMovieFrames('screenshot_localizer_cue_' + str(self.correct_answer) + '.png')
 
         elif self.phase == 3:  # post-cue fix cross
-            self.session.fixation_cross.draw()
-            self.session.crosses[0].draw()
-            self.session.crosses[1].draw()
+            self.session.fixation_layers[True].draw()
 
         elif self.phase == 4 or self.phase == 5:
-            self.session.crosses[0].draw()
-            self.session.crosses[1].draw()
+            self.session.crosses_layer.draw()
 
             if self.show_response_phase:
                 self.session.show_response_phase_txt.draw()
@@ -113,13 +118,9 @@ class LocalizerTrial(Trial):
             # self.session.screen.getMovieFrame()
             # self.session.screen.saveMovieFrames('screenshot_localizer_blank_screen.png')
         elif self.phase == 6:
-            self.session.crosses[0].draw()
-            self.session.crosses[1].draw()
-            self.session.feedback_text_objects[self.feedback_type].draw()
+            self.session.scenes.draw((self.session.crosses_layer, self.feedback_text_objects[self.feedback_type]))
         elif self.phase == 7:
-            self.session.fixation_cross.draw()
-            self.session.crosses[0].draw()
-            self.session.crosses[1].draw()
+            self.session.fixation_layers[True].draw()
 
         super(LocalizerTrial, self).draw()
 
@@ -133,11 +134,26 @@ class LocalizerTrial(Trial):
         self.phase_time = self.session.clock.getTime()
         self.frame_n = 0
 
+        # Fixation ends with the response phase: summarize this trial's gaze samples for the drift estimate
+        if self.phase == 4:
+            self.session.drift_estimator.end_trial()
+
+    def gaze_masked(self):
+        """ Whether gaze is unusable now, because of a blink or a loss of tracking (see the session's blink monitor) """
+        return self.session.blink_monitor is not None and self.session.blink_monitor.masked()
+
+    def track_fixation(self):
+        """ Gaze during the fixation crosses (phases 1 and 3) feeds the session's drift estimate, whatever the
+        response modality. Called every frame """
+        if self.tracker and self.phase in [1, 3] and not self.gaze_masked():
+            self.session.drift_estimator.add_sample(self.session.eye_pos())
+
     def run(self):
         """
         Runs the LocalizerTrial
         """
         super(LocalizerTrial, self).run()
+        self.session.drift_estimator.start_trial()   # drop samples of a trial that was stopped during fixation
 
         while not self.stopped:
             self.frame_n += 1
@@ -192,6 +208,10 @@ class LocalizerTrial(Trial):
             if self.phase == 7:
                 self.ITI_time = self.session.clock.getTime()
 
+                # Use idle time to prepare the next trial, but not just before the pulse that may end the ITI
+                if not self.pulse_due():
+                    self.session.prefetch_step()
+
                 if self.block_trial_ID == self.session.last_ID_this_block or self.session.scanner == 'n':
                     # If this is the last trial of the block, show the FULL ITI
                     # print('Trial number %d (block trial %d)' % (self.ID, self.block_trial_ID))
@@ -207,6 +227,8 @@ class LocalizerTrial(Trial):
 
             # events and draw, but only if we haven't stopped yet
             if not self.stopped:
+                self.check_missed_pulse()
+                self.track_fixation()
                 self.event()
                 self.draw()
 
@@ -221,11 +243,12 @@ class LocalizerTrialSaccade(LocalizerTrial):
     Currently, can only handle TWO flashers / choice options!
     """
 
-    def __init__(self, ID, block_trial_ID=0, parameters={}, phase_durations=[], session=None, screen=None,
-                 tracker=None):
-        super(LocalizerTrialSaccade, self).__init__(ID, block_trial_ID=block_trial_ID, parameters=parameters,
-                                                    phase_durations=phase_durations,
-                                                    session=session, screen=screen, tracker=tracker)
+    __slots__ = ('correct_direction', 'directions_verbose', 'eye_movement_detected_in_phase', 'eye_pos_start_phase',
+                 'wrong_modality_answers')
+
+    def reset(self, ID, block_trial_ID=0, parameters={}, phase_durations=[]):
+        super(LocalizerTrialSaccade, self).reset(ID, block_trial_ID=block_trial_ID, parameters=parameters,
+                                                 phase_durations=phase_durations)
 
         self.correct_direction = parameters['correct_answer']
         self.directions_verbose = ['left saccade', 'right saccade']
@@ -312,7 +335,7 @@ class LocalizerTrialSaccade(LocalizerTrial):
                     # probably always be detected: drift correction?
 
         # Don't forget to check keyboard responses for kill signals and/or scanner pulses!
-        for i, (ev, ev_time) in enumerate(event.getKeys(timeStamped=self.session.clock)):
+        for i, (ev, ev_time) in enumerate(self.session.input_poller.get_keys()):
 
             if len(ev) > 0:
                 if ev in ['esc', 'escape']:
@@ -332,11 +355,7 @@ class LocalizerTrialSaccade(LocalizerTrial):
                     self.events.append([ev, ev_time, 'key response (wrong modality)'])
 
                 elif ev == 't':  # Scanner pulse
-                    self.events.append([99, ev_time, 'pulse'])
-                    self.n_TRs += 1
-
-                    if self.phase == 0:
-                        self.phase_forward()
+                    self.handle_pulse(ev_time)
 
     def phase_forward(self):
         """ Do everything the superclass does, but also reset current phase eye movement detection """
@@ -356,10 +375,11 @@ class LocalizerTrialKeyboard(LocalizerTrial):
     4. Too early phase
     """
 
-    def __init__(self, ID, block_trial_ID=0, parameters={}, phase_durations=[], session=None, screen=None, tracker=None):
-        super(LocalizerTrialKeyboard, self).__init__(ID, block_trial_ID=block_trial_ID, parameters=parameters,
-                                                     phase_durations=phase_durations,
-                                                     session=session, screen=screen, tracker=tracker)
+    __slots__ = ('correct_key', 'eye_movement_detected_in_phase', 'eye_pos_start_phase', 'wrong_modality_answers')
+
+    def reset(self, ID, block_trial_ID=0, parameters={}, phase_durations=[]):
+        super(LocalizerTrialKeyboard, self).reset(ID, block_trial_ID=block_trial_ID, parameters=parameters,
+                                                  phase_durations=phase_durations)
 
         self.correct_answer = parameters['correct_answer']
         self.correct_key = self.session.response_keys[self.correct_answer]
@@ -371,7 +391,7 @@ class LocalizerTrialKeyboard(LocalizerTrial):
     def event(self):
         """ Checks for the keyboard responses only """
 
-        for i, (ev, ev_time) in enumerate(event.getKeys(timeStamped=self.session.clock)):
+        for i, (ev, ev_time) in enumerate(self.session.input_poller.get_keys()):
             # ev_time is the event timestamp relative to the Session Clock
 
             if len(ev) > 0:
@@ -447,11 +467,7 @@ class LocalizerTrialKeyboard(LocalizerTrial):
                         self.events.append([ev, ev_time, 'late keypress (during ITI)'])
 
                 elif ev == 't':  # Scanner pulse
-                    self.events.append([99, ev_time, 'pulse'])
-                    self.n_TRs += 1
-
-                    if self.phase == 0:
-                        self.phase_forward()
+                    self.handle_pulse(ev_time)
 
         # Check for eye movements!
         if self.eye_pos_start_phase[self.phase] is None:
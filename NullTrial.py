@@ -1,5 +1,4 @@
 from exp_tools import Trial
-from psychopy import event
 
 
 class NullTrial(Trial):
@@ -27,10 +26,19 @@ class NullTrial(Trial):
         Passed on to parent class
     """
 
+    __slots__ = ('block_trial_ID', 'frame_n', 'response', 'draw_crosses', 'n_TRs', 'run_time', 't_time', 'fix1_time',
+                 'cue_time', 'fix2_time', 'stimulus_time', 'post_stimulus_time', 'feedback_time', 'ITI_time')
+
     def __init__(self, ID, block_trial_ID=0, parameters={}, phase_durations=[], session=None, screen=None,
                  tracker=None):
         super(NullTrial, self).__init__(parameters=parameters, phase_durations=phase_durations, session=session,
                                         screen=screen, tracker=tracker)
+        self.reset(ID, block_trial_ID=block_trial_ID, parameters=parameters, phase_durations=phase_durations)
+
+    def reset(self, ID, block_trial_ID=0, parameters={}, phase_durations=[]):
+        """ (Re)sets all per-trial state, so that this object can be reused for a new trial """
+
+        super(NullTrial, self).reset(parameters=parameters, phase_durations=phase_durations)
         self.ID = ID
         self.frame_n = -1
         self.response = None
@@ -45,20 +53,16 @@ class NullTrial(Trial):
           self.feedback_time = self.ITI_time = 0.0
 
     def draw(self):
-        """ Draws whatever should be drawn (fixation cross and maybe target crosses) """
-
-        if self.draw_crosses:
-            self.session.crosses[0].draw()
-            self.session.crosses[1].draw()
+        """ Draws whatever should be drawn (fixation cross and maybe target crosses, pre-rendered together) """
 
-        self.session.fixation_cross.draw()
+        self.session.fixation_layers[self.draw_crosses].draw()
 
         super(NullTrial, self).draw()
 
     def event(self):
         """ Checks for keyboard responses and scanner pulses """
 
-        for i, (ev, ev_time) in enumerate(event.getKeys(timeStamped=self.session.clock)):
+        for i, (ev, ev_time) in enumerate(self.session.input_poller.get_keys()):
             # ev_time is the event timestamp relative to the Session Clock
 
             if len(ev) > 0:
@@ -74,11 +78,7 @@ class NullTrial(Trial):
                     print('Trial canceled by user')
 
                 elif ev == 't':  # Scanner pulse
-                    self.events.append([99, ev_time, 'pulse'])
-                    self.n_TRs += 1
-
-                    if self.phase == 0:
-                        self.phase_forward()
+                    self.handle_pulse(ev_time)
 
     def run(self):
         """ Everything here is directly copied from the FlashTrial. We act as if the normal 'phases' are being run, but
@@ -141,6 +141,10 @@ class NullTrial(Trial):
             if self.phase == 7:
                 self.ITI_time = self.session.clock.getTime()
 
+                # Use idle time to prepare the next trial, but not just before the pulse that may end the ITI
+                if not self.pulse_due():
+                    self.session.prefetch_step()
+
                 if self.block_trial_ID == self.session.last_ID_this_block or self.session.scanner == 'n':
                     # If this is the last trial of the block, show the FULL ITI
                     print('Trial number %d (block trial %d)' % (self.ID, self.block_trial_ID))
@@ -156,6 +160,7 @@ class NullTrial(Trial):
 
             # events and draw, but only if we haven't stopped yet
             if not self.stopped:
+                self.check_missed_pulse()
                 self.event()
                 self.draw()
 
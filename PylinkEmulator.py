@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+PylinkEmulator.py
+
+In-process stand-in for the subset of SR Research's pylink that is used by this experiment (libeyelink, its
+calibration graphics, and the sessions), to run and measure the tracker command / message path without an EyeLink.
+
+Commands (sendCommand) and messages (sendMessage) travel over an emulated link: a bounded send buffer that a
+background 'tracker' thread empties, one item per service_time, after link_latency. Items sent while the buffer is
+full are dropped (as with a flooded link), or the sender blocks until there is room. The emulator keeps the
+throughput, latency and send buffer depth (see LinkStatistics), so that message flooding and batching can be
+quantified offline, e.g. with flood_test().
+
+Usage: install the emulator as pylink *before* importing anything that imports pylink:
+
+    import PylinkEmulator
+    PylinkEmulator.install(link_latency=0.001, service_time=0.0002, buffer_size=64)
+    from FlashSession import *
+
+Gaze samples (getNewestSample, getNextData / getFloatData) are at gaze_function(t), by default fixation at the
+center of the screen_pixel_coords that were sent, with a little noise.
+"""
+
+from __future__ import division
+import sys
+import time
+import threading
+from collections import deque
+
+import numpy as np
+
+__version__ = '2.0 (emulated)'
+
+# Event and data types
+STARTBLINK, ENDBLINK, STARTSACC, ENDSACC, STARTFIX, ENDFIX = 3, 4, 5, 6, 7, 8
+SAMPLE_TYPE = 200
+MISSING_DATA = -32768
+
+# Tracker modes
+IN_DISCONNECT_MODE, IN_UNKNOWN_MODE, IN_IDLE_MODE, IN_SETUP_MODE, IN_RECORD_MODE = 16384, 0, 1, 2, 4
+
+# Keys
+KB_PRESS, KB_RELEASE, KB_REPEAT = 10, -1, 1
+JUNK_KEY, TERMINATE_KEY, ENTER_KEY, ESC_KEY = 1, 0x7FFF, 0x0D, 0x1B
+F1_KEY, F2_KEY, F3_KEY, F4_KEY, F5_KEY = 0x3B00, 0x3C00, 0x3D00, 0x3E00, 0x3F00
+F6_KEY, F7_KEY, F8_KEY, F9_KEY, F10_KEY = 0x4000, 0x4100, 0x4200, 0x4300, 0x4400
+PAGE_UP, PAGE_DOWN = 0x4900, 0x5100
+CURS_UP, CURS_DOWN, CURS_LEFT, CURS_RIGHT = 0x4800, 0x5000, 0x4B00, 0x4D00
+
+# Calibration graphics
+CR_HAIR_COLOR, PUPIL_HAIR_COLOR, PUPIL_BOX_COLOR, SEARCH_LIMIT_BOX_COLOR, MOUSE_CURSOR_COLOR = 1, 2, 3, 4, 5
+CAL_ERR_BEEP, DC_ERR_BEEP, CAL_GOOD_BEEP, CAL_TARG_BEEP, DC_GOOD_BEEP, DC_TARG_BEEP = -1, -2, 0, 1, 2, 3
+
+# Link settings, used by the next EyeLink(); see install()
+link_settings = {'link_latency': 0.001,     # s from sending to arrival at the tracker
+                 'service_time': 0.0002,    # s the tracker needs per command / message
+                 'buffer_size': 64,         # maximum number of items in the send buffer
+                 'block_when_full': False,  # block the sender (or else drop the item) when the buffer is full
+                 'sample_rate': 1000,       # Hz
+                 'transfer_rate': 1e6}      # bytes / s of receiveDataFile
+
+_eyelink = None
+_graphics = None
+
+
+def install(**settings):
+    """ Registers this module as pylink (sys.modules), with the given link_settings """
+    link_settings.update(settings)
+    sys.modules['pylink'] = sys.modules[__name__]
+
+
+class LinkStatistics(object):
+    """ Throughput, latency and send buffer depth of the emulated link """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n_sent = 0
+        self.n_delivered = 0
+        self.n_dropped = 0
+        self.first_send_time = None
+        self.last_delivery_time = None
+        self.latencies = []         # s from sendMessage / sendCommand to processing by the tracker
+        self.buffer_depths = []     # number of items in the send buffer, at every send
+        self.blocked_time = 0.      # s senders were blocked on a full buffer
+
+    def summary(self):
+        """ Dict of statistics (times in ms) """
+        latencies = np.array(self.latencies) * 1000
+        depths = np.array(self.buffer_depths)
+        duration = self.last_delivery_time - self.first_send_time if self.n_delivered > 0 else 0
+        return {'n_sent': self.n_sent,
+                'n_delivered': self.n_delivered,
+                'n_dropped': self.n_dropped,
+                'throughput_per_s': self.n_delivered / duration if duration > 0 else np.nan,
+                'latency_mean_ms': latencies.mean() if len(latencies) > 0 else np.nan,
+                'latency_p99_ms': np.percentile(latencies, 99) if len(latencies) > 0 else np.nan,
+                'latency_max_ms': latencies.max() if len(latencies) > 0 else np.nan,
+                'buffer_depth_mean': depths.mean() if len(depths) > 0 else 0,
+                'buffer_depth_max': depths.max() if len(depths) > 0 else 0,
+                'blocked_ms': self.blocked_time * 1000}
+
+
+class SampleEye(object):
+    def __init__(self, gaze, pupil_size):
+        self.gaze = gaze
+        self.pupil_size = pupil_size
+
+    def getGaze(self):
+        return self.gaze
+
+    def getPupilSize(self):
+        return self.pupil_size
+
+
+class Sample(object):
+    """ Binocular sample """
+
+    def __init__(self, time_ms, gaze, pupil_size):
+        self.time = time_ms
+        self.eye = SampleEye(gaze, pupil_size)
+
+    def getTime(self):
+        return self.time
+
+    def isLeftSample(self):
+        return True
+
+    def isRightSample(self):
+        return True
+
+    def isBinocular(self):
+        return True
+
+    def getLeftEye(self):
+        return self.eye
+
+    def getRightEye(self):
+        return self.eye
+
+
+class KeyInput(object):
+    def __init__(self, key, state=KB_PRESS):
+        self.key = key
+        self.state = state
+
+
+class EyeLinkCustomDisplay(object):
+    """ Base class of calibration graphics """
+
+    def __init__(self):
+        pass
+
+
+class EyeLink(object):
+    """
+    Emulated tracker connection. Link behaviour is set by link_settings (see install()) and can be changed on the
+    instance (link_latency, service_time, buffer_size, block_when_full, sample_rate, transfer_rate)
+    """
+
+    def __init__(self, trackeraddress='100.1.1.1'):
+        global _eyelink
+        _eyelink = self
+
+        for name, value in link_settings.items():
+            setattr(self, name, value)
+
+        self.start_time = time.time()
+        self.stats = LinkStatistics()
+        self.commands = []
+        self.messages = []          # (tracker time, message) written to the data file
+        self.data_file = None
+        self.connected = True
+        self.mode = IN_IDLE_MODE
+        self.screen_size = (1920, 1080)
+        self.pupil_size_diameter = True
+        self.gaze_function = self.fixate_center
+        self.random_state = np.random.RandomState(0)
+        self.last_read_sample = None
+        self.float_data = None
+
+        self._buffer = deque()
+        self._buffer_changed = threading.Condition()
+        self._thread = threading.Thread(target=self._serve_link)
+        self._thread.daemon = True
+        self._thread.start()
+
+    # The link
+    def _send(self, kind, text):
+        """ Puts a command or message in the send buffer. Returns 0, or an error code if it was dropped """
+        with self._buffer_changed:
+            self.stats.n_sent += 1
+            if self.stats.first_send_time is None:
+                self.stats.first_send_time = time.time()
+            self.stats.buffer_depths.append(len(self._buffer))
+
+            if len(self._buffer) >= self.buffer_size:
+                if not self.block_when_full:
+                    self.stats.n_dropped += 1
+                    return -1
+                blocked_start = time.time()
+                while len(self._buffer) >= self.buffer_size:
+                    self._buffer_changed.wait()
+                self.stats.blocked_time += time.time() - blocked_start
+
+            self._buffer.append((time.time(), kind, text))
+            self._buffer_changed.notify_all()
+        return 0
+
+    def _serve_link(self):
+        """ Tracker side of the link: processes the send buffer, one item per service_time """
+        while True:
+            with self._buffer_changed:
+                while len(self._buffer) == 0:
+                    self._buffer_changed.wait()
+                send_time, kind, text = self._buffer[0]
+
+            arrival_time = send_time + self.link_latency
+            if arrival_time > time.time():
+                time.sleep(arrival_time - time.time())
+            time.sleep(self.service_time)
+
+            if kind == 'command':
+                self._do_command(text)
+            elif self.data_file is not None:
+                self.messages.append((self.trackerTime(), text))
+
+            with self._buffer_changed:
+                self._buffer.popleft()
+                now = time.time()
+                self.stats.n_delivered += 1
+                self.stats.latencies.append(now - send_time)
+                self.stats.last_delivery_time = now
+                self._buffer_changed.notify_all()
+
+    def _do_command(self, command):
+        self.commands.append(command)
+        if command.replace(' ', '').startswith('screen_pixel_coords='):
+            coords = [float(value) for value in command.split('=')[1].split()]
+            self.screen_size = (coords[2] - coords[0], coords[3] - coords[1])
+        elif command.replace(' ', '').startswith('sample_rate='):
+            self.sample_rate = float(command.split('=')[1])
+
+    def flush_link(self, timeout=10.):
+        """ Waits until the send buffer is empty """
+        end_time = time.time() + timeout
+        with self._buffer_changed:
+            while len(self._buffer) > 0 and time.time() < end_time:
+                self._buffer_changed.wait(0.01)
+
+    def buffer_depth(self):
+        return len(self._buffer)
+
+    def sendCommand(self, command):
+        return self._send('command', command)
+
+    def sendMessage(self, message):
+        return self._send('message', message)
+
+    # Tracker state
+    def getTrackerVersion(self):
+        return 3
+
+    def getTrackerVersionString(self):
+        return 'EYELINK CL 4.56'
+
+    def isConnected(self):
+        return self.connected
+
+    def getCurrentMode(self):
+        return self.mode
+
+    def setOfflineMode(self):
+        self.mode = IN_IDLE_MODE
+
+    def setPupilSizeDiameter(self, diameter):
+        self.pupil_size_diameter = diameter
+
+    def eyeAvailable(self):
+        return 1    # right eye
+
+    def trackerTime(self):
+        return (time.time() - self.start_time) * 1000
+
+    def currentTime(self):
+        return int(self.trackerTime())
+
+    def startRecording(self, file_samples, file_events, link_samples, link_events):
+        self.mode = IN_RECORD_MODE
+        self.last_read_sample = int(self.trackerTime() * self.sample_rate / 1000)
+        return 0
+
+    def stopRecording(self):
+        self.mode = IN_IDLE_MODE
+
+    def isRecording(self):
+        return 0 if self.mode == IN_RECORD_MODE else -1
+
+    def waitForBlockStart(self, timeout, samples, events):
+        return 1
+
+    def close(self):
+        self.connected = False
+
+    # Calibration
+    def doTrackerSetup(self, width=None, height=None):
+        self.mode = IN_IDLE_MODE
+
+    def doDriftCorrect(self, x, y, draw, allow_setup):
+        return 0
+
+    def applyDriftCorrect(self):
+        return 0
+
+    def getCalibrationResult(self):
+        return 0
+
+    def sendKeybutton(self, code, mods, state):
+        return 0
+
+    # Data file
+    def openDataFile(self, file_name):
+        self.data_file = file_name
+        self.messages = []
+        return 0
+
+    def closeDataFile(self):
+        self.flush_link()
+        return 0
+
+    def receiveDataFile(self, src, dest):
+        """ Writes the messages as an ASC-like text file, after the time a transfer of its size would take """
+        self.flush_link()
+        contents = ''.join(['MSG\t%d\t%s\n' % (t, message) for t, message in self.messages])
+        time.sleep(len(contents) / self.transfer_rate)
+        with open(dest, 'w') as f:
+            f.write(contents)
+        return len(contents)
+
+    # Samples
+    def fixate_center(self, t):
+        """ Default gaze_function: fixation at the screen center, with 0.5 pixel noise """
+        return (self.screen_size[0] / 2 + self.random_state.randn() * .5,
+                self.screen_size[1] / 2 + self.random_state.randn() * .5)
+
+    def _sample(self, sample_n):
+        t = sample_n * 1000. / self.sample_rate
+        return Sample(t, self.gaze_function(t), 1000. if self.pupil_size_diameter else 4000.)
+
+    def getNewestSample(self):
+        if self.mode != IN_RECORD_MODE:
+            return None
+        return self._sample(int(self.trackerTime() * self.sample_rate / 1000))
+
+    def getNextData(self):
+        """ Samples since the previous getNextData (at most one second of samples are kept) """
+        if self.mode != IN_RECORD_MODE:
+            return 0
+        newest = int(self.trackerTime() * self.sample_rate / 1000)
+        self.last_read_sample = max(self.last_read_sample, newest - int(self.sample_rate))
+        if self.last_read_sample >= newest:
+            return 0
+        self.last_read_sample += 1
+        self.float_data = self._sample(self.last_read_sample)
+        return SAMPLE_TYPE
+
+    def getFloatData(self):
+        return self.float_data
+
+
+def getEYELINK():
+    return _eyelink
+
+
+def msecDelay(delay):
+    time.sleep(delay / 1000.)
+
+
+def pumpDelay(delay):
+    time.sleep(delay / 1000.)
+
+
+def currentTime():
+    return _eyelink.currentTime() if _eyelink is not None else 0
+
+
+def openGraphicsEx(graphics):
+    global _graphics
+    _graphics = graphics
+
+
+def closeGraphics():
+    global _graphics
+    _graphics = None
+
+
+def flushGetkeyQueue():
+    pass
+
+
+def beginRealTimeMode(delay):
+    pass
+
+
+def endRealTimeMode():
+    pass
+
+
+def setCalibrationColors(foreground, background):
+    pass
+
+
+def setTargetSize(diameter, hole):
+    pass
+
+
+def setCalibrationSounds(target, good, error):
+    pass
+
+
+def setDriftCorrectSounds(target, good, error):
+    pass
+
+
+def flood_test(n_messages=500, interval=0., message='trial 1 parameter\tsome_parameter : 0.123456', **settings):
+    """
+    Sends n_messages messages, interval seconds apart (like Trial.stop logs the trial parameters), over an emulated
+    link with the given link_settings. Returns the LinkStatistics summary
+    """
+
+    link_settings.update(settings)
+    eyelink = EyeLink()
+    eyelink.openDataFile('flood.edf')
+    for i in range(n_messages):
+        eyelink.sendMessage(message)
+        if interval > 0:
+            time.sleep(interval)
+    eyelink.flush_link()
+    return eyelink.stats.summary()
+
+
+if __name__ == '__main__':
+    # Message flooding with and without the 0.5 ms pauses between log messages (see Trial.stop)
+    for interval in [0., 0.0005]:
+        summary = flood_test(interval=interval)
+        print('interval %.1f ms: %d / %d delivered (%d dropped), %.0f messages/s, latency mean %.2f ms, '
+              'p99 %.2f ms, send buffer depth max %d' % (
+                interval * 1000, summary['n_delivered'], summary['n_sent'], summary['n_dropped'],
+                summary['throughput_per_s'], summary['latency_mean_ms'], summary['latency_p99_ms'],
+                summary['buffer_depth_max']))
@@ -0,0 +1,87 @@
+from psychopy import visual
+
+
+class ScoreFeedback(object):
+    """
+    Feedback text showing the points earned and the total score, e.g.:
+
+        Correct! +8
+        Total score: 120
+
+    Setting the text of a TextStim re-lays out the glyphs and rebuilds its texture, which is slow. Therefore, all
+    text is rendered once: the static parts (header and score label) as their own TextStims, and the score from a
+    digit atlas of ten pre-rendered TextStims (one per digit), which are moved to the position of every digit when
+    drawn. Setting a new score with set_score() only stores its digits.
+
+    Parameters
+    -----------
+    win : psychopy.visual.Window instance
+    header : str
+        First line, e.g. 'Correct! +8'
+    score_label : str
+        Text before the score on the second line, e.g. 'Total score:'
+    height : float
+        Letter height, in degrees of visual angle
+    color : str
+        Text color. Defaults to 'darkgreen'
+    mirror : bool
+        Flip horizontally (for mirrored displays)? Defaults to False
+    max_digits : int
+        Maximum number of digits of the score. Defaults to 5
+    digit_width : float or None
+        Horizontal distance between digits, in degrees of visual angle. Defaults to 0.6 * height
+    """
+
+    def __init__(self, win, header, score_label, height, color='darkgreen', mirror=False, max_digits=5,
+                 digit_width=None):
+
+        self.header_text = header
+        self.score_label_text = score_label
+        self.score = None
+        self.score_digits = []
+
+        if digit_width is None:
+            digit_width = .6 * height
+
+        # When mirrored, everything to the right of the center goes to the left
+        x_sign = -1 if mirror else 1
+        line_y = .6 * height
+
+        self.header = visual.TextStim(win, text=header, color=color, units='deg', height=height, pos=(0, line_y),
+                                      flipHoriz=mirror)
+        self.score_label = visual.TextStim(win, text=score_label, color=color, units='deg', height=height,
+                                           pos=(-x_sign * height / 4, -line_y), alignHoriz='right', flipHoriz=mirror)
+
+        # Digit atlas, and the positions at which the digits of the score are drawn
+        self.digits = [visual.TextStim(win, text=str(digit), color=color, units='deg', height=height,
+                                       alignHoriz='center', flipHoriz=mirror) for digit in range(10)]
+        self.digit_positions = [(x_sign * (height / 4 + (i + .5) * digit_width), -line_y) for i in range(max_digits)]
+
+    @property
+    def text(self):
+        """ Full feedback text, e.g. for logging """
+        return '%s\n%s %d' % (self.header_text, self.score_label_text, self.score)
+
+    def set_score(self, score):
+        """
+        Sets the score to show
+        """
+
+        score_digits = [int(digit) for digit in '%d' % score]
+        if len(score_digits) > len(self.digit_positions):
+            raise(ValueError('Score %d has more than %d digits' % (score, len(self.digit_positions))))
+
+        self.score = score
+        self.score_digits = score_digits
+
+    def draw(self):
+        """
+        Draws the feedback
+        """
+
+        self.header.draw()
+        self.score_label.draw()
+        for position, digit in zip(self.digit_positions, self.score_digits):
+            digit_stim = self.digits[digit]
+            digit_stim.pos = position
+            digit_stim.draw()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Forecasts behaviour on a design before scanning: virtual participants (accumulator models) do the decision-making
+trials of a participant's design (designs/pp_xxx/all_blocks/trials.csv), on flash sequences drawn like the session
+draws them (see EvidenceSampler), and are scored with the session's rules:
+    - responses faster than 150 ms get 'too fast' feedback
+    - responses on SPD trials get 'too slow' feedback with probability expon.cdf(rt, loc=.75, scale=1/2.75) (as in
+      FlashTrial; the deterministic deadlines of standard_parameters.sat are reported as well)
+    - correct responses in limbic blocks earn 8 points (trial types 2 and 5) or 2 points (trial types 3 and 4)
+
+Evidence arrives per frame (flash frames of the correct and incorrect flashers), and all virtual participants and
+trials are simulated at once as arrays of shape (participants, trials, flashers, frames), in chunks of participants
+that run in parallel processes.
+
+Models (see default_observer):
+    'ddm'	--	two flashers: one accumulator of the difference in flash evidence (right - left), bounds at
+				+/- threshold
+    'race'	--	one accumulator per flasher, the first to reach threshold wins
+
+Usage: python SimulatedObserver.py <trials.csv or pp_xxx directory> [n_simulations]
+"""
+from __future__ import division
+import os
+import sys
+from multiprocessing import Pool, cpu_count
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from EvidenceSampler import sample_increments_batch
+
+# Parameters of a virtual participant. Drift (gain) and noise are in threshold units per second of flash evidence
+default_observer = {
+    'model': 'ddm',
+    'gain': 8.0,              # drift per second during a flash (of the flash difference for the ddm)
+    'noise': 1.0,             # standard deviation of the accumulated noise per sqrt(second)
+    'threshold': 1.0,         # bound on ACC, NEU and LEFT/RIGHT cued trials
+    'threshold_speed': 0.6,   # bound on SPD trials
+    'cue_bias': 0.2,          # starting point towards the cued flasher (LEFT/RIGHT cues), as a fraction of the bound
+    't0_hand': 0.35,          # non-decision time (s) of keyboard responses
+    't0_eye': 0.25,           # non-decision time (s) of saccades
+    'st0': 0.1,               # range of the (uniform) variability in non-decision time (s)
+}
+
+# Trial types of limbic blocks with a reward cue, and their rewards for a correct response (see
+# FlashSession.update_score)
+limbic_rewards = {2: 8, 5: 8, 3: 2, 4: 2}
+
+
+def load_design(design):
+    """ The decision-making trials of a design: a trials.csv file, a participant's design directory, or a
+    DataFrame """
+
+    if isinstance(design, pd.DataFrame):
+        trials = design
+    else:
+        if os.path.isdir(design):
+            design = os.path.join(design, 'all_blocks', 'trials.csv')
+        trials = pd.read_csv(design)
+    trials = trials[(trials['block_type'] != 'localizer') & ~trials['null_trial'].astype(bool)]
+    return trials.reset_index(drop=True)
+
+
+def frame_timing(parameters, frame_rate, stim_max_time):
+    """ Increment and flash length in frames, and number of increments, as in FlashSession.prepare_trials """
+
+    increment_length = int(np.round(parameters['increment_duration'] * frame_rate / 1000))
+    flash_length = int(np.round(parameters['flash_duration'] * frame_rate / 1000))
+    n_increments = int(np.ceil(stim_max_time * frame_rate / increment_length)) + 1
+    return increment_length, flash_length, n_increments
+
+
+def _simulate_chunk(args):
+    """ Simulates n_simulations virtual participants on all trials. Runs in a worker process """
+
+    trials, n_simulations, observer, parameters, frame_rate, seed = args
+    random_state = np.random.RandomState(seed)
+    n_trials = len(trials['correct_answer'])
+    n_flashers = parameters['n_flashers']
+    dt = 1 / frame_rate
+
+    stim_max_time = trials['phase_4'].max()
+    increment_length, flash_length, n_increments = frame_timing(parameters, frame_rate, stim_max_time)
+    n_frames = int(np.ceil(stim_max_time * frame_rate))
+
+    # Flash evidence per frame: (simulations, trials, flashers, frames)
+    correct_answers = np.tile(trials['correct_answer'], n_simulations)
+    increments = sample_increments_batch(n_increments, parameters['prop_correct'], parameters['prop_incorrect'],
+                                         n_flashers, correct_answers, random_state)
+    frames = np.arange(n_frames)
+    evidence = increments[:, :, frames // increment_length] * (frames % increment_length < flash_length)
+    evidence = evidence.reshape(n_simulations, n_trials, n_flashers, n_frames)
+
+    # Bounds and starting points per trial
+    speed = trials['cue'] == 'SPD'
+    threshold = np.where(speed, observer['threshold_speed'], observer['threshold'])
+    cued = np.where(trials['cue'] == 'LEFT', 0, np.where(trials['cue'] == 'RIGHT', 1, -1))
+    start = observer['cue_bias'] * threshold
+
+    if observer['model'] == 'ddm':
+        if n_flashers != 2:
+            raise ValueError('The ddm needs two flashers; use the race model')
+        drift = observer['gain'] * (evidence[:, :, 1] - evidence[:, :, 0]) * dt
+        x = np.cumsum(drift + observer['noise'] * np.sqrt(dt) * random_state.standard_normal(drift.shape), axis=2)
+        x += np.where(cued == 1, start, np.where(cued == 0, -start, 0))[:, np.newaxis]
+        crossed = np.abs(x) >= threshold[:, np.newaxis]
+        decision_frame = crossed.argmax(axis=2)
+        responded = crossed.any(axis=2)
+        sim_idx, trial_idx = np.ogrid[:n_simulations, :n_trials]
+        choice = (x[sim_idx, trial_idx, decision_frame] > 0).astype(int)
+    elif observer['model'] == 'race':
+        drift = observer['gain'] * evidence * dt
+        x = np.cumsum(drift + observer['noise'] * np.sqrt(dt) * random_state.standard_normal(drift.shape), axis=3)
+        x += np.where(np.arange(n_flashers)[np.newaxis, :] == cued[:, np.newaxis], start[:, np.newaxis],
+                      0)[:, :, np.newaxis]
+        crossed = (x >= threshold[:, np.newaxis, np.newaxis]).any(axis=2)
+        decision_frame = crossed.argmax(axis=2)
+        responded = crossed.any(axis=2)
+        # The winner is the accumulator that is furthest at the decision frame
+        sim_idx, trial_idx = np.ogrid[:n_simulations, :n_trials]
+        choice = x[sim_idx, trial_idx, :, decision_frame].argmax(axis=2)
+    else:
+        raise ValueError('Unknown model %s' % observer['model'])
+
+    # Response times, including the non-decision time; responses after the stimulus phase are too late
+    t0 = np.where(trials['response_modality'] == 'eye', observer['t0_eye'], observer['t0_hand'])
+    rt = (decision_frame + 1) * dt + t0 + observer['st0'] * (random_state.uniform(size=decision_frame.shape) - .5)
+    responded &= rt < trials['phase_4'][np.newaxis, :]
+    rt = np.where(responded, rt, np.nan)
+    correct = responded & (choice == trials['correct_answer'][np.newaxis, :])
+
+    # Feedback as in FlashTrial: 0 = too late / too slow, 1 = correct, 2 = wrong, 3 = too fast
+    response_type = np.where(responded, np.where(correct, 1, 2), 0)
+    with np.errstate(invalid='ignore'):
+        too_fast = responded & (rt < 0.150)
+        too_slow = responded & ~too_fast & speed[np.newaxis, :] & \
+            (random_state.uniform(size=rt.shape) < stats.expon.cdf(np.nan_to_num(rt), loc=.75, scale=1 / 2.75))
+    feedback_type = np.where(too_fast, 3, np.where(too_slow, 0, response_type))
+
+    reward = np.array([limbic_rewards.get(trial_type, 0) if 'limbic' in block_type else 0
+                       for trial_type, block_type in zip(trials['trial_type'], trials['block_type'])])
+    score = (correct * reward[np.newaxis, :]).sum(axis=1)
+
+    return {'choice': np.where(responded, choice, -1), 'rt': rt, 'response_type': response_type,
+            'feedback_type': feedback_type, 'score': score}
+
+
+def simulate(design, n_simulations=1000, observer=None, parameters=None, frame_rate=60, chunk_size=50,
+             n_processes=None, seed=None):
+    """
+    Simulates n_simulations virtual participants on the decision-making trials of a design.
+
+    Parameters
+    ----------
+    design: str or pd.DataFrame
+        trials.csv, a participant's design directory, or the trials themselves
+    n_simulations: int
+    observer: dict
+        Model parameters (missing ones are taken from default_observer)
+    parameters: dict
+        Flash parameters (default: standard_parameters.parameters)
+    frame_rate: float
+    chunk_size: int
+        Number of virtual participants simulated at once, per process
+    n_processes: int or None
+        Defaults to the number of CPUs minus 1; 1 runs in this process
+    seed: int or None
+        For reproducible simulations
+
+    Returns
+    -------
+    trials: pd.DataFrame
+        The simulated trials of the design
+    results: dict
+        'choice' (-1 if no response), 'rt' (s, NaN if no response), 'response_type' and 'feedback_type' (as in
+        FlashTrial), all of shape (n_simulations, n_trials), and 'score' (points per virtual participant)
+    """
+
+    if parameters is None:
+        from standard_parameters import parameters
+    full_observer = dict(default_observer)
+    full_observer.update(observer or {})
+
+    trials = load_design(design)
+    trial_arrays = dict((column, trials[column].values) for column in
+                        ['correct_answer', 'cue', 'block_type', 'trial_type', 'response_modality', 'phase_4'])
+    trial_arrays['correct_answer'] = trial_arrays['correct_answer'].astype(int)
+
+    seeds = np.random.RandomState(seed).randint(2 ** 31 - 1, size=int(np.ceil(n_simulations / chunk_size)))
+    chunks = [(trial_arrays, min(chunk_size, n_simulations - i * chunk_size), full_observer, parameters,
+               frame_rate, chunk_seed) for i, chunk_seed in enumerate(seeds)]
+
+    if n_processes is None:
+        n_processes = max(1, cpu_count() - 1)
+    if n_processes == 1 or len(chunks) == 1:
+        chunk_results = [_simulate_chunk(chunk) for chunk in chunks]
+    else:
+        pool = Pool(processes=min(n_processes, len(chunks)))
+        try:
+            chunk_results = pool.map(_simulate_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+    results = dict((key, np.concatenate([chunk[key] for chunk in chunk_results])) for key in chunk_results[0])
+    return trials, results
+
+
+def summarize(trials, results, sat=None):
+    """
+    Summary of a simulation.
+
+    Returns
+    -------
+    conditions: pd.DataFrame
+        Per block type, cue and trial type: the proportion of trials with a response in time, accuracy of these responses, RT
+        mean and quantiles (s), the rates of 'too fast' and 'too slow' feedback, and the proportion of responses
+        slower than the SAT deadline of the cue (sat['speed_max_time'] for SPD, sat['acc_max_time'] otherwise)
+    payout: dict
+        Mean, standard deviation and 5th, 50th and 95th percentile of the score, and the mean in euros
+    """
+
+    if sat is None:
+        from standard_parameters import sat
+
+    rows = []
+    for (block_type, cue, trial_type), condition in trials.groupby(['block_type', 'cue', 'trial_type']):
+        idx = condition.index.values
+        rt = results['rt'][:, idx]
+        responded = ~np.isnan(rt)
+        n_responses = responded.sum()
+        deadline = sat['speed_max_time'] if cue == 'SPD' else sat['acc_max_time']
+        row = {'block_type': block_type, 'cue': cue, 'trial_type': trial_type, 'n_trials': len(idx),
+               'p_response': responded.mean(),
+               'accuracy': (results['response_type'][:, idx] == 1).sum() / max(n_responses, 1),
+               'too_fast_fb': (results['feedback_type'][:, idx] == 3).sum() / max(n_responses, 1),
+               'too_slow_fb': ((results['feedback_type'][:, idx] == 0) & responded).sum() / max(n_responses, 1),
+               'past_sat_deadline': (rt[responded] > deadline).mean() if n_responses > 0 else np.nan,
+               'rt_mean': rt[responded].mean() if n_responses > 0 else np.nan}
+        for q in [.1, .3, .5, .7, .9]:
+            row['rt_q%d' % (q * 100)] = np.percentile(rt[responded], q * 100) if n_responses > 0 else np.nan
+        rows.append(row)
+
+    columns = ['block_type', 'cue', 'trial_type', 'n_trials', 'p_response', 'accuracy', 'too_fast_fb', 'too_slow_fb',
+               'past_sat_deadline', 'rt_mean', 'rt_q10', 'rt_q30', 'rt_q50', 'rt_q70', 'rt_q90']
+    conditions = pd.DataFrame(rows)[columns]
+
+    score = results['score']
+    payout = {'mean': score.mean(), 'sd': score.std(), 'p5': np.percentile(score, 5),
+              'p50': np.percentile(score, 50), 'p95': np.percentile(score, 95),
+              'euro': score.mean() * (10 / 400)}   # as FlashSession.close
+    return conditions, payout
+
+
+def sweep_difficulty(design, prop_pairs, n_simulations=1000, observer=None, parameters=None, **args):
+    """
+    Forecast per (prop_correct, prop_incorrect) pair: overall accuracy, proportion of responses in time, mean RT
+    and mean score. Other arguments are passed on to simulate()
+    """
+
+    if parameters is None:
+        from standard_parameters import parameters
+
+    rows = []
+    for prop_correct, prop_incorrect in prop_pairs:
+        these_parameters = dict(parameters, prop_correct=prop_correct, prop_incorrect=prop_incorrect)
+        trials, results = simulate(design, n_simulations=n_simulations, observer=observer,
+                                   parameters=these_parameters, **args)
+        responded = ~np.isnan(results['rt'])
+        rows.append({'prop_correct': prop_correct, 'prop_incorrect': prop_incorrect,
+                     'p_response': responded.mean(),
+                     'accuracy': (results['response_type'] == 1).sum() / max(responded.sum(), 1),
+                     'rt_mean': np.nanmean(results['rt']), 'score': results['score'].mean()})
+    return pd.DataFrame(rows)[['prop_correct', 'prop_incorrect', 'p_response', 'accuracy', 'rt_mean', 'score']]
+
+
+if __name__ == '__main__':
+    design = sys.argv[1]
+    n_simulations = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    trials, results = simulate(design, n_simulations=n_simulations)
+    conditions, payout = summarize(trials, results)
+    pd.set_option('display.width', 200)
+    print(conditions.to_string(index=False, float_format=lambda v: '%.3f' % v))
+    print('Score: mean %.1f (sd %.1f; 5%%-95%%: %d-%d), %.2f euro' % (payout['mean'], payout['sd'], payout['p5'],
+                                                                    payout['p95'], payout['euro']))
@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from psychopy import visual
+from psychopy.tools.monitorunittools import convertToPix
+
+
+class StaticLayer(object):
+    """
+    A group of static stimuli, rendered once into a single texture, which is then drawn with one draw call.
+
+    On construction, the stimuli are drawn into the back buffer, the region around them is captured (like
+    visual.BufferImageStim, which does the work), and the back buffer is cleared. Therefore, make layers when the
+    stimuli are set up, never in the middle of drawing a frame.
+
+    The captured region is opaque: it includes the background color. Draw a layer first, before anything that may
+    overlap its region.
+
+    Parameters
+    -----------
+    win : psychopy.visual.Window instance
+    stimuli : list
+        Stimuli (anything with a draw() method), drawn in this order
+    size : tuple
+        (width, height) of the region to capture, in units
+    pos : tuple
+        Center of the region to capture, in units. Defaults to (0, 0)
+    units : str
+        Units of size and pos. Defaults to 'deg'
+    """
+
+    def __init__(self, win, stimuli, size, pos=(0, 0), units='deg'):
+
+        self.win = win
+        self.stimuli = stimuli
+
+        # Region to capture, in pixels and in normalized units (left, top, right, bottom)
+        half_size_pix = convertToPix(vertices=[0, 0], pos=[size[0] / 2., size[1] / 2.], units=units, win=win)
+        pos_pix = convertToPix(vertices=[0, 0], pos=pos, units=units, win=win)
+        half_win = [win.size[0] / 2., win.size[1] / 2.]
+        rect = [max(-1, (pos_pix[0] - half_size_pix[0]) / half_win[0]),
+                min(1, (pos_pix[1] + half_size_pix[1]) / half_win[1]),
+                min(1, (pos_pix[0] + half_size_pix[0]) / half_win[0]),
+                max(-1, (pos_pix[1] - half_size_pix[1]) / half_win[1])]
+
+        self.image = visual.BufferImageStim(win, stim=stimuli, rect=rect, interpolate=False)
+        self.image.pos = ((rect[0] + rect[2]) / 2 * half_win[0], (rect[1] + rect[3]) / 2 * half_win[1])
+        win.clearBuffer()
+
+    def draw(self):
+        """
+        Draws the layer
+        """
+
+        self.image.draw()
+
+
+class SceneCache(object):
+    """
+    Static scenes (e.g. a cue with the target crosses, a feedback text, an instruction screen), each composed once into
+    a StaticLayer, so that drawing a scene is a single draw call for as long as it is shown.
+
+    A scene is identified by the tuple of its stimuli, so the same tuple (of the same objects) must be passed to
+    compose() and draw(). Stimuli that change (e.g. a TextStim of which the text is set) must be composed again.
+
+    Scenes made with compose() are kept for the whole session. Scenes composed on the fly by draw(compose=True) are
+    kept up to max_scenes; then the oldest is discarded.
+
+    Parameters
+    -----------
+    win : psychopy.visual.Window instance
+    max_scenes : int
+        Maximum number of scenes composed on the fly. Defaults to 16
+    """
+
+    def __init__(self, win, max_scenes=16):
+        self.win = win
+        self.max_scenes = max_scenes
+        self.scenes = {}
+        self.on_the_fly = OrderedDict()
+
+    def compose(self, stimuli, size=None, units='deg'):
+        """
+        (Re)composes the scene of stimuli (a tuple), capturing a region of size (in units) around the center of the
+        screen, or the whole screen if size is None. Never call this in the middle of drawing a frame (see StaticLayer)
+        """
+
+        if size is None:
+            size, units = self.win.size, 'pix'
+        self.scenes[stimuli] = StaticLayer(self.win, list(stimuli), size=size, units=units)
+        self.on_the_fly.pop(stimuli, None)
+        return self.scenes[stimuli]
+
+    def draw(self, stimuli, compose=False):
+        """
+        Draws the scene of stimuli (a tuple) with a single draw call if it has been composed. If not, it is composed
+        of the whole screen first if compose is True (only do this if nothing else has been drawn in this frame yet), or
+        else all stimuli are drawn one by one.
+        """
+
+        scene = self.scenes.get(stimuli)
+        if scene is None:
+            scene = self.on_the_fly.get(stimuli)
+        if scene is None and compose:
+            scene = self.on_the_fly[stimuli] = StaticLayer(self.win, list(stimuli), size=self.win.size, units='pix')
+            if len(self.on_the_fly) > self.max_scenes:
+                self.on_the_fly.popitem(last=False)
+
+        if scene is not None:
+            scene.draw()
+        else:
+            for stimulus in stimuli:
+                stimulus.draw()
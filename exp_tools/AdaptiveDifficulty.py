@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+AdaptiveDifficulty.py
+
+Bayesian adaptive choice of trial difficulty (as QUEST+): a posterior over the parameters of the psychometric
+function on a grid, and every next trial at the difficulty that is expected to be most informative about them.
+"""
+
+from __future__ import division
+import numpy as np
+
+
+class AdaptiveDifficulty(object):
+    """
+    Difficulty is the difference in flash probability between the correct and the incorrect flashers (intensity),
+    around a fixed mean: prop_correct = mean_prop + intensity / 2, prop_incorrect = mean_prop - intensity / 2.
+
+    Accuracy is modelled as a Weibull function of intensity,
+        p(correct) = guess_rate + (1 - guess_rate - lapse) * (1 - exp(-(intensity / threshold) ** slope)),
+    with a posterior over (threshold, slope, lapse) on a grid. The likelihood of a correct response is tabulated once
+    for every intensity and grid point, so that an update is a single product, and choosing the next intensity
+    (minimal expected entropy of the posterior after the response) is a few array operations over all intensities
+    and grid points at once.
+
+    Practice blocks are short (8 trials), so the grid is coarse in slope and lapse, the prior on the threshold can be
+    centred on the expected threshold (log-normal), and the first trials can be set to easy intensities (warmup)
+    before the most informative ones are chosen. Their responses update the posterior like any other.
+
+    Parameters
+    ----------
+    intensities: array
+        Intensities that can be chosen
+    mean_prop: float
+    thresholds: array
+    slopes: array
+    lapses: array
+    guess_rate: float
+        Accuracy of guessing: 1 / number of flashers
+    target: float
+        Target accuracy (see target_intensity)
+    prior_threshold: float or None
+        Median of the log-normal prior on the threshold; None for a uniform prior
+    prior_sd: float
+        Standard deviation of the log of the threshold in the prior
+    warmup: sequence of float
+        Intensities of the first trials
+    """
+
+    def __init__(self, intensities=np.linspace(0.05, 0.7, 14), mean_prop=0.55,
+                 thresholds=np.exp(np.linspace(np.log(0.05), np.log(0.8), 30)), slopes=(1.5, 2.5, 3.5),
+                 lapses=(0, 0.04), guess_rate=0.5, target=0.8, prior_threshold=None, prior_sd=0.5, warmup=()):
+        self.intensities = np.asarray(intensities, dtype=float)
+        self.mean_prop = mean_prop
+        self.guess_rate = guess_rate
+        self.target = target
+        self.warmup = warmup
+
+        # Grid points, flattened: (n_grid,) each
+        threshold, slope, lapse = np.meshgrid(thresholds, slopes, lapses, indexing='ij')
+        self.threshold, self.slope, self.lapse = threshold.ravel(), slope.ravel(), lapse.ravel()
+
+        # p(correct) per intensity and grid point: (n_intensities, n_grid)
+        weibull = 1 - np.exp(-(self.intensities[:, np.newaxis] / self.threshold[np.newaxis, :]) ** self.slope)
+        self.likelihood = guess_rate + (1 - guess_rate - self.lapse) * weibull
+
+        if prior_threshold is None:
+            self.posterior = np.ones(len(self.threshold))
+        else:
+            self.posterior = np.exp(-0.5 * ((np.log(self.threshold) - np.log(prior_threshold)) / prior_sd) ** 2)
+        self.posterior /= self.posterior.sum()
+        self.history = []   # (intensity, correct) of all updates
+        self.next_index = None
+
+    def difficulty(self, intensity):
+        """ (prop_correct, prop_incorrect) of intensity """
+        return self.mean_prop + intensity / 2, self.mean_prop - intensity / 2
+
+    def next_intensity(self):
+        """ The intensity with the minimal expected entropy of the posterior after the response (or the next warmup
+        intensity) """
+
+        if len(self.history) < len(self.warmup):
+            self.next_index = int(np.argmin(np.abs(self.intensities - self.warmup[len(self.history)])))
+            return self.intensities[self.next_index]
+
+        p_correct = self.likelihood.dot(self.posterior)
+        joint_correct = self.likelihood * self.posterior
+        joint_incorrect = self.posterior - joint_correct
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            expected_entropy = np.zeros(len(self.intensities))
+            for joint, p in [(joint_correct, p_correct), (joint_incorrect, 1 - p_correct)]:
+                q = joint / p[:, np.newaxis]
+                expected_entropy -= p * np.where(q > 0, q * np.log(q), 0).sum(axis=1)
+
+        self.next_index = int(np.argmin(expected_entropy))
+        return self.intensities[self.next_index]
+
+    def next_difficulty(self):
+        """ (prop_correct, prop_incorrect) of the next trial """
+        return self.difficulty(self.next_intensity())
+
+    def update(self, intensity, correct):
+        """ Updates the posterior with the response (correct: bool) on a trial of intensity """
+
+        index = np.argmin(np.abs(self.intensities - intensity))
+        self.posterior *= self.likelihood[index] if correct else 1 - self.likelihood[index]
+        self.posterior /= self.posterior.sum()
+        self.history.append((self.intensities[index], bool(correct)))
+
+    def target_intensities(self):
+        """ Per grid point, the intensity at which accuracy is target """
+        fraction = np.clip((self.target - self.guess_rate) / (1 - self.guess_rate - self.lapse), 0, 1 - 1e-9)
+        return self.threshold * (-np.log(1 - fraction)) ** (1 / self.slope)
+
+    def target_intensity(self):
+        """ Posterior mean and standard deviation of the intensity at which accuracy is target """
+        intensities = self.target_intensities()
+        mean = self.posterior.dot(intensities)
+        return mean, np.sqrt(self.posterior.dot((intensities - mean) ** 2))
+
+    def converged(self, tolerance=0.1, min_trials=6):
+        """ Whether the target intensity is known to within tolerance (posterior standard deviation). The defaults
+        suit a block of 8 trials: about half of the participants reach them before the end of the block """
+        return len(self.history) >= min_trials and self.target_intensity()[1] < tolerance
+
+    def estimate(self):
+        """ Posterior means of the psychometric parameters, and of the target intensity and difficulty (within the
+        range of intensities) """
+        intensity, sd = self.target_intensity()
+        intensity = np.clip(intensity, self.intensities[0], self.intensities[-1])
+        return {'threshold': self.posterior.dot(self.threshold), 'slope': self.posterior.dot(self.slope),
+                'lapse': self.posterior.dot(self.lapse), 'target_intensity': intensity, 'target_intensity_sd': sd,
+                'target_difficulty': self.difficulty(intensity), 'n_trials': len(self.history)}
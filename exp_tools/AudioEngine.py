@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+AudioEngine.py
+
+Plays preloaded sounds through a single, persistent audio output stream.
+"""
+
+from __future__ import division
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from scipy.io import wavfile
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+
+
+class PyAudioSink(object):
+    """ Audio output through a pyaudio (PortAudio) callback stream, which stays open for the whole session """
+
+    def __init__(self, sample_rate=44100, frames_per_buffer=256):
+        self.sample_rate = sample_rate
+        self.frames_per_buffer = frames_per_buffer
+        self.pyaudio = None
+        self.stream = None
+
+    def start(self, callback):
+        if pyaudio is None:
+            raise(ImportError('pyaudio is not installed; use the null audio sink instead'))
+
+        def stream_callback(in_data, frame_count, time_info, status):
+            return (callback(frame_count), pyaudio.paContinue)
+
+        self.pyaudio = pyaudio.PyAudio()
+        self.stream = self.pyaudio.open(format=pyaudio.paInt16,
+                                        channels=1,
+                                        rate=self.sample_rate,
+                                        output=True,
+                                        frames_per_buffer=self.frames_per_buffer,
+                                        stream_callback=stream_callback)
+        self.stream.start_stream()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self.stream = None
+        if self.pyaudio is not None:
+            self.pyaudio.terminate()
+            self.pyaudio = None
+
+
+class NullAudioSink(object):
+    """
+    Stand-in for an audio device, e.g. for testing without a sound card: a thread requests a buffer from the callback
+    every buffer period, like a sound card would. If record is True, all rendered audio is kept in self.output.
+    """
+
+    def __init__(self, sample_rate=44100, frames_per_buffer=256, record=False):
+        self.sample_rate = sample_rate
+        self.frames_per_buffer = frames_per_buffer
+        self.record = record
+        self.output = []
+        self.n_buffers = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, callback):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, args=(callback, ), name='NullAudioSink')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, callback):
+        period = self.frames_per_buffer / self.sample_rate
+        next_time = time.time()
+        while not self._stopped.is_set():
+            data = callback(self.frames_per_buffer)
+            self.n_buffers += 1
+            if self.record:
+                self.output.append(np.frombuffer(data, dtype=np.int16))
+
+            next_time += period
+            time.sleep(max(0, next_time - time.time()))
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+            self._thread = None
+
+    def recorded(self):
+        """ Returns all recorded audio as a single int16 array """
+        if len(self.output) == 0:
+            return np.zeros(0, dtype=np.int16)
+        return np.concatenate(self.output)
+
+
+class AudioEngine(object):
+    """
+    Decodes all sounds once into contiguous mono int16 arrays, and plays them through one persistent output stream.
+
+    Sounds are started by putting them in a trigger queue. The audio callback starts all queued sounds at the start of
+    its next buffer, and mixes all playing sounds (voices) in a preallocated buffer. The latency between play() and
+    the sound reaching the output is therefore at most one buffer (frames_per_buffer / sample_rate seconds), plus the
+    latency of the audio device.
+
+    Parameters
+    ----------
+    sample_rate: int
+    frames_per_buffer: int
+        Number of frames mixed per callback
+    max_voices: int
+        Maximum number of simultaneously playing sounds. If more are started, the one that has played longest is cut.
+    sink: str {'pyaudio', 'null'} or sink object
+        Audio output. A sink object needs start(callback) and stop() methods, where callback(frame_count) returns
+        frame_count frames of int16 audio as bytes.
+    """
+
+    def __init__(self, sample_rate=44100, frames_per_buffer=256, max_voices=8, sink='pyaudio'):
+        self.sample_rate = sample_rate
+        self.frames_per_buffer = frames_per_buffer
+        self.sounds = {}
+
+        if sink == 'pyaudio':
+            sink = PyAudioSink(sample_rate=sample_rate, frames_per_buffer=frames_per_buffer)
+        elif sink == 'null':
+            sink = NullAudioSink(sample_rate=sample_rate, frames_per_buffer=frames_per_buffer)
+        self.sink = sink
+
+        # Voices: the sound array being played and the position in it, per slot (None = free)
+        self._triggers = deque()
+        self._voice_data = [None] * max_voices
+        self._voice_pos = np.zeros(max_voices, dtype=int)
+
+        # Mixing buffers. Mixing is done in int32 so that overlapping sounds can be clipped instead of wrapping around
+        self._mix_buffer = np.zeros(frames_per_buffer * 4, dtype=np.int32)
+        self._out_buffer = np.zeros(frames_per_buffer * 4, dtype=np.int16)
+
+        self.n_callbacks = 0
+        self.started = False
+
+    def load(self, file_name, sound_name):
+        """ Reads a .wav-file, and stores it as a mono int16 array at the engine's sample rate """
+
+        rate, data = wavfile.read(file_name)
+
+        # Mix down stereo sounds
+        if data.ndim == 2:
+            data = data.mean(axis=1)
+
+        # Convert to int16
+        if data.dtype == np.uint8:
+            data = (data.astype(np.float64) - 128) * 256
+        elif data.dtype == np.int32:
+            data = data / 65536
+        elif data.dtype.kind == 'f' and np.abs(data).max() <= 1:
+            data = data * 32767
+
+        if rate != self.sample_rate:
+            n_frames = int(round(data.shape[0] * self.sample_rate / rate))
+            data = np.interp(np.arange(n_frames) * (rate / self.sample_rate), np.arange(data.shape[0]), data)
+
+        self.sounds[sound_name] = np.ascontiguousarray(np.clip(np.round(data), -32768, 32767).astype(np.int16))
+
+    def start(self):
+        """ Opens the output stream """
+        if not self.started:
+            self.sink.start(self.render)
+            self.started = True
+
+    def stop(self):
+        """ Closes the output stream """
+        if self.started:
+            self.sink.stop()
+            self.started = False
+
+    def play(self, sound_name):
+        """ Starts playing the preloaded sound sound_name (at the start of the next audio buffer) """
+        self._triggers.append(self.sounds[sound_name])
+
+    def play_array(self, sound_array):
+        """ Starts playing a mono int16 array at the engine's sample rate """
+        self._triggers.append(np.ascontiguousarray(sound_array, dtype=np.int16))
+
+    def stop_all(self):
+        """ Stops all playing and queued sounds """
+        self._triggers.clear()
+        for i in range(len(self._voice_data)):
+            self._voice_data[i] = None
+
+    def _start_voice(self, data):
+        free = [i for i, voice in enumerate(self._voice_data) if voice is None]
+        if len(free) > 0:
+            i = free[0]
+        else:
+            i = int(np.argmax(self._voice_pos))
+        self._voice_data[i] = data
+        self._voice_pos[i] = 0
+
+    def render(self, frame_count):
+        """ Audio callback: mixes the next frame_count frames of all playing sounds, returned as int16 bytes """
+
+        if frame_count > self._mix_buffer.shape[0]:
+            self._mix_buffer = np.zeros(frame_count, dtype=np.int32)
+            self._out_buffer = np.zeros(frame_count, dtype=np.int16)
+
+        mix = self._mix_buffer[:frame_count]
+        mix[:] = 0
+
+        while len(self._triggers) > 0:
+            self._start_voice(self._triggers.popleft())
+
+        for i, data in enumerate(self._voice_data):
+            if data is None:
+                continue
+            pos = self._voice_pos[i]
+            n = min(frame_count, data.shape[0] - pos)
+            mix[:n] += data[pos:pos + n]
+            if pos + n >= data.shape[0]:
+                self._voice_data[i] = None
+            else:
+                self._voice_pos[i] = pos + n
+
+        np.clip(mix, -32768, 32767, out=mix)
+        out = self._out_buffer[:frame_count]
+        out[:] = mix
+        self.n_callbacks += 1
+        return out.tobytes()
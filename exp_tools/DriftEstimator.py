@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+DriftEstimator.py
+
+Online estimate of eye tracker drift from gaze during fixation periods, so that gaze positions can be compared to
+where the participant actually fixates, and recalibration is only needed when the drift becomes large.
+"""
+
+import numpy as np
+
+
+class DriftEstimator(object):
+    """
+    Collects gaze samples during fixation periods of a trial (add_sample), summarizes them per trial by their median
+    (end_trial), and estimates the drift of the current block as the median of the last window trial medians: the
+    offset of measured fixation from the fixation cross. Medians make the estimate robust against saccades and
+    blinks during fixation; samples further than max_deviation from the (drift-corrected) fixation cross are
+    ignored altogether.
+
+    Parameters
+    ----------
+    fixation_pos: tuple
+        Position of the fixation cross, in the units of the gaze samples (pixels)
+    pixels_per_degree: float
+    warn_threshold: float
+        Drift (degrees) above which recalibration is advised
+    max_deviation: float
+        Degrees
+    window: int
+        Number of most recent trials in the block estimate
+    min_samples: int
+        Minimal number of samples for a trial median
+    max_samples: int
+        Maximal number of samples per trial (further samples are ignored)
+    """
+
+    def __init__(self, fixation_pos, pixels_per_degree, warn_threshold=1.0, max_deviation=3.0, window=20,
+                 min_samples=5, max_samples=512):
+        self.fixation_pos = np.array(fixation_pos, dtype=float)
+        self.pixels_per_degree = pixels_per_degree
+        self.warn_threshold = warn_threshold
+        self.max_deviation = max_deviation
+        self.window = window
+        self.min_samples = min_samples
+
+        self.samples = np.zeros((max_samples, 2))
+        self.n_samples = 0
+        self.trial_medians = np.zeros((window, 2))
+        self.n_trials = 0
+        self.offset = np.zeros(2)   # drift estimate of the current block, in pixels
+        self.block = None
+        self.block_log = []         # (block, number of trials, drift x, drift y (degrees)) at the end of every block
+
+    def start_block(self, block):
+        """ Starts a new estimate (e.g. after a recalibration) """
+        self.block = block
+        self.n_trials = 0
+        self.n_samples = 0
+        self.offset = np.zeros(2)
+
+    def end_block(self):
+        """ Logs the estimate of the current block (it stays in use until the next start_block) """
+        self.block_log.append((self.block, self.n_trials) + tuple(float(v) for v in self.offset_deg()))
+
+    def expected_fixation(self):
+        """ Where gaze samples are expected during fixation: the fixation cross plus the drift """
+        return self.fixation_pos + self.offset
+
+    def start_trial(self):
+        """ Discards the samples collected so far, e.g. of a trial that stopped before its end_trial() """
+        self.n_samples = 0
+
+    def add_sample(self, gaze_pos):
+        """ Adds a gaze sample taken during fixation. Invalid samples and samples off fixation are ignored """
+        if self.n_samples == len(self.samples):
+            return
+        deviation = np.hypot(gaze_pos[0] - self.fixation_pos[0] - self.offset[0],
+                             gaze_pos[1] - self.fixation_pos[1] - self.offset[1])
+        if deviation <= self.max_deviation * self.pixels_per_degree:
+            self.samples[self.n_samples] = gaze_pos
+            self.n_samples += 1
+
+    def end_trial(self):
+        """ Updates the drift estimate with the samples of this trial. Returns the median fixation position of the
+        trial, or None if there were too few samples """
+        if self.n_samples < self.min_samples:
+            self.n_samples = 0
+            return None
+
+        trial_median = np.median(self.samples[:self.n_samples], axis=0)
+        self.n_samples = 0
+        self.trial_medians[self.n_trials % self.window] = trial_median
+        self.n_trials += 1
+        self.offset = np.median(self.trial_medians[:min(self.n_trials, self.window)], axis=0) - self.fixation_pos
+        return trial_median
+
+    def offset_deg(self):
+        return self.offset / self.pixels_per_degree
+
+    def drift_deg(self):
+        """ Size of the drift, in degrees """
+        return np.hypot(*self.offset_deg())
+
+    def needs_recalibration(self):
+        return self.drift_deg() > self.warn_threshold
+
+    def report(self):
+        """ Message for the operator """
+        x, y = self.offset_deg()
+        if self.n_trials == 0:
+            return 'Drift: no fixation data in this block'
+        if self.needs_recalibration():
+            return 'WARNING: estimated drift is %.2f degrees (x %.2f, y %.2f, %d trials): please recalibrate' % (
+                self.drift_deg(), x, y, self.n_trials)
+        return 'Estimated drift is %.2f degrees (x %.2f, y %.2f, %d trials): no need to recalibrate' % (
+            self.drift_deg(), x, y, self.n_trials)
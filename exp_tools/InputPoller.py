@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+InputPoller.py
+
+Polls keyboard / button box events and scanner pulses on a separate thread, so that response and trigger timing
+does not depend on the frame loop.
+"""
+
+import threading
+import time
+from collections import deque
+from warnings import warn
+
+from psychopy import core, event
+
+
+class InputPoller(object):
+    """
+    Polls input events at rate_hz on a separate thread, timestamps them relative to clock, and hands them to the
+    frame loop through a deque (appends and pops on a deque are atomic, so no locks are needed).
+
+    Backends
+    --------
+    'iohub': reads key presses from a psychopy.iohub keyboard device, which is polled in the ioHub process at
+        1 kHz and timestamps key presses in psychopy's time base. This gives millisecond-precision response times
+        for the keyboard and button box (which sends key presses), and for a scanner sending 't' key presses.
+        Keys injected into psychopy.event by the launchScan scanner emulator do not pass through ioHub: those in
+        emulated_keys are taken from psychopy's key buffer instead.
+    'psychopy': drains psychopy.event's key buffer. Keys injected by the scanner emulator are timestamped at
+        injection, so emulated pulses are exact, but real key presses only arrive in this buffer when pyglet events
+        are dispatched on the main thread (every flip), so their timestamps remain bound to the frame rate. A polling
+        thread would not improve on that (and would compete with the frame loop for the GIL), so this backend has
+        none: the buffer is drained by get_keys().
+
+    Parameters
+    ----------
+    clock: psychopy.core.Clock
+        Clock to which all event times are relative (the session clock)
+    backend: str {'psychopy', 'iohub'}
+    rate_hz: float
+        Polling rate
+    max_events: int
+        Maximum number of events kept between two calls to get_keys(); older events are dropped
+    emulated_keys: tuple of str
+        Keys injected by an emulator into psychopy.event (e.g. the launchScan sync key), which the 'iohub' backend
+        reads from there
+    """
+
+    def __init__(self, clock, backend='iohub', rate_hz=1000, max_events=1024, emulated_keys=()):
+        self.clock = clock
+        self.interval = 1.0 / rate_hz
+        self.queue = deque(maxlen=max_events)
+        self.emulated_keys = emulated_keys
+
+        self.io = None
+        self.keyboard = None
+        if backend == 'iohub':
+            try:
+                from psychopy.iohub import launchHubServer
+                self.io = launchHubServer()
+                self.keyboard = self.io.devices.keyboard
+            except Exception as e:
+                warn('Could not start ioHub keyboard (%s), falling back to psychopy.event' % e)
+                backend = 'psychopy'
+        self.backend = backend
+
+        self._running = threading.Event()   # Set while polling
+        self._stopped = threading.Event()   # Set when the thread should end
+        self._thread = None
+        if self.backend == 'iohub':
+            self._thread = threading.Thread(target=self._run, name='InputPoller')
+            self._thread.daemon = True
+
+    def start(self, paused=False):
+        """ Starts the polling thread (if any). If paused, it only starts polling at resume() """
+        if not paused:
+            self._running.set()
+        if self._thread is not None:
+            self._thread.start()
+
+    def pause(self):
+        """ Stops polling, e.g. while the eye tracker calibration reads the keyboard itself """
+        self._running.clear()
+
+    def resume(self):
+        """ Resumes polling after pause(). Events that occurred during the pause are discarded. """
+        if self.backend == 'iohub':
+            self.keyboard.clearEvents()
+        event.clearEvents(eventType='keyboard')
+        self.queue.clear()
+        self._running.set()
+
+    def stop(self):
+        """ Stops the polling thread, and the ioHub server if it was started """
+        self._stopped.set()
+        self._running.set()   # Wake up the thread if paused, so it can end
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=1)
+        if self.io is not None:
+            self.io.quit()
+            self.io = None
+
+    def _time_offset(self):
+        """ Offset to convert psychopy.core.getTime() into self.clock time """
+        return self.clock.getTime() - core.getTime()
+
+    def _poll_psychopy(self):
+        key_buffer = event._keyBuffer
+        if len(key_buffer) > 0:
+            offset = self._time_offset()
+            while len(key_buffer) > 0:
+                key = key_buffer.pop(0)
+                self.queue.append((key[0], key[-1] + offset))
+
+    def _poll_iohub(self):
+        presses = self.keyboard.getPresses()
+        if len(presses) > 0:
+            offset = self._time_offset()
+            for press in presses:
+                self.queue.append((press.key, press.time + offset))
+
+        # Real key presses are also put in psychopy's buffer (on flip). We use the ioHub ones, so discard these, but
+        # keep the keys of an emulator (which only injects into psychopy's buffer)
+        key_buffer = event._keyBuffer
+        if len(key_buffer) > 0:
+            offset = self._time_offset()
+            while len(key_buffer) > 0:
+                key = key_buffer.pop(0)
+                if key[0] in self.emulated_keys:
+                    self.queue.append((key[0], key[-1] + offset))
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._running.wait()
+            if self._stopped.is_set():
+                break
+            self._poll_iohub()
+            time.sleep(self.interval)
+
+    def get_keys(self):
+        """ Returns all events since the previous call, as a list of (key, time) tuples. Time is on self.clock. """
+        if self._thread is None and self._running.is_set():
+            self._poll_psychopy()
+        keys = []
+        while len(self.queue) > 0:
+            keys.append(self.queue.popleft())
+        return keys
+
+    def clear(self):
+        """ Discards all events received so far """
+        self.queue.clear()
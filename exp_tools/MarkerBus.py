@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+MarkerBus.py
+
+One timestamped stream of event markers (trial and phase starts, responses, sounds, ...) for all recordings: the
+eye tracker's EDF file, the EEG (StarStim triggers) and a marker file next to the data. The frame loop only writes
+a marker into a preallocated ring; a background thread per sink hands new markers to it, and the sink does the
+formatting and the (possibly blocking) I/O.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+
+class MarkerBus(object):
+    """
+    Ring of capacity markers (code, time, label) with a single writer (the frame loop). mark() only fills one
+    preallocated slot. Every sink has its own background thread, which delivers the new markers to it every interval
+    seconds, so that a slow sink (e.g. the paced EDF messages) never delays another. If a sink falls a whole ring
+    behind, the oldest markers are lost for it (counted in n_lost).
+
+    A sink is any object with a write(codes, times, labels) method, which receives arrays of new markers in order.
+    A sink with immediate = True (of which write never blocks, e.g. because it only queues for its own I/O thread)
+    is written by mark() itself instead, so that it gets every marker without delay.
+
+    Parameters
+    ----------
+    sinks: list
+    capacity: int
+    interval: float
+        Seconds between deliveries
+    """
+
+    # Marker codes. Codes are sent as EEG triggers, so keep them within 1-255; code 0 is a text-only marker (e.g. the
+    # trial parameters), which is not sent to the EEG
+    TEXT = 0
+    TRIAL_START = 1
+    TRIAL_STOP = 2
+    KEY_EVENT = 3
+    SOUND = 4
+    PHASE_START = 10    # + phase number
+
+    def __init__(self, sinks=(), capacity=4096, interval=0.005):
+        self.sinks = [sink for sink in sinks if not getattr(sink, 'immediate', False)]
+        self.immediate_sinks = [sink for sink in sinks if getattr(sink, 'immediate', False)]
+        self.capacity = capacity
+        self.interval = interval
+
+        self.codes = np.zeros(capacity, dtype=np.int32)
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.labels = np.empty(capacity, dtype=object)
+        self.n_marked = 0       # markers written so far; the next goes to slot n_marked % capacity
+        self.n_delivered = [0] * len(self.sinks)    # per sink
+        self.n_lost = [0] * len(self.sinks)
+
+        self._stopped = threading.Event()
+        self._threads = [threading.Thread(target=self._run, args=(i, ), name='MarkerBus-%s' % type(sink).__name__)
+                         for i, sink in enumerate(self.sinks)]
+        for thread in self._threads:
+            thread.daemon = True
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def mark(self, code, t, label=None):
+        """ Adds a marker. Constant time, never blocks """
+        slot = self.n_marked % self.capacity
+        self.codes[slot] = code
+        self.times[slot] = t
+        self.labels[slot] = label
+        self.n_marked += 1   # only now is the marker visible to the delivering threads
+        for sink in self.immediate_sinks:
+            sink.write((code, ), (t, ), (label, ))
+
+    def deliver(self, i):
+        """ Hands all new markers to sink i. Called by its background thread, and by stop() """
+        n_marked, n_delivered = self.n_marked, self.n_delivered[i]
+        if n_marked - n_delivered > self.capacity:
+            self.n_lost[i] += n_marked - n_delivered - self.capacity
+            n_delivered = n_marked - self.capacity
+        if n_marked == n_delivered:
+            return
+
+        slots = np.arange(n_delivered, n_marked) % self.capacity
+        codes, times, labels = self.codes[slots], self.times[slots], self.labels[slots]
+        self.n_delivered[i] = n_marked
+        self.sinks[i].write(codes, times, labels)
+
+    def _run(self, i):
+        while not self._stopped.wait(self.interval):
+            self.deliver(i)
+
+    def stop(self):
+        """ Delivers the last markers, stops the threads and closes the sinks that can be closed """
+        self._stopped.set()
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join(timeout=1)
+        for i in range(len(self.sinks)):
+            self.deliver(i)
+        for sink in self.sinks + self.immediate_sinks:
+            if hasattr(sink, 'close'):
+                sink.close()
+
+
+class TrackerSink(object):
+    """
+    Writes markers as EDF messages. The message carries the time since the marker (in ms) as offset, so that the
+    EyeLink timestamps it at the time of the marker rather than at arrival. Markers without a label are written as
+    'marker <code>'. Messages are sent pause seconds apart, so as not to flood the link (this only delays the tracker
+    sink's own thread).
+    """
+
+    def __init__(self, tracker, clock, pause=0.0005):
+        self.tracker = tracker
+        self.clock = clock
+        self.pause = pause
+
+    def write(self, codes, times, labels):
+        for code, t, label in zip(codes, times, labels):
+            offset = max(0, int(round((self.clock.getTime() - t) * 1000)))
+            self.tracker.log('%d %s' % (offset, label if label is not None else 'marker %d' % code))
+            time.sleep(self.pause)
+
+
+class TriggerSink(object):
+    """ Sends the codes of markers (except text-only markers) as EEG triggers through a TriggerDispatcher. Sending
+    only queues the trigger for the dispatcher's I/O thread, so this sink is written by mark() itself """
+
+    immediate = True
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+
+    def write(self, codes, times, labels):
+        for code, t in zip(codes, times):
+            if code != MarkerBus.TEXT:
+                self.dispatcher.send(int(code), t)
+
+
+class FileSink(object):
+    """ Appends markers to a tab-separated file with columns time, code and label """
+
+    def __init__(self, file_name):
+        self.file = open(file_name, 'w')
+        self.file.write('time\tcode\tlabel\n')
+
+    def write(self, codes, times, labels):
+        self.file.writelines(['%.6f\t%d\t%s\n' % (t, code, '' if label is None else label.replace('\t', ' '))
+                              for code, t, label in zip(codes, times, labels)])
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+PulseRecorder.py
+
+Session-wide record of scanner pulses (volume triggers), with an online linear fit of the actual TR.
+"""
+
+from __future__ import division
+import numpy as np
+import pandas as pd
+
+
+class PulseRecorder(object):
+    """
+    Keeps a preallocated array of pulse times per block, and fits pulse_time = intercept + TR * volume_nr online
+    (running sums, so every update is O(1)).
+
+    The fit is used to predict upcoming volume times, and to flag duplicate pulses (a second trigger arriving within
+    duplicate_window TRs of the previous volume) and missed pulses (no trigger within missed_tolerance TRs after
+    the predicted volume time). Missed volumes are inserted at their predicted time, so that trials counting volumes
+    stay locked to the scanner. If a missed pulse arrives after all, it replaces the inserted volume.
+
+    Parameters
+    ----------
+    TR: float
+        Nominal repetition time in seconds. Used until at least two pulses in the current block are recorded.
+    n_blocks: int
+        Number of blocks (scanner runs) to keep pulses for
+    max_volumes: int
+        Maximum number of volumes per block
+    duplicate_window: float
+        Fraction of a TR within which a second pulse is considered a duplicate
+    missed_tolerance: float
+        Fraction of a TR after the predicted volume time after which a pulse is considered missed
+    """
+
+    # Flags per recorded volume
+    PULSE = 1    # Trigger received on time
+    MISSED = 2   # No trigger received; time is the predicted volume time
+    LATE = 3     # Trigger received after the volume was already flagged as missed
+
+    def __init__(self, TR, n_blocks=8, max_volumes=1000, duplicate_window=0.5, missed_tolerance=0.2):
+        self.TR = TR
+        self.n_blocks = n_blocks
+        self.max_volumes = max_volumes
+        self.duplicate_window = duplicate_window
+        self.missed_tolerance = missed_tolerance
+
+        self.pulse_times = np.zeros((n_blocks, max_volumes))
+        self.flags = np.zeros((n_blocks, max_volumes), dtype=np.int8)
+        self.n_volumes = np.zeros(n_blocks, dtype=int)
+        self.duplicate_times = np.zeros((n_blocks, max_volumes))
+        self.n_duplicates = np.zeros(n_blocks, dtype=int)
+
+        self.block = 0
+        self._reset_fit()
+
+    def _reset_fit(self):
+        """ Running sums for the least-squares fit of pulse time on volume number """
+        self._n = 0
+        self._sum_v = self._sum_t = self._sum_vv = self._sum_vt = 0.0
+
+    def _add_to_fit(self, volume, t):
+        self._n += 1
+        self._sum_v += volume
+        self._sum_t += t
+        self._sum_vv += volume * volume
+        self._sum_vt += volume * t
+
+    def start_block(self, block):
+        """ Starts recording pulses of a new block (scanner run). Any previous pulses of this block are discarded. """
+        self.block = block
+        self.n_volumes[block] = 0
+        self.n_duplicates[block] = 0
+        self._reset_fit()
+
+    def fit(self):
+        """
+        Returns (intercept, TR) of the linear fit of pulse times in the current block. With fewer than two pulses,
+        the nominal TR is used.
+        """
+
+        if self._n == 0:
+            return None, self.TR
+
+        if self._n == 1:
+            return self._sum_t - self.TR * self._sum_v, self.TR
+
+        denominator = self._n * self._sum_vv - self._sum_v ** 2
+        slope = (self._n * self._sum_vt - self._sum_v * self._sum_t) / denominator
+        intercept = (self._sum_t - slope * self._sum_v) / self._n
+        return intercept, slope
+
+    def predict(self, volume):
+        """ Predicted time (session clock) of volume number volume in the current block """
+        intercept, slope = self.fit()
+        if intercept is None:
+            return None
+        return intercept + slope * volume
+
+    def next_pulse_time(self, t=None):
+        """ Predicted time of the first volume after time t (or after the last recorded volume if t is None) """
+        n = self.n_volumes[self.block]
+        if n == 0:
+            return None
+
+        next_t = self.predict(n)
+        if t is not None and next_t <= t:
+            intercept, slope = self.fit()
+            next_t = intercept + slope * np.floor((t - intercept) / slope + 1)
+        return next_t
+
+    def _append(self, t, flag):
+        block, n = self.block, self.n_volumes[self.block]
+        if n >= self.max_volumes:
+            return False
+        self.pulse_times[block, n] = t
+        self.flags[block, n] = flag
+        self.n_volumes[block] += 1
+        if flag != self.MISSED:
+            self._add_to_fit(n, t)
+        return True
+
+    def record(self, t):
+        """
+        Records a scanner pulse received at time t.
+
+        Returns
+        -------
+        n_volumes: int
+            Number of new volumes this pulse represents: 0 for a duplicate (or late) pulse, 1 normally, and more if
+            pulses were missed before this one.
+        """
+
+        block, n = self.block, self.n_volumes[self.block]
+        if n == 0:
+            self._append(t, self.PULSE)
+            return 1
+
+        _, tr = self.fit()
+        last_t = self.pulse_times[block, n - 1]
+
+        if t - last_t < self.duplicate_window * tr:
+            if self.flags[block, n - 1] == self.MISSED:
+                # The volume we assumed missed did arrive, only late. Keep the actual time.
+                self.pulse_times[block, n - 1] = t
+                self.flags[block, n - 1] = self.LATE
+                self._add_to_fit(n - 1, t)
+            elif self.n_duplicates[block] < self.max_volumes:
+                self.duplicate_times[block, self.n_duplicates[block]] = t
+                self.n_duplicates[block] += 1
+            return 0
+
+        # Fill in any volumes that were missed between the last one and this one
+        n_missed = int(np.round((t - last_t) / tr)) - 1
+        for i in range(n_missed):
+            self._append(last_t + (i + 1) * tr, self.MISSED)
+
+        self._append(t, self.PULSE)
+        return n_missed + 1
+
+    def check_missed(self, t):
+        """
+        Checks whether the next volume is overdue at time t. If so, it is recorded as missed (at its predicted time).
+        Call this every frame in which the scanner should be sending pulses.
+
+        Returns
+        -------
+        n_volumes: int
+            1 if a missed volume was recorded, 0 otherwise
+        """
+
+        n = self.n_volumes[self.block]
+        if n == 0:
+            return 0
+
+        _, tr = self.fit()
+        expected_t = self.predict(n)
+        if t > expected_t + self.missed_tolerance * tr:
+            self._append(expected_t, self.MISSED)
+            return 1
+        return 0
+
+    def n_missed(self, block=None):
+        """ Number of volumes in block (default: current) for which no (timely) pulse was received """
+        block = self.block if block is None else block
+        return int(np.sum(self.flags[block, :self.n_volumes[block]] != self.PULSE))
+
+    def to_dataframe(self):
+        """ Returns all recorded volumes and duplicate pulses of all blocks as a pd.DataFrame """
+
+        flag_names = {self.PULSE: 'pulse', self.MISSED: 'missed', self.LATE: 'late'}
+        dfs = []
+        for block in range(self.n_blocks):
+            n = self.n_volumes[block]
+            dfs.append(pd.DataFrame({'block': block,
+                                     'volume': np.arange(n),
+                                     'time': self.pulse_times[block, :n],
+                                     'flag': [flag_names[f] for f in self.flags[block, :n]]}))
+            n_dup = self.n_duplicates[block]
+            dfs.append(pd.DataFrame({'block': block,
+                                     'volume': -1,
+                                     'time': self.duplicate_times[block, :n_dup],
+                                     'flag': 'duplicate'}, index=np.arange(n_dup)))
+
+        return pd.concat(dfs, ignore_index=True)[['block', 'volume', 'time', 'flag']]
+
+    def estimate_tr(self, block):
+        """ Returns (intercept, TR) fitted on all received pulses of block, or (None, nominal TR) if there are < 2 """
+        n = self.n_volumes[block]
+        received = self.flags[block, :n] != self.MISSED
+        if received.sum() < 2:
+            return None, self.TR
+
+        slope, intercept = np.polyfit(np.arange(n)[received], self.pulse_times[block, :n][received], 1)
+        return intercept, slope
+
+    def summary(self, block=None):
+        """ Returns a string describing the pulses of block (default: current) """
+        block = self.block if block is None else block
+        _, tr = self.estimate_tr(block)
+
+        return 'Block %d: %d volumes, estimated TR = %.4fs (nominal %.4fs), %d missed/late, %d duplicate pulses' % (
+            block, self.n_volumes[block], tr, self.TR, self.n_missed(block), self.n_duplicates[block])
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+RealTime.py
+
+Real-time execution profile for the stimulus (render) thread on Linux: a real-time scheduling policy (SCHED_FIFO or
+SCHED_RR), pinning to a single (preferably isolated) CPU core, and locking all memory to prevent page faults.
+Python 2 has no os.sched_* functions, so libc is called through ctypes where they are missing.
+
+Scheduling policy and CPU affinity are set for the *calling thread* only. Call apply_realtime_profile() from the
+thread that draws and flips, after background threads (input polling, audio) have been started, so that these keep
+running on the other cores at normal priority.
+"""
+
+from __future__ import division
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+
+import numpy as np
+
+SCHED_OTHER, SCHED_FIFO, SCHED_RR = 0, 1, 2
+MCL_CURRENT, MCL_FUTURE = 1, 2
+_policies = {'fifo': SCHED_FIFO, 'rr': SCHED_RR, 'other': SCHED_OTHER}
+_policy_names = dict((v, k) for k, v in _policies.items())
+
+
+class _SchedParam(ctypes.Structure):
+    _fields_ = [('sched_priority', ctypes.c_int)]
+
+
+def _libc():
+    return ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+
+def _oserror():
+    errno = ctypes.get_errno()
+    return OSError(errno, os.strerror(errno))
+
+
+def _parse_cpu_list(cpu_list):
+    """ Parses a kernel cpu list such as '2-3,6' into [2, 3, 6] """
+    cpus = []
+    for part in cpu_list.strip().split(','):
+        if part == '':
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def isolated_cpus():
+    """ CPU cores that are isolated from the scheduler (isolcpus= kernel parameter) """
+    try:
+        with open('/sys/devices/system/cpu/isolated') as f:
+            return _parse_cpu_list(f.read())
+    except IOError:
+        return []
+
+
+def get_affinity():
+    """ CPU cores that the calling thread may run on """
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+
+    mask = (ctypes.c_ulong * 16)()
+    if _libc().sched_getaffinity(0, ctypes.sizeof(mask), mask) != 0:
+        raise _oserror()
+    bits = ctypes.sizeof(ctypes.c_ulong) * 8
+    return [cpu for cpu in range(len(mask) * bits) if mask[cpu // bits] >> (cpu % bits) & 1]
+
+
+def set_affinity(cpus):
+    """ Pins the calling thread to cpus """
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+        return
+
+    mask = (ctypes.c_ulong * 16)()
+    bits = ctypes.sizeof(ctypes.c_ulong) * 8
+    for cpu in cpus:
+        mask[cpu // bits] |= 1 << (cpu % bits)
+    if _libc().sched_setaffinity(0, ctypes.sizeof(mask), mask) != 0:
+        raise _oserror()
+
+
+def get_scheduler():
+    """ Scheduling policy name and priority of the calling thread """
+    if hasattr(os, 'sched_getscheduler'):
+        return _policy_names.get(os.sched_getscheduler(0), 'other'), os.sched_getparam(0).sched_priority
+
+    libc = _libc()
+    policy = libc.sched_getscheduler(0)
+    param = _SchedParam()
+    if policy < 0 or libc.sched_getparam(0, ctypes.byref(param)) != 0:
+        raise _oserror()
+    return _policy_names.get(policy, 'other'), param.sched_priority
+
+
+def set_scheduler(policy, priority):
+    """ Sets the scheduling policy ('fifo', 'rr' or 'other') and priority of the calling thread """
+    if hasattr(os, 'sched_setscheduler'):
+        os.sched_setscheduler(0, _policies[policy], os.sched_param(priority))
+        return
+
+    if _libc().sched_setscheduler(0, _policies[policy], ctypes.byref(_SchedParam(priority))) != 0:
+        raise _oserror()
+
+
+def max_priority(policy):
+    if hasattr(os, 'sched_get_priority_max'):
+        return os.sched_get_priority_max(_policies[policy])
+    return _libc().sched_get_priority_max(_policies[policy])
+
+
+def lock_memory():
+    """ Locks all current and future memory of the process in RAM """
+    if _libc().mlockall(MCL_CURRENT | MCL_FUTURE) != 0:
+        raise _oserror()
+
+
+def apply_realtime_profile(policy='fifo', priority=None, cpu=None, lock_memory_pages=True):
+    """
+    Applies as much of the real-time profile as permitted, and reports what was achieved. Nothing raises: settings
+    that fail (e.g. without CAP_SYS_NICE / CAP_IPC_LOCK or a high enough RLIMIT_MEMLOCK) are listed in 'errors'.
+
+    Parameters
+    ----------
+    policy: str {'fifo', 'rr'}
+        Real-time scheduling policy
+    priority: int or None
+        Real-time priority. Defaults to half the maximum priority, which leaves room for kernel threads (e.g. of
+        USB / graphics drivers) that should run before the render thread.
+    cpu: int or None
+        CPU core to pin the calling thread to. Defaults to the first isolated core, or else the last allowed core.
+    lock_memory_pages: bool
+        mlockall() all memory
+
+    Returns
+    -------
+    profile: dict
+        With the achieved 'scheduler', 'priority', 'affinity', 'memory_locked' and 'nice', and 'errors'
+    """
+
+    profile = {'platform': sys.platform, 'errors': []}
+
+    if not sys.platform.startswith('linux'):
+        profile['errors'].append('real-time profile is only supported on Linux')
+        if sys.platform == 'darwin':
+            # At least prevent App Nap from throttling the process
+            try:
+                import appnope
+                appnope.nope()
+                profile['app_nap_disabled'] = True
+            except ImportError:
+                profile['errors'].append('appnope not installed')
+        profile['nice'] = os.nice(0)
+        return profile
+
+    # CPU affinity
+    try:
+        if cpu is None:
+            isolated = isolated_cpus()
+            cpu = isolated[0] if len(isolated) > 0 else get_affinity()[-1]
+        set_affinity([cpu])
+        profile['isolated_cpus'] = isolated_cpus()
+    except (OSError, IndexError) as e:
+        profile['errors'].append('affinity: %s' % e)
+
+    # Scheduling policy. If real-time scheduling is not permitted, at least try to get the highest nice value
+    try:
+        if priority is None:
+            priority = max(1, max_priority(policy) // 2)
+        set_scheduler(policy, priority)
+    except OSError as e:
+        profile['errors'].append('scheduler: %s' % e)
+        try:
+            os.nice(-20 - os.nice(0))
+        except OSError as e:
+            profile['errors'].append('nice: %s' % e)
+
+    # Memory locking
+    profile['memory_locked'] = False
+    if lock_memory_pages:
+        try:
+            lock_memory()
+            profile['memory_locked'] = True
+        except OSError as e:
+            profile['errors'].append('mlockall: %s' % e)
+
+    # Report what was achieved, rather than what was asked for
+    profile['scheduler'], profile['priority'] = get_scheduler()
+    profile['affinity'] = get_affinity()
+    profile['nice'] = os.nice(0)
+
+    return profile
+
+
+def jitter_self_test(duration=1.0, interval=0.001, screen=None, n_frames=120, max_latency=0.001):
+    """
+    Measures how precisely the calling thread is scheduled: the wake-up latency of duration seconds of short sleeps
+    and, if a screen (psychopy.visual.Window) is given, the intervals of n_frames flips.
+
+    The test passes if the 99th percentile of wake-up latencies is below max_latency (seconds) and no frames are
+    dropped (an interval longer than 1.5 times the median interval).
+
+    Returns
+    -------
+    result: dict
+        Latencies and frame interval statistics in ms, and 'passed'
+    """
+
+    latencies = []
+    end_time = time.time() + duration
+    while time.time() < end_time:
+        start = time.time()
+        time.sleep(interval)
+        latencies.append(time.time() - start - interval)
+    latencies = np.array(latencies)
+
+    result = {'wakeup_latency_mean_ms': latencies.mean() * 1000,
+              'wakeup_latency_p99_ms': np.percentile(latencies, 99) * 1000,
+              'wakeup_latency_max_ms': latencies.max() * 1000}
+    passed = np.percentile(latencies, 99) < max_latency
+
+    if screen is not None:
+        flip_times = np.zeros(n_frames)
+        for frame_n in range(n_frames):
+            screen.flip()
+            flip_times[frame_n] = time.time()
+        intervals = np.diff(flip_times)
+
+        result['frame_interval_median_ms'] = np.median(intervals) * 1000
+        result['frame_interval_sd_ms'] = intervals.std() * 1000
+        result['n_dropped_frames'] = int(np.sum(intervals > 1.5 * np.median(intervals)))
+        passed = passed and result['n_dropped_frames'] == 0
+
+    result['passed'] = bool(passed)
+    return result
@@ -8,8 +8,9 @@ Copyright (c) 2009 TK. All rights reserved.
 """
 
 
-import os, sys, datetime
+import os, sys, datetime, glob, gc
 import subprocess, logging
+from collections import deque
 import pickle, datetime, time
 
 import scipy as sp
@@ -25,9 +26,6 @@ from psychopy import visual, core, event, misc
 # from VisionEgg.Core import *
 import pygame
 from pygame.locals import *
-from scipy.io import wavfile
-
-import pyaudio, wave
 
 from pylink import *
 
@@ -35,6 +33,11 @@ import pygaze
 from pygaze import libscreen
 #from pygaze import eyetracker
 from .eyelink import eyetracker
+from .InputPoller import InputPoller
+from .AudioEngine import AudioEngine
+from .RealTime import apply_realtime_profile, jitter_self_test
+from .TriggerDispatcher import TriggerDispatcher
+from .MarkerBus import MarkerBus, TrackerSink, TriggerSink, FileSink
 from IPython import embed as shell
 
 
@@ -45,6 +48,8 @@ class Session(object):
         self.subject_initials = subject_initials
         self.index_number = index_number
 
+        self.audio = None
+        self.sounds = {}
         if sound_system:
             self.setup_sound_system()
         # pygame.mixer.init()
@@ -58,33 +63,175 @@ class Session(object):
         self.outputDict = {'parameterArray': [], 'eventArray' : []}
         self.events = []
         self.stopped = False
-
-    def setup_sound_system(self):
-        """initialize pyaudio backend, and create dictionary of sounds."""
-        self.pyaudio = pyaudio.PyAudio()
-        self.sound_files = subprocess.Popen('ls ' + os.path.join(os.environ['EXPERIMENT_HOME'], 'sounds', '*.wav'), shell=True, stdout=subprocess.PIPE).communicate()[0].split('\n')[0:-1]
-        self.sounds = {}
+        self.input_poller = None
+        self.last_flip_time = None
+        self.marker_bus = None
+        self.blink_monitor = None
+
+        # Steps that prepare the next trial, run in idle frames of the current trial
+        self.prefetch_steps = deque()
+        self.prefetch_budget = 0.5   # Only start a step in the first half of a frame
+        self.prefetch_overruns = 0
+
+        # Garbage collection control (see setup_gc_control)
+        self.gc_control = False
+        self.in_critical_section = False
+        self.gc_pauses = []
+        self._gc_start = None
+        self.realtime_profile = None
+
+    def setup_input_poller(self, backend='iohub', rate_hz=1000, paused=False):
+        """Start polling keyboard, button box and scanner pulse events on a separate thread. After this, all
+        key events should be read with self.input_poller.get_keys() instead of psychopy.event.getKeys(). If paused,
+        the thread is started but only polls after self.input_poller.resume(), so that the keyboard can still be read
+        with psychopy.event until then (e.g. by launchScan, waiting for the first scanner pulse)"""
+        self.input_poller = InputPoller(clock=self.clock, backend=backend, rate_hz=rate_hz)
+        self.input_poller.start(paused=paused)
+
+    def marker_sinks(self):
+        """Sinks of the marker bus: the marker file. Subclasses add their recordings (eye tracker, EEG)"""
+        return [FileSink(self.output_file + '_markers.tsv')]
+
+    def setup_marker_bus(self, capacity=4096, interval=0.005):
+        """Start the marker bus: all event markers (see mark) are written to every sink from a background thread"""
+        self.marker_bus = MarkerBus(self.marker_sinks(), capacity=capacity, interval=interval)
+        self.marker_bus.start()
+
+    def stop_marker_bus(self):
+        """Deliver the last markers and close the sinks"""
+        if self.marker_bus is not None:
+            self.marker_bus.stop()
+            self.marker_bus = None
+
+    def mark(self, code, t=None, label=None):
+        """Marks an event with code (see the codes of MarkerBus) at time t of the session clock (default: now), with
+        an optional text label (e.g. for the EDF message). Cheap enough for the frame loop. Without a marker bus, the
+        label is only logged to the tracker, if there is one"""
+        if t is None:
+            t = self.clock.getTime()
+        if self.marker_bus is not None:
+            self.marker_bus.mark(code, t, label)
+        elif label is not None and getattr(self, 'tracker', None):
+            self.tracker.log(label)
+            time.sleep(0.0005)
+
+    def schedule_prefetch(self, steps):
+        """Schedule functions (steps) that prepare the next trial. Trials call prefetch_step() in idle frames, which
+        runs one step per frame; finish_prefetch() runs all that are left."""
+        self.prefetch_steps = deque(steps)
+
+    def prefetch_step(self):
+        """Run the next prefetch step, but only if this frame has just started (less than prefetch_budget frame
+        periods since the last flip), so that the step does not delay the next flip. Returns True if a step was run.
+        Steps that still end after the next flip are counted in prefetch_overruns."""
+        if len(self.prefetch_steps) == 0:
+            return False
+
+        if self.last_flip_time is not None:
+            frame_period = self.screen.monitorFramePeriod
+            if core.getTime() - self.last_flip_time > self.prefetch_budget * frame_period:
+                return False
+
+        self.prefetch_steps.popleft()()
+
+        if self.last_flip_time is not None and core.getTime() - self.last_flip_time > frame_period:
+            self.prefetch_overruns += 1
+        return True
+
+    def finish_prefetch(self):
+        """Run all prefetch steps that were not run yet"""
+        while len(self.prefetch_steps) > 0:
+            self.prefetch_steps.popleft()()
+
+    def setup_realtime(self, policy='fifo', priority=None, cpu=None, lock_memory=True, self_test=True):
+        """Apply the real-time profile (real-time scheduling, CPU pinning and memory locking; see RealTime.py) to the
+        calling (render) thread, and check how well it works with a jitter self-test. Call this after the screen and
+        all background threads are set up, before the first block. The achieved settings are saved with the session
+        (outputDict['realtime_profile'])."""
+        self.realtime_profile = apply_realtime_profile(policy=policy, priority=priority, cpu=cpu,
+                                                       lock_memory_pages=lock_memory)
+        if self_test:
+            self.realtime_profile['self_test'] = jitter_self_test(screen=getattr(self, 'screen', None))
+        self.outputDict['realtime_profile'] = self.realtime_profile
+
+        for error in self.realtime_profile['errors']:
+            print('Warning: real-time profile: %s' % error)
+        if self_test and not self.realtime_profile['self_test']['passed']:
+            print('Warning: real-time self-test failed: %s' % self.realtime_profile['self_test'])
+        return self.realtime_profile
+
+    def setup_gc_control(self):
+        """Take over garbage collection: the collector is disabled during critical sections (trial phases 1 to 6, see
+        Trial.phase_forward), and a full collection is run in idle frames of the ITI (as a prefetch step) instead.
+        Call this when all stimuli have been made: everything that exists then is collected once and, where
+        supported (python >= 3.7), frozen, so that later collections do not have to traverse it.
+        GC pauses are recorded in gc_pauses as (time, frame number, duration, generation, n collected), so that
+        dropped frames can be attributed to a collection, or not."""
+        self.collect_garbage()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+        if hasattr(gc, 'callbacks'):
+            # Also record collections that are not started by collect_garbage (outside critical sections)
+            gc.callbacks.append(self._gc_callback)
+        self.gc_control = True
+
+    def start_critical_section(self):
+        """Disable the garbage collector until end_critical_section()"""
+        if self.gc_control and not self.in_critical_section:
+            gc.disable()
+            self.in_critical_section = True
+
+    def end_critical_section(self, collect=True):
+        """Enable the garbage collector again. If collect, a full collection is scheduled as a prefetch step, so
+        that it runs in an idle frame (or in finish_prefetch())"""
+        if self.in_critical_section:
+            gc.enable()
+            self.in_critical_section = False
+            if collect:
+                self.prefetch_steps.append(self.collect_garbage)
+
+    def collect_garbage(self, generation=2):
+        """Run a garbage collection now, and record its duration"""
+        start_time = core.getTime()
+        collected = gc.collect(generation)
+        if not hasattr(gc, 'callbacks'):
+            self._record_gc_pause(start_time, core.getTime() - start_time, generation, collected)
+        return collected
+
+    def _gc_callback(self, phase, info):
+        if phase == 'start':
+            self._gc_start = core.getTime()
+        elif self._gc_start is not None:
+            self._record_gc_pause(self._gc_start, core.getTime() - self._gc_start, info['generation'],
+                                  info['collected'])
+            self._gc_start = None
+
+    def _record_gc_pause(self, start_time, duration, generation, collected):
+        # Frame number: index of the frame interval in which the collection started (if intervals are recorded)
+        screen = getattr(self, 'screen', None)
+        if screen is not None and screen.recordFrameIntervals:
+            frame_n = len(screen.frameIntervals)
+        else:
+            frame_n = -1
+        self.gc_pauses.append((start_time, frame_n, duration, generation, collected))
+
+    def setup_sound_system(self, sink='pyaudio'):
+        """initialize the audio engine (one persistent output stream), and decode all sounds into self.sounds.
+        Use sink='null' to run without a sound card."""
+        self.audio = AudioEngine(sample_rate=44100, sink=sink)
+        self.sounds = self.audio.sounds
+        self.sound_files = sorted(glob.glob(os.path.join(os.environ['EXPERIMENT_HOME'], 'sounds', '*.wav')))
         for sf in self.sound_files:
             self.read_sound_file(file_name = sf)
-        # print self.sounds
+        self.audio.start()
 
     def read_sound_file(self, file_name, sound_name = None):
-        """Read sound file from file_name, and append to self.sounds with name as key"""
+        """Read sound file from file_name (once), and add to self.sounds with name as key"""
         if sound_name == None:
             sound_name = os.path.splitext(os.path.split(file_name)[-1])[0]
 
-        rate, data = wavfile.read(file_name)
-        # create stream data assuming 2 channels, i.e. stereo data, and use np.float32 data format
-        stream_data = data.astype(np.int16)
-
-        # check data formats - is this stereo sound? If so, we need to fix it.
-        wf = wave.open(file_name, 'rb')
-        # print sound_name
-        # print wf.getframerate(), wf.getnframes(), wf.getsampwidth(), wf.getnchannels()
-        if wf.getnchannels() == 2:
-            stream_data = stream_data[::2]
-
-        self.sounds.update({sound_name: stream_data})
+        # mono np.int16 at 44100 Hz; stereo sounds are mixed down
+        self.audio.load(file_name, sound_name)
 
     def create_screen(self, size = (2560, 1440), full_screen = False, background_color = (0.0,0.0,0.0),
                         gamma_scale = (2.475,2.25,2.15), physical_screen_size = (62, 32), physical_screen_distance =
@@ -163,6 +310,15 @@ class Session(object):
 
     def close(self):
         """close screen and save data"""
+        self.stop_marker_bus()
+        if self.gc_control:
+            self.end_critical_section(collect=False)
+            if hasattr(gc, 'callbacks') and self._gc_callback in gc.callbacks:
+                gc.callbacks.remove(self._gc_callback)
+        if self.input_poller is not None:
+            self.input_poller.stop()
+        if self.audio is not None:
+            self.audio.stop()
         pygame.mixer.quit()
         self.screen.close()
         with open(self.output_file + '_outputDict.pickle', 'wb') as f:
@@ -177,42 +333,12 @@ class Session(object):
         """docstring for play_sound"""
         if type(sound_index) == int:
             sound_index = str(sound_index)
-        # assuming 44100 Hz, mono channel np.int16 format for the sounds
-        stream_data = self.sounds[sound_index]
-
-        self.frame_counter = 0
-        def callback(in_data, frame_count, time_info, status):
-            data = stream_data[self.frame_counter:self.frame_counter+frame_count]
-            self.frame_counter += frame_count
-            return (data, pyaudio.paContinue)
-
-        # open stream using callback (3)
-        stream = self.pyaudio.open(format=pyaudio.paInt16,
-                        channels=1,
-                        rate=44100,
-                        output=True,
-                        stream_callback=callback)
-
-        stream.start_stream()
-        # stream.write(stream_data)
+        # mixed into the running output stream at the start of the next audio buffer
+        self.audio.play(sound_index)
 
     def play_np_sound(self, sound_array):
         # assuming 44100 Hz, mono channel np.int16 format for the sounds
-
-        self.frame_counter = 0
-        def callback(in_data, frame_count, time_info, status):
-            data = sound_array[self.frame_counter:self.frame_counter+frame_count]
-            self.frame_counter += frame_count
-            return (data, pyaudio.paContinue)
-
-        # open stream using callback (3)
-        stream = self.pyaudio.open(format=pyaudio.paInt16,
-                        channels=1,
-                        rate=44100,
-                        output=True,
-                        stream_callback=callback)
-
-        stream.start_stream()
+        self.audio.play_array(sound_array)
 
 
 class EyelinkSession(Session):
@@ -220,18 +346,28 @@ class EyelinkSession(Session):
     def __init__(self, subject_initials, index_number, sound_system):
         super(EyelinkSession, self).__init__(subject_initials, index_number, sound_system)
 
-    def create_tracker(self, tracker_on = True, sensitivity_class = 0, split_screen = False, screen_half = 'L', auto_trigger_calibration = 1, calibration_type = 'HV9', sample_rate = 1000):
+    def create_tracker(self, tracker_on = True, sensitivity_class = 0, split_screen = False, screen_half = 'L', auto_trigger_calibration = 1, calibration_type = 'HV9', sample_rate = 1000, replay_file = None, replay_speed = 1.0):
         """
         tracker sets up the connection and inputs the parameters.
         only start tracker after the screen is taken, its parameters are set,
          and output file names are created.
+        if replay_file is given, a recorded gaze trace is played back (at replay_speed) instead of connecting to
+         the eyelink.
         """
 
         self.eyelink_temp_file = self.subject_initials[:2] + '_' + str(self.index_number) + '_' + str(np.random.randint(99)) + '.edf'
         # self.tracker.openDataFile(self.eyelink_temp_file)
 
 
-        if tracker_on:
+        if tracker_on and replay_file is not None:
+            self.tracker = eyetracker.EyeTracker(self.display,
+                                                 trackertype='replay',
+                                                 replay_file=replay_file,
+                                                 speed=replay_speed,
+                                                 data_file=self.eyelink_temp_file,
+                                                 pixels_per_degree=self.pixels_per_degree)
+            self.tracker_on = True
+        elif tracker_on:
            # create actual tracker
             try:
                 # self.tracker = EyeLink()
@@ -326,8 +462,24 @@ class EyelinkSession(Session):
     def tracker_setup(self, sensitivity_class = 0, split_screen = False, screen_half = 'L', auto_trigger_calibration = True, calibration_type = 'HV9', sample_rate = 1000):
         if self.tracker.connected():
 
+            # the calibration screens read the keyboard themselves, and the link to the tracker is not shared
+            if self.input_poller is not None:
+                self.input_poller.pause()
+            if self.blink_monitor is not None:
+                self.blink_monitor.pause()
+
+            # time from the tracker requesting each calibration target to its presentation
+            graphics = getattr(self.tracker, 'eyelink_graphics', None)
+            if graphics is not None:
+                graphics.target_latencies = []
+
             self.tracker.calibrate()
 
+            if graphics is not None and len(graphics.target_latencies) > 0:
+                latency = graphics.target_latency()
+                print('Calibration target latency (ms): mean %.2f, median %.2f, max %.2f (%d targets)' % (
+                    latency['mean'], latency['median'], latency['max'], latency['n']))
+
             # re-set all the settings to be sure of sample rate and filter and such that may have been changed during the calibration procedure and the subject pressing all sorts of buttons
             self.apply_settings(sensitivity_class = sensitivity_class, split_screen = split_screen, screen_half = screen_half, auto_trigger_calibration = auto_trigger_calibration, calibration_type = calibration_type, sample_rate = sample_rate )
 
@@ -339,6 +491,11 @@ class EyelinkSession(Session):
 #			self.eye_measured, self.sample_rate, self.CR_mode, self.file_sample_filter, self.link_sample_filter = self.tracker.getModeData()
             self.sample_rate = sample_rate
 
+            if self.input_poller is not None:
+                self.input_poller.resume()
+            if self.blink_monitor is not None:
+                self.blink_monitor.resume()
+
     def drift_correct(self, position=None):
         """docstring for drift_correct"""
         if self.tracker.connected():
@@ -433,7 +590,32 @@ class EyelinkSession(Session):
 
         return saccade_polling_time
 
+    def setup_blink_monitor(self, **args):
+        """Start detecting blinks and losses of tracking in the samples of the tracker, in a background thread (see
+        gazeevents.BlinkMonitor; args are passed on). Trials use it to ignore gaze during blinks and to count them.
+        Call this before setup_realtime, so that the thread does not inherit the real-time profile"""
+        if self.tracker is not None and hasattr(self.tracker, 'blink_monitor'):
+            self.blink_monitor = self.tracker.blink_monitor(**args)
+            self.blink_monitor.start()
+
+    def stop_blink_monitor(self):
+        """Stop the blink monitor, and keep the blinks and losses of tracking it found in the output"""
+        if self.blink_monitor is not None:
+            self.blink_monitor.stop()
+            self.outputDict['blink_periods'] = list(self.blink_monitor.periods)
+            print('%d blinks, %d losses of tracking' % (self.blink_monitor.n_blinks, self.blink_monitor.n_losses))
+            self.blink_monitor = None
+
+    def marker_sinks(self):
+        """markers also go to the EDF file, as messages"""
+        sinks = super(EyelinkSession, self).marker_sinks()
+        if self.tracker is not None:
+            sinks.append(TrackerSink(self.tracker, self.clock))
+        return sinks
+
     def close(self):
+        self.stop_marker_bus()   # before the tracker closes
+        self.stop_blink_monitor()
         if self.tracker is not None:
             if self.tracker.connected():
                 self.tracker.stop_recording()
@@ -445,40 +627,60 @@ class EyelinkSession(Session):
     def play_sound(self, sound_index = '1'):
         """docstring for play_sound"""
         super(EyelinkSession, self).play_sound(sound_index = sound_index)
-        if self.tracker != None:
-            self.tracker.log('sound ' + str(sound_index) + ' at ' + str(core.getTime()) )
+        self.mark(MarkerBus.SOUND, label='sound ' + str(sound_index) + ' at ' + str(core.getTime()))
 
 
 class StarStimSession(EyelinkSession):
     """StarStimSession adds starstim EEG trigger functionality to the EyelinkSession.
     It assumes an active recording, using NIC already connected over bluetooth.
     Triggers land in the file that's already set up and recording.
+    Triggers are sent by a TriggerDispatcher on its own thread, so that the network never delays the frame loop.
     """
-    def __init__(self, subject_initials, index_number, connect_to_starstim = False, TCP_IP = '10.0.1.201', TCP_PORT = 1234):
-        super(StarStimSession, self).__init__(subject_initials, index_number)
+    def __init__(self, subject_initials, index_number, connect_to_starstim = False, TCP_IP = '10.0.1.201', TCP_PORT = 1234, sound_system = False):
+        super(StarStimSession, self).__init__(subject_initials, index_number, sound_system)
         self.setup_starstim_connection(TCP_IP = TCP_IP, TCP_PORT = TCP_PORT, connect_to_starstim = connect_to_starstim)
 
     def setup_starstim_connection(self, TCP_IP = '10.0.1.201', TCP_PORT = 1234, connect_to_starstim = True):
         """setup_starstim_connection opens a connection to the starstim to its standard ip address
         and standard (trigger) port. For controlling the recordings etc, we need tcp port 1235, it seems.
         more on that later.
+        If the connection cannot be made (or breaks), the dispatcher keeps trying to reconnect in the background.
         """
         if connect_to_starstim:
-            self.star_stim_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.star_stim_socket.connect((TCP_IP, TCP_PORT))
+            self.trigger_dispatcher = TriggerDispatcher(host = TCP_IP, port = TCP_PORT, clock = self.clock)
+            if not self.trigger_dispatcher.start(wait_connected = 2.0):
+                print('could not connect to starstim at %s:%d, will keep trying' % (TCP_IP, TCP_PORT))
             self.star_stim_connected = True
         else:
             self.star_stim_connected = False
 
     def close_starstim_connection(self):
         if self.star_stim_connected:
-            self.star_stim_socket.close()
+            self.trigger_dispatcher.stop()
+            self.star_stim_connected = False
+            latency = self.trigger_dispatcher.latency()
+            self.outputDict['starstim_trigger_latency'] = latency
+            self.outputDict['starstim_triggers'] = list(self.trigger_dispatcher.log)
+            print('Starstim triggers: %d sent, %d dropped, %d reconnects' % (
+                latency['n_sent'], latency['n_dropped'], latency['n_reconnects']))
+            if latency['n_sent'] > 0:
+                print('Starstim trigger send latency (ms): mean %.2f, p99 %.2f, max %.2f' % (
+                    latency['mean'], latency['p99'], latency['max']))
 
     def send_starstim_trigger(self, trigger = 1):
+        """queues the trigger, timestamped now; it is sent from the dispatcher's thread"""
         if self.star_stim_connected:
-            self.star_stim_socket.sendall('<TRIGGER>%i</TRIGGER>'%trigger)
+            self.trigger_dispatcher.send(trigger)
+
+    def marker_sinks(self):
+        """markers are also sent as EEG triggers"""
+        sinks = super(StarStimSession, self).marker_sinks()
+        if self.star_stim_connected:
+            sinks.append(TriggerSink(self.trigger_dispatcher))
+        return sinks
 
     def close(self):
+        # stop sending first, so that the trigger log is saved with the output
+        self.stop_marker_bus()
+        self.close_starstim_connection()
         super(StarStimSession, self).close()
-        if self.star_stim_connected:
-            self.close_starstim_connection()
@@ -17,152 +17,223 @@ import numpy as np
 # import matplotlib.pylab as pl
 from math import *
 
-class OneUpOneDownStaircase(object):
-	"""
-	OneUpOneDownStaircase object, for one-up-one-down staircase in its standard form.
+# exp_tools star-imports this module: export the staircases only, not the names imported above
+__all__ = ['InterleavedStaircases', 'OneUpOneDownStaircase', 'TwoUpOneDownStaircase', 'ThreeUpOneDownStaircase',
+	'YesNoStaircase']
+
+class InterleavedStaircases(object):
 	"""
-	def __init__(self, initial_value, initial_stepsize, nr_reversals = 10, increment_value = None, stepsize_multiplication_on_reversal = 0.75, max_nr_trials = 40 ):
-		self.initial_value = initial_value
-		self.initial_stepsize = initial_stepsize
-		self.nr_reversals = nr_reversals
-		self.increment_value = increment_value
-		self.stepsize_multiplication_on_reversal = stepsize_multiplication_on_reversal
-		self.max_nr_trials = max_nr_trials
-		
-		self.test_value = self.initial_value
-		self.present_increment_value = increment_value
-		
-		# set up filler variables
-		self.past_answers = []
-		self.nr_trials = 0
-		self.present_nr_reversals = 0
-	
-	def test_value(self):
-		return self.test_value
+	Any number of n-up-one-down staircases, stored as arrays so that they can be updated together in one call.
 	
-	def answer( self, correct ):
-		continue_after_this_trial = True
-		self.nr_trials = self.nr_trials + 1
-		if correct: # answer was correct and so we lower the contrast/whatever value
-			self.test_value = self.test_value - self.present_increment_value
-		else:
-			self.test_value = self.test_value + self.present_increment_value
-	
-		self.past_answers.append(correct)
-			
-		if self.nr_trials > 1:
-			if self.past_answers[-1] != self.past_answers[-2]:	# we have a reversal here
-				self.present_nr_reversals = self.present_nr_reversals + 1
-				if self.present_nr_reversals % 2 == 0:
-					self.present_increment_value = self.present_increment_value * self.stepsize_multiplication_on_reversal
-				if self.present_nr_reversals >= self.nr_reversals:
-					continue_after_this_trial = False
-			else: 
-				pass
-			if self.nr_trials >= self.max_nr_trials:
-				continue_after_this_trial = False
-		
-		return continue_after_this_trial
+	The value of a staircase goes down (gets harder) when the last nr_correct_for_down answers were all correct,
+	and up (by up_step_factor times the step) otherwise. Every second reversal (a correct answer after an incorrect
+	one, or vice versa) multiplies the step by stepsize_multiplication_on_reversal. A staircase is done after
+	nr_reversals reversals or max_nr_trials trials.
 	
-class TwoUpOneDownStaircase(OneUpOneDownStaircase):
-	def __init__(self, initial_value, initial_stepsize, nr_reversals = 10, increment_value = None, stepsize_multiplication_on_reversal = 0.75, max_nr_trials = 40 ):
-		super(TwoUpOneDownStaircase, self).__init__(initial_value, initial_stepsize, nr_reversals = 10, increment_value = None, stepsize_multiplication_on_reversal = 0.75, max_nr_trials = 40)
-		self.past_answers = [0.5, 0.5, 0.5]
+	The number of consecutive correct answers is kept as a counter per staircase, and the history is preallocated
+	(doubled when full), so an answer costs the same at every trial. All parameters are a value for all staircases
+	or an array with a value per staircase.
 	
-	def answer( self, correct ):
-		continue_after_this_trial = True
-		self.nr_trials = self.nr_trials + 1
-		self.past_answers.append(correct)
-		
-		nr_corrects_in_last_2_trials = np.array(self.past_answers, dtype = float)[-2:].sum()
+	Parameters
+	----------
+	initial_values: float or array
+		Start value of every staircase; its length sets the number of staircases (see n_staircases)
+	stepsizes: float or array
+	nr_correct_for_down: int or array
+		1, 2 or 3 for one-up-one-down, two-up-one-down or three-up-one-down
+	up_step_factor: float or array
+		Size of a step up relative to a step down (3 for the weighted yes/no staircase of Kaernbach)
+	nr_reversals: int or array
+	stepsize_multiplication_on_reversal: float or array
+	max_nr_trials: int or array
+	n_staircases: int
+		Number of staircases, if initial_values is a single value
+	"""
+	def __init__(self, initial_values, stepsizes, nr_correct_for_down = 1, up_step_factor = 1.0, nr_reversals = 10, stepsize_multiplication_on_reversal = 0.75, max_nr_trials = 40, n_staircases = None):
+		if n_staircases is None:
+			n_staircases = np.size(initial_values)
+		self.n_staircases = n_staircases
+		shape = (n_staircases,)
 		
-		if nr_corrects_in_last_2_trials == 2:	# this subject is too good for this stimulus value
-			self.test_value = self.test_value - self.present_increment_value
-		else:
-			self.test_value = self.test_value + self.present_increment_value
+		self.initial_values = np.array(np.broadcast_to(initial_values, shape), dtype = float)
+		self.nr_correct_for_down = np.array(np.broadcast_to(nr_correct_for_down, shape), dtype = int)
+		self.up_step_factor = np.array(np.broadcast_to(up_step_factor, shape), dtype = float)
+		self.nr_reversals = np.array(np.broadcast_to(nr_reversals, shape), dtype = int)
+		self.stepsize_multiplication_on_reversal = np.array(np.broadcast_to(stepsize_multiplication_on_reversal, shape), dtype = float)
+		self.max_nr_trials = np.array(np.broadcast_to(max_nr_trials, shape), dtype = int)
 		
-		if self.nr_trials > 1:
-			if self.past_answers[-1] != self.past_answers[-2]:	# we have a reversal here
-				self.present_nr_reversals = self.present_nr_reversals + 1
-				if self.present_nr_reversals % 2 == 0:
-					self.present_increment_value = self.present_increment_value * self.stepsize_multiplication_on_reversal
-				if self.present_nr_reversals >= self.nr_reversals:
-					continue_after_this_trial = False
-			else: 
-				pass
-			if self.nr_trials >= self.max_nr_trials:
-				continue_after_this_trial = False
+		# state per staircase
+		self.test_values = self.initial_values.copy()
+		self.stepsizes = np.array(np.broadcast_to(stepsizes, shape), dtype = float)
+		self.nr_trials = np.zeros(shape, dtype = int)
+		self.present_nr_reversals = np.zeros(shape, dtype = int)
+		self.nr_consecutive_correct = np.zeros(shape, dtype = int)
+		self.last_answers = np.zeros(shape, dtype = bool)
+		self.active = np.ones(shape, dtype = bool)
 		
-		return continue_after_this_trial
+		# history: one row per trial of a staircase (values tested, answers given, and whether it was a reversal)
+		capacity = max(int(self.max_nr_trials.max()), 1)
+		self.past_values = np.zeros((capacity, n_staircases))
+		self.past_answers = np.zeros((capacity, n_staircases), dtype = bool)
+		self.past_reversals = np.zeros((capacity, n_staircases), dtype = bool)
 	
-class ThreeUpOneDownStaircase(TwoUpOneDownStaircase):
-	def answer( self, correct ):
-		continue_after_this_trial = True
-		self.nr_trials = self.nr_trials + 1
-		self.past_answers.append(correct)
+	def _grow_history(self):
+		""" Doubles the length of the history """
+		for name in ['past_values', 'past_answers', 'past_reversals']:
+			history = getattr(self, name)
+			setattr(self, name, np.concatenate((history, np.zeros_like(history))))
+	
+	def answer( self, indices, correct ):
+		"""
+		Updates the staircases in indices (int or array of distinct ints) with their answers (bool or array).
+		Returns, per staircase, whether it continues after this trial.
+		"""
+		scalar = np.ndim(indices) == 0
+		indices = np.atleast_1d(indices)
+		correct = np.broadcast_to(np.asarray(correct, dtype = bool), indices.shape)
 		
-		nr_corrects_in_last_3_trials = np.array(self.past_answers, dtype = float)[-3:].sum()
+		trial_ns = self.nr_trials[indices]
+		if trial_ns.max() >= self.past_values.shape[0]:
+			self._grow_history()
+		reversals = (trial_ns > 0) & (correct != self.last_answers[indices])
+		self.past_values[trial_ns, indices] = self.test_values[indices]
+		self.past_answers[trial_ns, indices] = correct
+		self.past_reversals[trial_ns, indices] = reversals
 		
-		if nr_corrects_in_last_3_trials == 3:	# this subject is too good for this stimulus value
-			self.test_value = self.test_value - self.present_increment_value
-		else:
-			self.test_value = self.test_value + self.present_increment_value
+		# go down after nr_correct_for_down correct answers in a row, up otherwise
+		nr_consecutive_correct = np.where(correct, self.nr_consecutive_correct[indices] + 1, 0)
+		down = nr_consecutive_correct >= self.nr_correct_for_down[indices]
+		stepsizes = self.stepsizes[indices]
+		self.test_values[indices] += np.where(down, -stepsizes, stepsizes * self.up_step_factor[indices])
 		
-		if self.nr_trials > 1:
-			if self.past_answers[-1] != self.past_answers[-2]:	# we have a reversal here
-				self.present_nr_reversals = self.present_nr_reversals + 1
-				if self.present_nr_reversals % 2 == 0:
-					self.present_increment_value = self.present_increment_value * self.stepsize_multiplication_on_reversal
-				if self.present_nr_reversals >= self.nr_reversals:
-					continue_after_this_trial = False
-			else: 
-				pass
-			if self.nr_trials >= self.max_nr_trials:
-				continue_after_this_trial = False
+		nr_reversals = self.present_nr_reversals[indices] + reversals
+		shrink = reversals & (nr_reversals % 2 == 0)
+		self.stepsizes[indices] = np.where(shrink, stepsizes * self.stepsize_multiplication_on_reversal[indices], stepsizes)
 		
-		return continue_after_this_trial
+		self.nr_consecutive_correct[indices] = nr_consecutive_correct
+		self.present_nr_reversals[indices] = nr_reversals
+		self.last_answers[indices] = correct
+		self.nr_trials[indices] = trial_ns + 1
+		continues = (nr_reversals < self.nr_reversals[indices]) & (trial_ns + 1 < self.max_nr_trials[indices])
+		self.active[indices] = continues
+		
+		return continues[0] if scalar else continues
 	
-class YesNoStaircase(object):
-	def __init__(self, initial_value, initial_stepsize, nr_reversals = 100, stepsize_multiplication_on_reversal = 0.75, max_nr_trials = 400 ):
+	def active_indices(self):
+		""" Staircases that are not done yet """
+		return np.flatnonzero(self.active)
+	
+	def next_index(self, random_state = np.random):
+		""" A random staircase that is not done yet (for randomly interleaved staircases), or None if all are done """
+		indices = self.active_indices()
+		if len(indices) == 0:
+			return None
+		return indices[random_state.randint(len(indices))]
+	
+	def history(self, index):
+		""" Values tested, answers and reversals of staircase index, up to now """
+		n = self.nr_trials[index]
+		return self.past_values[:n, index], self.past_answers[:n, index], self.past_reversals[:n, index]
+	
+	def threshold(self, nr_last_reversals = 6):
+		""" Per staircase, the mean value at its last nr_last_reversals reversals (nan without reversals) """
+		thresholds = np.full(self.n_staircases, np.nan)
+		for index in range(self.n_staircases):
+			values, answers, reversals = self.history(index)
+			if reversals.any():
+				thresholds[index] = values[reversals][-nr_last_reversals:].mean()
+		return thresholds
+	
+	def checkpoint(self):
+		""" A copy of the state of all staircases, to resume from with restore() """
+		n = max(int(self.nr_trials.max()), 1)
+		state = dict((name, getattr(self, name).copy()) for name in ['test_values', 'stepsizes', 'nr_trials', 'present_nr_reversals', 'nr_consecutive_correct', 'last_answers', 'active'])
+		state.update(dict((name, getattr(self, name)[:n].copy()) for name in ['past_values', 'past_answers', 'past_reversals']))
+		return state
+	
+	def restore(self, state):
+		""" Resumes from a checkpoint """
+		for name in ['test_values', 'stepsizes', 'nr_trials', 'present_nr_reversals', 'nr_consecutive_correct', 'last_answers', 'active']:
+			getattr(self, name)[:] = state[name]
+		n = state['past_values'].shape[0]
+		while self.past_values.shape[0] < n:
+			self._grow_history()
+		for name in ['past_values', 'past_answers', 'past_reversals']:
+			history = getattr(self, name)
+			history[:] = 0
+			history[:n] = state[name]
+	
+	def save(self, file_name):
+		""" Pickles the staircases (parameters and state), e.g. at the end of every block """
+		with open(file_name, 'wb') as f:
+			pickle.dump(self, f)
+	
+	@classmethod
+	def load(cls, file_name):
+		with open(file_name, 'rb') as f:
+			return pickle.load(f)
+	
+
+class OneUpOneDownStaircase(object):
+	"""
+	OneUpOneDownStaircase object, for one-up-one-down staircase in its standard form.
+	The step is increment_value, or initial_stepsize if no increment_value is given.
+	"""
+	nr_correct_for_down = 1
+	up_step_factor = 1.0
+	
+	def __init__(self, initial_value, initial_stepsize, nr_reversals = 10, increment_value = None, stepsize_multiplication_on_reversal = 0.75, max_nr_trials = 40 ):
 		self.initial_value = initial_value
 		self.initial_stepsize = initial_stepsize
 		self.nr_reversals = nr_reversals
+		self.increment_value = increment_value
 		self.stepsize_multiplication_on_reversal = stepsize_multiplication_on_reversal
 		self.max_nr_trials = max_nr_trials
 		
-		self.test_value = self.initial_value
-		self.present_increment_value = initial_stepsize
-		
-		# set up filler variables
-		self.past_answers = []
-		self.nr_trials = 0
-		self.present_nr_reversals = 0
+		self.staircases = InterleavedStaircases(initial_value, initial_stepsize if increment_value is None else increment_value, nr_correct_for_down = self.nr_correct_for_down, up_step_factor = self.up_step_factor, nr_reversals = nr_reversals, stepsize_multiplication_on_reversal = stepsize_multiplication_on_reversal, max_nr_trials = max_nr_trials, n_staircases = 1)
 	
+	@property
 	def test_value(self):
-		return self.test_value
+		return self.staircases.test_values[0]
+	
+	@property
+	def present_increment_value(self):
+		return self.staircases.stepsizes[0]
+	
+	@property
+	def nr_trials(self):
+		return self.staircases.nr_trials[0]
+	
+	@property
+	def present_nr_reversals(self):
+		return self.staircases.present_nr_reversals[0]
+	
+	@property
+	def past_answers(self):
+		return self.staircases.history(0)[1]
 	
 	def answer( self, correct ):
-		continue_after_this_trial = True
-		self.nr_trials = self.nr_trials + 1
-		if correct: # answer was correct and so we lower the contrast/whatever value according to Kaernbach's method
-			self.test_value = self.test_value - self.present_increment_value
-		else:
-			self.test_value = self.test_value + 3.0 * self.present_increment_value
-	
-		self.past_answers.append(correct)
-			
-		if self.nr_trials > 1:
-			if self.past_answers[-1] != self.past_answers[-2]:	# we have a reversal here
-				self.present_nr_reversals = self.present_nr_reversals + 1
-				if self.present_nr_reversals % 2 == 0:
-					self.present_increment_value = self.present_increment_value * self.stepsize_multiplication_on_reversal
-				if self.present_nr_reversals >= self.nr_reversals:
-					continue_after_this_trial = False
-			else: 
-				pass
-			if self.nr_trials >= self.max_nr_trials:
-				continue_after_this_trial = False
-		
-		return continue_after_this_trial
+		return bool(self.staircases.answer(0, correct))
+	
+	def checkpoint(self):
+		return self.staircases.checkpoint()
+	
+	def restore(self, state):
+		self.staircases.restore(state)
+	
+class TwoUpOneDownStaircase(OneUpOneDownStaircase):
+	nr_correct_for_down = 2
+	
+class ThreeUpOneDownStaircase(TwoUpOneDownStaircase):
+	nr_correct_for_down = 3
+	
+class YesNoStaircase(OneUpOneDownStaircase):
+	"""
+	Yes/no staircase according to Kaernbach's method: a step down after a correct answer, three steps up after an
+	incorrect one.
+	"""
+	up_step_factor = 3.0
+	
+	def __init__(self, initial_value, initial_stepsize, nr_reversals = 100, stepsize_multiplication_on_reversal = 0.75, max_nr_trials = 400 ):
+		super(YesNoStaircase, self).__init__(initial_value, initial_stepsize, nr_reversals = nr_reversals, stepsize_multiplication_on_reversal = stepsize_multiplication_on_reversal, max_nr_trials = max_nr_trials)
 	
-	
\ No newline at end of file
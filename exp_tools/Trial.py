@@ -8,53 +8,107 @@ Copyright (c) 2009 TK. All rights reserved.
 """
 
 
-import time as time_module
 from Session import *
 
 
 class Trial(object):
-    """base class for Trials"""
+    """base class for Trials. Trial objects can be reused for a next trial by reset() (see TrialPool), so all
+    per-trial state is set in reset(). Attributes are kept in __slots__; subclasses without __slots__ get a __dict__"""
+
+    __slots__ = ('ID', 'parameters', 'phase_durations', 'screen', 'tracker', 'session', 'events', 'phase',
+                 'phase_time', 'phase_times', 'stopped', 'preamble_sent', 'start_time', 'stop_time')
 
     def __init__(self, parameters={}, phase_durations=[], session=None, screen=None, tracker=None):
         super(Trial, self).__init__()
-        self.parameters = parameters.copy()
-        self.phase_durations = phase_durations
         self.screen = screen
         self.tracker = tracker
         self.session = session
 
+        Trial.reset(self, parameters=parameters, phase_durations=phase_durations)
+
+    def reset(self, parameters={}, phase_durations=[]):
+        """resets the state of the Trial base class for a new trial. The parameters are not copied: a compact record of
+        them is made when the trial stops (see parameter_record)"""
+        self.parameters = parameters
+        self.phase_durations = phase_durations
+
         self.events = []
         self.phase = 0
         self.phase_time = None
         self.phase_times = np.cumsum(np.array(self.phase_durations))
         self.stopped = False
+        self.preamble_sent = False
+        self.start_time = self.stop_time = None
 
     def create_stimuli(self):
         pass
 
     def run(self):
         self.start_time = self.session.clock.getTime()
-        if self.tracker:
-            self.tracker.log('trial ' + str(self.ID) + ' started at ' + str(self.start_time) )
+        self.session.mark(MarkerBus.TRIAL_START, self.start_time, 'trial ' + str(self.ID) + ' started at ' + str(self.start_time))
+        if self.tracker and not self.preamble_sent:
             self.tracker.send_command('record_status_message "Trial ' + str(self.ID) + '"')
         self.events.append('trial ' + str(self.ID) + ' started at ' + str(self.start_time))
 
+    def send_preamble(self):
+        """sends this trial's status message to the tracker. Can be done before run(), while the previous trial ends"""
+        if self.tracker:
+            self.tracker.send_command('record_status_message "Trial ' + str(self.ID) + '"')
+        self.preamble_sent = True
+
     def stop(self):
         self.stop_time = self.session.clock.getTime()
         self.stopped = True
-        if self.tracker:
-            # pipe parameters to the eyelink data file in a for loop so as to limit the risk of flooding the buffer
-            for k in self.parameters.keys():
-                self.tracker.log('trial ' + str(self.ID) + ' parameter\t' + k + ' : ' + str(self.parameters[k]) )
-                time_module.sleep(0.0005)
-            self.tracker.log('trial ' + str(self.ID) + ' stopped at ' + str(self.stop_time) )
+        self.session.end_critical_section()   # in case the trial stopped before the ITI
+        parameter_record = self.parameter_record()
+        # parameters go to the eyelink data file (if any) as text markers; the marker bus paces them so as not to flood
+        # the link (see TrackerSink)
+        for k in parameter_record.keys():
+            self.session.mark(MarkerBus.TEXT, self.stop_time, 'trial ' + str(self.ID) + ' parameter\t' + k + ' : ' + str(parameter_record[k]))
+        self.session.mark(MarkerBus.TRIAL_STOP, self.stop_time, 'trial ' + str(self.ID) + ' stopped at ' + str(self.stop_time))
         self.session.outputDict['eventArray'].append(self.events)
-        self.session.outputDict['parameterArray'].append(self.parameters)
+        self.session.outputDict['parameterArray'].append(parameter_record)
+
+    def parameter_record(self):
+        """compact copy of this trial's parameters, for the output. Array parameters (such as evidence arrays, which
+        the session keeps and saves itself) are left out"""
+        return dict((k, v) for k, v in self.parameters.items() if not isinstance(v, (np.ndarray, list, tuple)))
 
     def key_event(self, event):
-        if self.tracker:
-            self.tracker.log('trial ' + str(self.ID) + ' event ' + str(event) + ' at ' + str(self.session.clock.getTime()) )
-        self.events.append('trial ' + str(self.ID) + ' event ' + str(event) + ' at ' + str(self.session.clock.getTime()))
+        t = self.session.clock.getTime()
+        self.session.mark(MarkerBus.KEY_EVENT, t, 'trial ' + str(self.ID) + ' event ' + str(event) + ' at ' + str(t))
+        self.events.append('trial ' + str(self.ID) + ' event ' + str(event) + ' at ' + str(t))
+
+    def handle_pulse(self, ev_time):
+        """records a scanner pulse received at ev_time in the session's pulse recorder, and counts the volumes it
+        stands for in n_TRs (of trials that count volumes): 0 for a duplicate pulse, more than 1 if pulses were missed
+        before this one. The first volume ends phase 0"""
+        n_volumes = self.session.pulse_recorder.record(ev_time)
+        if n_volumes == 0:
+            self.events.append([99, ev_time, 'duplicate pulse'])
+        else:
+            self.events.append([99, ev_time, 'pulse'])
+            self.n_TRs += n_volumes
+
+            if self.phase == 0:
+                self.phase_forward()
+
+    def check_missed_pulse(self):
+        """if the scanner pulse we're waiting for is overdue (by the fitted TR), it was probably missed: count it
+        anyway. Call once per frame"""
+        if self.session.scanner != 'n' and self.session.pulse_recorder.check_missed(self.session.clock.getTime()):
+            self.events.append([99, self.session.clock.getTime(), 'missed pulse'])
+            self.n_TRs += 1
+            if self.phase == 0:
+                self.phase_forward()
+
+    def pulse_due(self, margin=0.05):
+        """whether the next scanner pulse is predicted (by the fitted TR) within margin seconds, so that the frame
+        loop should stay free to handle it"""
+        if self.session.scanner == 'n':
+            return False
+        next_pulse_time = self.session.pulse_recorder.next_pulse_time(self.session.clock.getTime())
+        return next_pulse_time is not None and next_pulse_time - self.session.clock.getTime() < margin
 
     def feedback(self, answer, setting):
         """feedback give the subject feedback on performance"""
@@ -65,17 +119,51 @@ class Trial(object):
                 self.session.play_sound(sound_index=1)
 
     def draw(self):
-        """draw function of the Trial superclass finishes drawing by clearing, drawing the viewport and swapping buffers"""
+        """draw function of the Trial superclass finishes drawing by clearing, drawing the viewport and swapping buffers.
+        The time of the flip (psychopy.core time) is kept in session.last_flip_time"""
 
         self.screen.flip()
+        self.session.last_flip_time = core.getTime()
 
     def phase_forward(self):
-        """go one phase forward"""
+        """go one phase forward. Phases 1 to 6 are a critical section: no garbage collection (see
+        Session.setup_gc_control)"""
         self.phase += 1
+        if self.phase == 1:
+            self.session.start_critical_section()
+        elif self.phase == 7:
+            self.session.end_critical_section()
         self.phase_time = self.session.clock.getTime()
         self.events.append('trial ' + str(self.ID) + ' phase ' + str(self.phase) + ' started at ' + str(
             self.phase_time))
-        if self.tracker:
-            self.tracker.log('trial ' + str(self.ID) + ' phase ' + str(self.phase) + ' started at ' +
-                             str(self.phase_time))
-            time_module.sleep(0.0005)
+        self.session.mark(MarkerBus.PHASE_START + self.phase, self.phase_time,
+                          'trial ' + str(self.ID) + ' phase ' + str(self.phase) + ' started at ' + str(self.phase_time))
+
+
+class TrialPool(object):
+    """Keeps finished trial objects per trial class, so that they can be reset and reused for later trials instead of
+    making a new object (with new lists and arrays) for every trial."""
+
+    def __init__(self):
+        self.idle = {}
+        self.n_made = 0
+        self.n_reused = 0
+
+    def get(self, trial_class, ID, block_trial_ID=0, parameters={}, phase_durations=[], **kwargs):
+        """returns a trial_class object for trial ID: an idle one that is reset, or a new one if none is idle.
+        kwargs (session, screen, tracker) are only used for new objects"""
+        idle = self.idle.get(trial_class)
+        if idle:
+            trial_object = idle.pop()
+            trial_object.reset(ID, block_trial_ID=block_trial_ID, parameters=parameters,
+                               phase_durations=phase_durations)
+            self.n_reused += 1
+        else:
+            trial_object = trial_class(ID, block_trial_ID=block_trial_ID, parameters=parameters,
+                                       phase_durations=phase_durations, **kwargs)
+            self.n_made += 1
+        return trial_object
+
+    def release(self, trial_object):
+        """returns a trial object to the pool, once everything that is needed from it has been saved"""
+        self.idle.setdefault(type(trial_object), []).append(trial_object)
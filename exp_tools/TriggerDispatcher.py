@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+TriggerDispatcher.py
+
+Sends EEG triggers to the StarStim NIC software over TCP from a dedicated I/O thread, so that a slow or broken
+network connection never stalls the frame loop. FakeNICServer is a local stand-in for NIC, for tests.
+"""
+
+import re
+import socket
+import threading
+import time
+from collections import deque
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import numpy as np
+
+
+class TriggerDispatcher(object):
+    """
+    Triggers are timestamped when send() is called, and put in a bounded queue (if it is full, the trigger is
+    dropped and counted). The I/O thread sends them with TCP_NODELAY (no Nagle buffering) and reconnects every
+    reconnect_interval seconds when the connection fails; a trigger that could not be sent is retried after
+    reconnecting. Every trigger ends up in the log as (trigger, call time, send time, status), so that the send
+    latency (send time - call time) can be checked afterwards. Note that a trigger written just after the receiver
+    closed the connection can still be lost: TCP only reports the broken connection at the next write.
+
+    Parameters
+    ----------
+    host: str
+    port: int
+    clock: object with getTime() (seconds)
+        Time base of the log, e.g. the session clock. Defaults to time.time()
+    max_queue: int
+        Maximum number of triggers waiting to be sent
+    connect_timeout: float
+        Seconds
+    send_timeout: float
+        Seconds after which a send counts as failed (the connection is then reopened)
+    reconnect_interval: float
+        Seconds between connection attempts
+    """
+
+    def __init__(self, host='10.0.1.201', port=1234, clock=None, max_queue=256, connect_timeout=1.0,
+                 send_timeout=0.5, reconnect_interval=1.0):
+        self.address = (host, port)
+        self.clock = clock
+        self.connect_timeout = connect_timeout
+        self.send_timeout = send_timeout
+        self.reconnect_interval = reconnect_interval
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.log = deque(maxlen=100000)
+        self.n_dropped = 0
+        self.n_reconnects = 0
+        self.connected = threading.Event()
+
+        self._socket = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='TriggerDispatcher')
+        self._thread.daemon = True
+
+    def get_time(self):
+        return time.time() if self.clock is None else self.clock.getTime()
+
+    def start(self, wait_connected=1.0):
+        """ Starts the I/O thread. Returns whether it connected within wait_connected seconds (if not, it keeps
+        trying in the background) """
+        self._thread.start()
+        return self.connected.wait(wait_connected)
+
+    def send(self, trigger, t=None):
+        """ Queues trigger (int) for sending; never blocks. t is the time of the event it marks (default: now).
+        Returns False if the queue was full """
+        try:
+            self.queue.put_nowait((trigger, self.get_time() if t is None else t))
+            return True
+        except queue.Full:
+            self.n_dropped += 1
+            self.log.append((trigger, self.get_time(), np.nan, 'dropped'))
+            return False
+
+    def stop(self, timeout=1.0):
+        """ Sends the triggers still queued (for at most timeout seconds) and closes the connection """
+        end_time = time.time() + timeout
+        while not self.queue.empty() and self.connected.is_set() and time.time() < end_time:
+            time.sleep(0.001)
+        self._stopped.set()
+        try:
+            self.queue.put_nowait((None, None))    # wake up the thread, if it waits for a trigger
+        except queue.Full:
+            pass    # then it does not wait, and sees _stopped
+        if self._thread.is_alive():
+            self._thread.join(timeout=max(0, end_time - time.time()) + self.send_timeout)
+        self._disconnect()
+
+    def _connect(self):
+        try:
+            self._socket = socket.create_connection(self.address, timeout=self.connect_timeout)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._socket.settimeout(self.send_timeout)
+            self.connected.set()
+            return True
+        except (socket.error, socket.timeout):
+            self._socket = None
+            return False
+
+    def _disconnect(self):
+        self.connected.clear()
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except socket.error:
+                pass
+            self._socket = None
+
+    def _run(self):
+        pending = None
+        while not self._stopped.is_set():
+            if self._socket is None and not self._connect():
+                self._stopped.wait(self.reconnect_interval)
+                continue
+
+            if pending is None:
+                pending = self.queue.get()
+                if pending[0] is None:
+                    break
+
+            trigger, call_time = pending
+            try:
+                self._socket.sendall(('<TRIGGER>%i</TRIGGER>' % trigger).encode('ascii'))
+                self.log.append((trigger, call_time, self.get_time(), 'sent'))
+                pending = None
+            except (socket.error, socket.timeout):
+                # keep the trigger, and retry after reconnecting
+                self._disconnect()
+                self.n_reconnects += 1
+
+    def latency(self):
+        """ Summary (in ms) of the time from send() to the trigger being handed to the network """
+        latencies = np.array([(sent - called) * 1000 for trigger, called, sent, status in self.log if status == 'sent'])
+        if len(latencies) == 0:
+            return {'n_sent': 0, 'n_dropped': self.n_dropped, 'n_reconnects': self.n_reconnects}
+        return {'n_sent': len(latencies), 'n_dropped': self.n_dropped, 'n_reconnects': self.n_reconnects,
+                'mean': latencies.mean(), 'p99': np.percentile(latencies, 99), 'max': latencies.max()}
+
+
+class FakeNICServer(object):
+    """
+    Local stand-in for the NIC trigger port: accepts connections on host:port (port 0 picks a free port, see
+    self.port) and records every <TRIGGER>n</TRIGGER> as (n, time.time()) in self.triggers.
+
+    Parameters
+    ----------
+    host: str
+    port: int
+    delay: float
+        Seconds to wait before every read, to emulate a slow receiver
+    """
+
+    trigger_pattern = re.compile(r'<TRIGGER>(-?\d+)</TRIGGER>')
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0.):
+        self.delay = delay
+        self.triggers = []
+        self.connections = []
+
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(5)
+        self._server.settimeout(0.1)
+        self.host, self.port = self._server.getsockname()
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._accept, name='FakeNICServer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _accept(self):
+        while not self._stopped.is_set():
+            try:
+                connection, address = self._server.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            self.connections.append(connection)
+            reader = threading.Thread(target=self._read, args=(connection,))
+            reader.daemon = True
+            reader.start()
+
+    def _read(self, connection):
+        received = ''
+        connection.settimeout(0.1)
+        while not self._stopped.is_set():
+            if self.delay > 0:
+                time.sleep(self.delay)
+            try:
+                data = connection.recv(4096)
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+            if not data:
+                break
+            received += data.decode('ascii')
+            end = 0
+            for match in self.trigger_pattern.finditer(received):
+                self.triggers.append((int(match.group(1)), time.time()))
+                end = match.end()
+            received = received[end:]
+
+    def drop_connections(self):
+        """ Closes all open connections, e.g. to test reconnecting """
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+                connection.close()
+            except socket.error:
+                pass
+        self.connections = []
+
+    def close(self):
+        self._stopped.set()
+        self.drop_connections()
+        self._server.close()
@@ -1,2 +1,11 @@
 from Session import *
 from Trial import *
+from PulseRecorder import *
+from InputPoller import *
+from AudioEngine import *
+from RealTime import *
+from TriggerDispatcher import *
+from MarkerBus import *
+from DriftEstimator import *
+from AdaptiveDifficulty import *
+from Staircase import *
@@ -83,6 +83,7 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
         self.fontsize = libeyelink.fontsize
 
         self.draw_menu_screen()
+        self.draw_cal_screens()
 
     def draw_menu_screen(self):
         """ Draws menu screen """
@@ -132,6 +133,50 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
 
         self.menuscreen = [title, vers, cal, val, autothres, extra_info, cam, arrow_keys, abort, exit]
 
+    def draw_cal_screens(self):
+        """ Makes the calibration target and status messages once; during calibration they are only moved and drawn """
+
+        self.cal_target_out = visual.GratingStim(self.display, tex='none', mask='circle',
+                                                 size=2.0/100*self.sizeX*self.cfX, color=[1.0,1.0,1.0])
+        self.cal_target_in = visual.GratingStim(self.display, tex='none', mask='circle',
+                                                size=2.0/300*self.sizeX*self.cfX, color=[-1.0,-1.0,-1.0])
+        self.target_latencies = []
+
+        messages = {'cal_lost': "Calibration lost, press 'enter' to return to menu",
+                    'cal_succ': "Calibration succesful, press 'v' to validate",
+                    'val_succ': "Validation succesful, press 'enter' to return to menu",
+                    'ret': "Press 'enter' to return to menu"}
+        self.status_texts = {}
+        for name, text in messages.items():
+            self.status_texts[name] = visual.TextStim(self.display, text=text, pos=(self.xc, self.yc), font='mono',
+                                                      height=self.fontsize, antialias=True)
+
+        # camera image, of which the image is replaced for every frame
+        self.camera_image = None
+
+    def target_latency(self):
+        """ Summary (in ms) of the time from the tracker requesting a calibration target to the flip showing it """
+
+        latencies = [latency * 1000 for latency in self.target_latencies]
+        if len(latencies) == 0:
+            return {'n': 0}
+        latencies.sort()
+        return {'n': len(latencies),
+                'mean': sum(latencies) / len(latencies),
+                'median': latencies[len(latencies) // 2],
+                'max': latencies[-1]}
+
+    def benchmark_targets(self, n_repeats=2):
+        """ Presents the targets of a 9-point calibration n_repeats times, and returns target_latency() of these """
+
+        self.target_latencies = []
+        for repeat in range(n_repeats):
+            for x in [0.1, 0.5, 0.9]:
+                for y in [0.1, 0.5, 0.9]:
+                    self.draw_cal_target(x * self.sizeX, y * self.sizeY)
+        self.erase_cal_target()
+        return self.target_latency()
+
     def close(self):
         self.display_open = False
 
@@ -186,15 +231,15 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
     def draw_cal_target(self, x, y):#
         """Draw the calibration/validation & drift-check  target"""
         
+        t0 = core.getTime()
         xVis = (x - self.sizeX/2)*self.cfX
         yVis = (self.sizeY/2 - y)*self.cfY
-        cal_target_out = visual.GratingStim(self.display, tex='none', mask='circle', size=2.0/100*self.sizeX*self.cfX, color=[1.0,1.0,1.0])
-        cal_target_in  = visual.GratingStim(self.display, tex='none', mask='circle', size=2.0/300*self.sizeX*self.cfX, color=[-1.0,-1.0,-1.0])
-        cal_target_out.setPos((xVis, yVis))
-        cal_target_in.setPos((xVis, yVis))
-        cal_target_out.draw()
-        cal_target_in.draw()
+        self.cal_target_out.pos = (xVis, yVis)
+        self.cal_target_in.pos = (xVis, yVis)
+        self.cal_target_out.draw()
+        self.cal_target_in.draw()
         self.display.flip()
+        self.target_latencies.append(core.getTime() - t0)
 
     def play_beep(self, beepid):
         """ Play a sound during calibration/drift correct.
@@ -218,9 +263,7 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
         elif beepid == pylink.CAL_ERR_BEEP or beepid == pylink.DC_ERR_BEEP:
 
             # Calibration lost
-            cal_lost = visual.TextStim(self.display, text="Calibration lost, press 'enter' to return to menu",
-                                       pos=(self.xc, self.yc), font='mono', height=self.fontsize, antialias=True)
-            cal_lost.draw()
+            self.status_texts['cal_lost'].draw()
             self.display.flip()
 
             # play beep
@@ -230,20 +273,14 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
 
             if self.state == "calibration":
                 # Calibration was a success
-                cal_succ = visual.TextStim(self.display, text="Calibration succesful, press 'v' to validate",
-                                           pos=(self.xc, self.yc), font='mono', height=self.fontsize, antialias=True)
-                cal_succ.draw()
+                self.status_texts['cal_succ'].draw()
 
             elif self.state == "validation":
                 # validation was successful
-                val_succ = visual.TextStim(self.display, text="Validation succesful, press 'enter' to return to menu",
-                                           pos=(self.xc, self.yc), font='mono', height=self.fontsize, antialias=True)
-                val_succ.draw()
+                self.status_texts['val_succ'].draw()
             else:
                 # Cal + val done, return to menu
-                ret = visual.TextStim(self.display, text="Press 'enter' to return to menu",
-                                      pos=(self.xc, self.yc), font='mono', height=self.fontsize, antialias=True)
-                ret.draw()
+                self.status_texts['ret'].draw()
 
             # Flip display
             self.display.flip()
@@ -440,9 +477,12 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
                 img = Image.fromstring("RGBX", (width, totlines), bufferv) # PIL
 
             imgResize = img.resize((self.size[0], self.size[1]))       
-            imgResizeVisual = visual.ImageStim(self.display, image=imgResize)
-            
-            imgResizeVisual.draw()
+            if self.camera_image is None:
+                self.camera_image = visual.ImageStim(self.display, image=imgResize)
+            else:
+                self.camera_image.image = imgResize
+
+            self.camera_image.draw()
             self.draw_cross_hair()    
             self.display.flip()
            
@@ -0,0 +1,691 @@
+# -*- coding: utf-8 -*-
+"""
+Gaze event detection on a buffered sample stream.
+
+The PyGaze event criteria (saccades by velocity / acceleration, fixations by dispersion and duration, blinks by
+invalid samples) are applied to chunks of samples at once, rather than to the newest sample in a busy loop. A sample
+source buffers all samples since the last read; between reads, waiting threads sleep.
+
+    source		--	delivers samples as arrays: EyelinkSampleSource (EyeLink link buffer), or
+					RecordedSampleSource (a recorded trace, e.g. for testing)
+    detectors		--	one per event type (SaccadeStartDetector, ...): feed() them chunks of samples until they
+					return an event
+    GazeEventEngine	--	blocking waits with timeouts (wait_for_saccade_start(), ...), a generator of events
+					(events()), and callbacks (on() and poll())
+    BlinkMonitor	--	blinks and losses of tracking, from gaze validity and pupil size, detected in a
+					background thread; tells whether gaze is currently usable (masked())
+
+All times are in milliseconds, all positions in pixels. Invalid samples (e.g. during blinks) have position (-1, -1).
+"""
+
+from collections import namedtuple, deque
+import threading
+import time
+
+import numpy as np
+
+GazeEvent = namedtuple('GazeEvent', ['name', 'time', 'start_pos', 'end_pos'])
+
+
+def _valid(x, y):
+    return ~((x == -1) & (y == -1))
+
+
+def _drop_repeats(x, y, prev_pos):
+    """ Indices of samples that differ from the previous one (the first is compared to prev_pos, if any) """
+    if len(x) == 0:
+        return np.zeros(0, dtype=int)
+    changed = np.ones(len(x), dtype=bool)
+    changed[1:] = (x[1:] != x[:-1]) | (y[1:] != y[:-1])
+    if prev_pos is not None:
+        changed[0] = x[0] != prev_pos[0] or y[0] != prev_pos[1]
+    return np.nonzero(changed)[0]
+
+
+class SaccadeStartDetector(object):
+    """
+    A saccade starts at the first movement between (valid, changed) samples that is larger than the noise level
+    (weighted distance: (sx / pxdsttresh[0]) ** 2 + (sy / pxdsttresh[1]) ** 2 > weightdist), and of which either the
+    velocity or the acceleration (relative to the previous supra-noise movement) is above threshold.
+    """
+
+    def __init__(self, pxdsttresh, weightdist, pxspdtresh, pxacctresh):
+        self.pxdsttresh = pxdsttresh
+        self.weightdist = weightdist
+        self.pxspdtresh = pxspdtresh
+        self.pxacctresh = pxacctresh
+        self.prev_pos = None
+        self.t0 = None
+        self.v0 = 0.
+
+    def feed(self, t, x, y):
+        """
+        Processes a chunk of samples. Returns (event, n) where event is a GazeEvent (or None) and n the number of
+        samples used: samples after an event are left for the next detector.
+        """
+
+        valid = np.nonzero(_valid(x, y))[0]
+        idx = valid[_drop_repeats(x[valid], y[valid], self.prev_pos)]
+        if len(idx) == 0:
+            return None, len(t)
+
+        if self.prev_pos is None:
+            # The first valid sample is the starting position
+            self.prev_pos = (x[idx[0]], y[idx[0]])
+            self.t0 = t[idx[0]]
+            idx = idx[1:]
+            if len(idx) == 0:
+                return None, len(t)
+
+        # Movements between subsequent samples, and which of these are larger than the noise level
+        px = np.concatenate(([self.prev_pos[0]], x[idx]))
+        py = np.concatenate(([self.prev_pos[1]], y[idx]))
+        sx, sy = np.diff(px), np.diff(py)
+        supra_noise = np.nonzero((sx / self.pxdsttresh[0]) ** 2 + (sy / self.pxdsttresh[1]) ** 2 > self.weightdist)[0]
+
+        if len(supra_noise) > 0:
+            # Velocity and acceleration, relative to the previous supra-noise movement
+            ts = t[idx[supra_noise]]
+            dt = np.diff(np.concatenate(([self.t0], ts)))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                v = np.hypot(sx[supra_noise], sy[supra_noise]) / dt
+                a = np.diff(np.concatenate(([self.v0], v))) / dt
+            saccadic = np.nonzero((v > self.pxspdtresh) | (a > self.pxacctresh))[0]
+
+            if len(saccadic) > 0:
+                k = supra_noise[saccadic[0]]
+                return GazeEvent('saccade_start', t[idx[k]], (px[k], py[k]), None), idx[k] + 1
+
+            self.t0, self.v0 = ts[-1], v[-1]
+
+        self.prev_pos = (px[-1], py[-1])
+        return None, len(t)
+
+
+class SaccadeEndDetector(object):
+    """
+    A saccade (that started at start_time from start_pos) ends at the first (valid, changed) sample at which the
+    velocity is below threshold, and the eye decelerates, but less than the acceleration threshold.
+    """
+
+    def __init__(self, start_time, start_pos, pxspdtresh, pxacctresh):
+        self.start_pos = start_pos
+        self.pxspdtresh = pxspdtresh
+        self.pxacctresh = pxacctresh
+        self.prev_pos = None
+        self.t0 = start_time
+        self.v0 = None
+
+    def feed(self, t, x, y):
+        """ See SaccadeStartDetector.feed() """
+
+        valid = np.nonzero(_valid(x, y))[0]
+        idx = valid[_drop_repeats(x[valid], y[valid], self.prev_pos)]
+        if len(idx) == 0:
+            return None, len(t)
+
+        if self.prev_pos is None:
+            # Initial velocity: from the saccade start to the first valid sample
+            i = idx[0]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.v0 = np.hypot(x[i] - self.start_pos[0], y[i] - self.start_pos[1]) / (t[i] - self.t0)
+            self.prev_pos, self.t0 = (x[i], y[i]), t[i]
+            idx = idx[1:]
+            if len(idx) == 0:
+                return None, len(t)
+
+        px = np.concatenate(([self.prev_pos[0]], x[idx]))
+        py = np.concatenate(([self.prev_pos[1]], y[idx]))
+        dt = np.diff(np.concatenate(([self.t0], t[idx])))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            v = np.hypot(np.diff(px), np.diff(py)) / dt
+            a = np.diff(np.concatenate(([self.v0], v))) / dt
+        ended = np.nonzero((v < self.pxspdtresh) & (a > -self.pxacctresh) & (a < 0))[0]
+
+        if len(ended) > 0:
+            k = ended[0]
+            return GazeEvent('saccade_end', t[idx[k]], self.start_pos, (px[k + 1], py[k + 1])), idx[k] + 1
+
+        self.prev_pos, self.t0, self.v0 = (px[-1], py[-1]), t[idx[-1]], v[-1]
+        return None, len(t)
+
+
+class FixationStartDetector(object):
+    """
+    A fixation starts when gaze has stayed within pxfixtresh of a position for fixtimetresh. A valid sample further
+    away restarts the fixation from that sample.
+    """
+
+    def __init__(self, pxfixtresh, fixtimetresh):
+        self.pxfixtresh = pxfixtresh
+        self.fixtimetresh = fixtimetresh
+        self.start_pos = None
+        self.t0 = None
+
+    def feed(self, t, x, y):
+        """ See SaccadeStartDetector.feed() """
+
+        idx = np.nonzero(_valid(x, y))[0]
+        if len(idx) > 0 and self.start_pos is None:
+            self.start_pos, self.t0 = (x[idx[0]], y[idx[0]]), t[idx[0]]
+            idx = idx[1:]
+
+        # Every iteration handles all samples up to the next one that is too far away (which restarts the fixation)
+        while len(idx) > 0:
+            too_far = (x[idx] - self.start_pos[0]) ** 2 + (y[idx] - self.start_pos[1]) ** 2 > self.pxfixtresh ** 2
+            fixated = ~too_far & (t[idx] - self.t0 >= self.fixtimetresh)
+
+            first_far = np.argmax(too_far) if too_far.any() else len(idx)
+            if fixated[:first_far].any():
+                i = idx[np.argmax(fixated)]
+                return GazeEvent('fixation_start', t[i], self.start_pos, None), i + 1
+            if first_far == len(idx):
+                break
+
+            i = idx[first_far]
+            self.start_pos, self.t0 = (x[i], y[i]), t[i]
+            idx = idx[first_far + 1:]
+
+        return None, len(t)
+
+
+class FixationEndDetector(object):
+    """ A fixation (at start_pos) ends at the first valid sample further than pxfixtresh away """
+
+    def __init__(self, start_pos, pxfixtresh):
+        self.start_pos = start_pos
+        self.pxfixtresh = pxfixtresh
+
+    def feed(self, t, x, y):
+        """ See SaccadeStartDetector.feed() """
+
+        too_far = _valid(x, y) & ((x - self.start_pos[0]) ** 2 + (y - self.start_pos[1]) ** 2 > self.pxfixtresh ** 2)
+        if too_far.any():
+            i = np.argmax(too_far)
+            return GazeEvent('fixation_end', t[i], self.start_pos, (x[i], y[i])), i + 1
+        return None, len(t)
+
+
+class BlinkStartDetector(object):
+    """ A blink starts with a run of invalid samples that lasts at least blink_threshold """
+
+    def __init__(self, blink_threshold):
+        self.blink_threshold = blink_threshold
+        self.run_start = None   # Time of the first invalid sample of the current run
+
+    def feed(self, t, x, y):
+        """ See SaccadeStartDetector.feed() """
+
+        if len(t) == 0:
+            return None, 0
+
+        invalid = ~_valid(x, y)
+
+        # Per sample, the start time of its run of invalid samples (runs can continue from the previous chunk)
+        previous_invalid = np.concatenate(([self.run_start is not None], invalid[:-1]))
+        run_starts = np.where(invalid & ~previous_invalid, np.arange(len(t)), -1)
+        last_start = np.maximum.accumulate(run_starts)
+        run_start_t = np.where(last_start >= 0, t[np.maximum(last_start, 0)],
+                               self.run_start if self.run_start is not None else np.nan)
+
+        with np.errstate(invalid='ignore'):
+            blinking = invalid & (t - run_start_t >= self.blink_threshold)
+        if blinking.any():
+            i = np.argmax(blinking)
+            return GazeEvent('blink_start', run_start_t[i], None, None), i + 1
+
+        self.run_start = run_start_t[-1] if invalid[-1] else None
+        return None, len(t)
+
+
+class BlinkEndDetector(object):
+    """ A blink ends at the first valid sample """
+
+    def feed(self, t, x, y):
+        """ See SaccadeStartDetector.feed() """
+
+        valid = _valid(x, y)
+        if valid.any():
+            i = np.argmax(valid)
+            return GazeEvent('blink_end', t[i], None, (x[i], y[i])), i + 1
+        return None, len(t)
+
+
+class RecordedSampleSource(object):
+    """
+    Replays a recorded trace (arrays of times in ms and gaze positions; invalid samples at (-1, -1)), optionally
+    with pupil sizes (NaN if unknown).
+
+    If realtime is False, every read() returns the next chunk_size samples, until the trace is exhausted. If realtime
+    is True, read() returns the samples that would have arrived since the previous read, with the first sample at
+    the moment of the first read.
+    """
+
+    def __init__(self, t, x, y, chunk_size=50, realtime=False, pupil=None):
+        self.t = np.asarray(t, dtype=float)
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.pupil = np.full(len(self.t), np.nan) if pupil is None else np.asarray(pupil, dtype=float)
+        self.chunk_size = chunk_size
+        self.realtime = realtime
+        self.position = 0
+        self.start_time = None
+
+    @property
+    def exhausted(self):
+        return self.position >= len(self.t)
+
+    def flush(self):
+        """ A recording has no old samples to discard """
+        pass
+
+    def read(self):
+        return self.read_with_pupil()[:3]
+
+    def read_with_pupil(self):
+        if self.realtime:
+            if self.start_time is None:
+                self.start_time = time.time() * 1000 - self.t[0]
+            end = np.searchsorted(self.t, time.time() * 1000 - self.start_time, side='right')
+        else:
+            end = self.position + self.chunk_size
+        chunk = slice(self.position, end)
+        self.position = max(self.position, min(end, len(self.t)))
+        return self.t[chunk], self.x[chunk], self.y[chunk], self.pupil[chunk]
+
+
+class EyelinkSampleSource(object):
+    """
+    Samples of the eye used, from the EyeLink link sample buffer, with times converted to the PyGaze clock.
+
+    Reading drains the link buffer (link events are discarded; the 'native' event detection reads events itself).
+    If the buffer holds no samples (e.g. link samples are disabled), the newest sample is used instead.
+
+    Parameters
+    ----------
+    tracker: libeyelink instance
+    """
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.last_time = None
+        self.clock_offset = 0.
+
+    def _eye_sample(self, sample):
+        """ Gaze position and pupil size of the eye used, or (-1, -1, -1) if invalid """
+        import pylink
+        if self.tracker.eye_used == self.tracker.right_eye and sample.isRightSample():
+            eye = sample.getRightEye()
+        elif self.tracker.eye_used == self.tracker.left_eye and sample.isLeftSample():
+            eye = sample.getLeftEye()
+        else:
+            return -1, -1, -1
+        gaze = eye.getGaze()
+        if gaze[0] == getattr(pylink, 'MISSING_DATA', -32768):
+            return -1, -1, -1
+        return gaze[0], gaze[1], eye.getPupilSize()
+
+    def flush(self):
+        """ Discards all buffered samples, and measures the offset between the tracker clock and the PyGaze clock """
+        self.read()
+        self.clock_offset = self.tracker._get_eyelink_clock_async()
+
+    def read(self):
+        return self.read_with_pupil()[:3]
+
+    def read_with_pupil(self):
+        import pylink
+        eyelink = pylink.getEYELINK()
+        if self.tracker.eye_used is None:
+            self.tracker.set_eye_used()
+
+        t, samples = [], []
+        with self.tracker.link_lock:   # the link is shared with other threads
+            data_type = eyelink.getNextData()
+            while data_type:
+                if data_type == pylink.SAMPLE_TYPE:
+                    sample = eyelink.getFloatData()
+                    if sample.getTime() != self.last_time:
+                        t.append(sample.getTime())
+                        samples.append(self._eye_sample(sample))
+                        self.last_time = sample.getTime()
+                data_type = eyelink.getNextData()
+
+            if len(t) == 0:
+                sample = eyelink.getNewestSample()
+                if sample is not None and sample.getTime() != self.last_time:
+                    t, samples = [sample.getTime()], [self._eye_sample(sample)]
+                    self.last_time = sample.getTime()
+
+        samples = np.array(samples, dtype=float).reshape(-1, 3)
+        return np.array(t, dtype=float) - self.clock_offset, samples[:, 0], samples[:, 1], samples[:, 2]
+
+
+class GazeEventEngine(object):
+    """
+    Detects gaze events in the samples of a source.
+
+    Waiting (wait_for_*(), events()) reads the source every poll_interval seconds and sleeps in between, instead of
+    spinning. Waits take a timeout (in ms; None waits forever) and return None when it passes, or when a recorded
+    source is exhausted.
+
+    Parameters
+    ----------
+    source: sample source (see EyelinkSampleSource and RecordedSampleSource)
+    pxdsttresh: tuple
+        RMS noise (x, y) in pixels
+    weightdist: float
+        Weighted distance (in units of noise) that a movement must exceed to count as a saccade
+    pxspdtresh: float
+        Saccade velocity threshold, in pixels / ms
+    pxacctresh: float
+        Saccade acceleration threshold, in pixels / ms ** 2
+    pxfixtresh: float
+        Maximum distance of gaze from the start of a fixation, in pixels
+    fixtimetresh: float
+        Minimal fixation duration, in ms
+    blink_threshold: float
+        Minimal blink duration, in ms
+    poll_interval: float
+        Sleep between reads of the source, in seconds
+    """
+
+    def __init__(self, source, pxdsttresh, weightdist, pxspdtresh, pxacctresh, pxfixtresh, fixtimetresh,
+                 blink_threshold, poll_interval=0.001):
+        self.source = source
+        self.pxdsttresh = pxdsttresh
+        self.weightdist = weightdist
+        self.pxspdtresh = pxspdtresh
+        self.pxacctresh = pxacctresh
+        self.pxfixtresh = pxfixtresh
+        self.fixtimetresh = fixtimetresh
+        self.blink_threshold = blink_threshold
+        self.poll_interval = poll_interval
+
+        self.callbacks = {}
+        self._pending = None   # Samples of the last chunk that came after the last event
+        self._chains = None
+
+    # Detectors
+    def first_detector(self, kind):
+        """ Detector for the first event of kind ('saccade', 'fixation' or 'blink') """
+        if kind == 'saccade':
+            return SaccadeStartDetector(self.pxdsttresh, self.weightdist, self.pxspdtresh, self.pxacctresh)
+        elif kind == 'fixation':
+            return FixationStartDetector(self.pxfixtresh, self.fixtimetresh)
+        elif kind == 'blink':
+            return BlinkStartDetector(self.blink_threshold)
+        raise ValueError('Unknown gaze event kind %s' % kind)
+
+    def next_detector(self, event):
+        """ Detector for the event that follows event (e.g. the end of a saccade after its start) """
+        if event.name == 'saccade_start':
+            return SaccadeEndDetector(event.time, event.start_pos, self.pxspdtresh, self.pxacctresh)
+        elif event.name == 'fixation_start':
+            return FixationEndDetector(event.start_pos, self.pxfixtresh)
+        elif event.name == 'blink_start':
+            return BlinkEndDetector()
+        return self.first_detector(event.name.split('_')[0])
+
+    def _read(self):
+        if self._pending is not None:
+            chunk, self._pending = self._pending, None
+            return chunk
+        return self.source.read()
+
+    # Blocking waits
+    def wait(self, detector, timeout=None, flush=True):
+        """ Feeds new samples to detector until it detects its event, and returns it (or None on time-out) """
+
+        if flush:
+            self._pending = None
+            self.source.flush()
+        end_time = None if timeout is None else time.time() + timeout / 1000.
+
+        while True:
+            t, x, y = self._read()
+            if len(t) > 0:
+                event, n_used = detector.feed(t, x, y)
+                if event is not None:
+                    if n_used < len(t):
+                        self._pending = (t[n_used:], x[n_used:], y[n_used:])
+                    return event
+            elif getattr(self.source, 'exhausted', False):
+                return None
+
+            if end_time is not None and time.time() > end_time:
+                return None
+            time.sleep(self.poll_interval)
+
+    def wait_for_saccade_start(self, timeout=None):
+        """ Returns (time, start position), or None on time-out """
+        event = self.wait(self.first_detector('saccade'), timeout=timeout)
+        return None if event is None else (event.time, event.start_pos)
+
+    def wait_for_saccade_end(self, timeout=None):
+        """ Waits for a saccade to start and end. Returns (end time, start position, end position), or None """
+        end_time = None if timeout is None else time.time() + timeout / 1000.
+        start = self.wait(self.first_detector('saccade'), timeout=timeout)
+        if start is None:
+            return None
+        remaining = None if end_time is None else max(0, end_time - time.time()) * 1000
+        event = self.wait(self.next_detector(start), timeout=remaining, flush=False)
+        return None if event is None else (event.time, event.start_pos, event.end_pos)
+
+    def wait_for_fixation_start(self, timeout=None):
+        """ Returns (time, fixation position), or None on time-out """
+        event = self.wait(self.first_detector('fixation'), timeout=timeout)
+        return None if event is None else (event.time, event.start_pos)
+
+    def wait_for_fixation_end(self, timeout=None):
+        """ Waits for a fixation to start and end. Returns (end time, fixation position), or None """
+        end_time = None if timeout is None else time.time() + timeout / 1000.
+        start = self.wait(self.first_detector('fixation'), timeout=timeout)
+        if start is None:
+            return None
+        remaining = None if end_time is None else max(0, end_time - time.time()) * 1000
+        event = self.wait(self.next_detector(start), timeout=remaining, flush=False)
+        return None if event is None else (event.time, event.start_pos)
+
+    def wait_for_blink_start(self, timeout=None):
+        """ Returns the time of the first invalid sample of the blink, or None on time-out """
+        event = self.wait(self.first_detector('blink'), timeout=timeout)
+        return None if event is None else event.time
+
+    def wait_for_blink_end(self, timeout=None):
+        """ Returns the time of the first valid sample, or None on time-out """
+        event = self.wait(BlinkEndDetector(), timeout=timeout)
+        return None if event is None else event.time
+
+    # Continuous detection
+    def _detect(self, chains, t, x, y):
+        """ Runs all detector chains over a chunk of samples. Returns all events, in order of time """
+        events = []
+        for kind in chains:
+            start = 0
+            while start < len(t):
+                event, n_used = chains[kind].feed(t[start:], x[start:], y[start:])
+                if event is None:
+                    break
+                events.append(event)
+                chains[kind] = self.next_detector(event)
+                start += n_used
+        events.sort(key=lambda event: event.time)
+        return events
+
+    def events(self, kinds=('saccade', 'fixation', 'blink'), timeout=None):
+        """ Generator of all events of kinds, until timeout (ms) passes or a recorded source is exhausted """
+
+        self.source.flush()
+        chains = dict((kind, self.first_detector(kind)) for kind in kinds)
+        end_time = None if timeout is None else time.time() + timeout / 1000.
+
+        while end_time is None or time.time() < end_time:
+            t, x, y = self.source.read()
+            if len(t) > 0:
+                for event in self._detect(chains, t, x, y):
+                    yield event
+            elif getattr(self.source, 'exhausted', False):
+                return
+            else:
+                time.sleep(self.poll_interval)
+
+    def on(self, event_name, callback):
+        """ Calls callback(event) for every event_name (e.g. 'saccade_start') found by poll() """
+        self.callbacks.setdefault(event_name, []).append(callback)
+
+    def poll(self, kinds=('saccade', 'fixation', 'blink')):
+        """ Processes all samples that arrived since the last poll (never blocks), calls the callbacks of the events
+        that were found and returns these. Call this e.g. once per frame """
+
+        if self._chains is None:
+            self.source.flush()
+            self._chains = dict((kind, self.first_detector(kind)) for kind in kinds)
+
+        t, x, y = self.source.read()
+        events = self._detect(self._chains, t, x, y) if len(t) > 0 else []
+        for event in events:
+            for callback in self.callbacks.get(event.name, []):
+                callback(event)
+        return events
+
+
+class BlinkMonitor(object):
+    """
+    Detects blinks and losses of tracking in the samples of a source with pupil sizes (read_with_pupil()). Every
+    interval seconds, a background thread reads the samples that arrived and classifies them at once, so that the
+    frame loop only has to ask masked() whether gaze can be used now, and count blinks (n_blinks).
+
+    A sample is lost if its gaze is invalid, its pupil size is not positive, or its pupil is smaller than pupil_drop
+    times the median pupil size of the last baseline_samples good samples: the lid covers part of the pupil at the
+    start and end of a blink, when gaze already moves but tracking is not yet lost. A run of lost samples is a blink
+    if it lasts from min_blink to max_blink ms, and a data loss if it lasts longer; shorter runs are only masked.
+    Gaze is masked during a run of lost samples and for padding ms after it, while the eye settles.
+
+    Note that an EyelinkSampleSource drains the link buffer: do not read it elsewhere (e.g. by a GazeEventEngine)
+    while the monitor runs. Pause the monitor while the tracker is set up (calibration reads the link itself).
+
+    Parameters
+    ----------
+    source: sample source with read_with_pupil() (see RecordedSampleSource and EyelinkSampleSource)
+    min_blink: float
+        ms
+    max_blink: float
+        ms
+    padding: float
+        ms
+    pupil_drop: float
+        Fraction of the baseline pupil size
+    baseline_samples: int
+    interval: float
+        Seconds between reads of the source
+    """
+
+    def __init__(self, source, min_blink=50, max_blink=500, padding=100, pupil_drop=0.6, baseline_samples=500,
+                 interval=0.002):
+        self.source = source
+        self.min_blink = min_blink
+        self.max_blink = max_blink
+        self.padding = padding
+        self.pupil_drop = pupil_drop
+        self.interval = interval
+
+        self.baseline = np.zeros(baseline_samples)   # ring of the pupil sizes of the last good samples
+        self.n_baseline = 0
+        self.run_start = None       # time of the first lost sample of the current run of lost samples
+        self.lost = False           # whether the newest sample was lost
+        self.last_time = -np.inf    # time of the newest sample
+        self.mask_end = -np.inf     # end of the padding after the last run of lost samples
+        self.n_blinks = 0
+        self.n_losses = 0
+        self.periods = deque(maxlen=10000)   # (start, end, 'blink' / 'loss') of all runs of lost samples
+
+        self._running = threading.Event()   # Set while reading the source
+        self._stopped = threading.Event()   # Set when the thread should end
+        self._reading = threading.Lock()    # Held while reading the source
+        self._thread = threading.Thread(target=self._run, name='BlinkMonitor')
+        self._thread.daemon = True
+
+    def start(self):
+        self.source.flush()
+        self._running.set()
+        self._thread.start()
+
+    def pause(self):
+        """ Stops reading the source, e.g. while the eye tracker is set up. Returns once a read in progress is done """
+        self._running.clear()
+        with self._reading:
+            pass
+
+    def running(self):
+        """ Whether the thread reads the source (started, and not paused or stopped) """
+        return self._running.is_set() and not self._stopped.is_set()
+
+    def resume(self):
+        """ Resumes reading after pause(). Samples that arrived during the pause are discarded """
+        self.source.flush()
+        self._running.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._running.set()   # Wake up the thread if paused, so it can end
+        if self._thread.is_alive():
+            self._thread.join(timeout=1)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._running.wait()
+            if self._stopped.is_set():
+                break
+            with self._reading:
+                if self._running.is_set():   # not paused in the meantime
+                    self.process(*self.source.read_with_pupil())
+
+    def masked(self):
+        """ Whether the newest gaze sample is lost or follows a run of lost samples by less than padding ms """
+        return self.lost or self.last_time < self.mask_end
+
+    def process(self, t, x, y, pupil):
+        """ Classifies a chunk of samples (pupil sizes may be NaN if unknown). Returns the runs of lost samples
+        that ended in this chunk, as (start, end, kind) """
+
+        if len(t) == 0:
+            return []
+
+        known = ~np.isnan(pupil)
+        with np.errstate(invalid='ignore'):
+            lost = ~_valid(x, y) | (known & (pupil <= 0))
+            if self.n_baseline > 0:
+                baseline = np.median(self.baseline[:min(self.n_baseline, len(self.baseline))])
+                lost |= known & (pupil < self.pupil_drop * baseline)
+
+        # Pupil sizes of good samples go into the baseline ring
+        good = pupil[known & ~lost][-len(self.baseline):]
+        slots = (self.n_baseline + np.arange(len(good))) % len(self.baseline)
+        self.baseline[slots] = good
+        self.n_baseline += len(good)
+
+        # Runs of lost samples, possibly continuing from the previous chunk. A run ends at the first good sample
+        previous_lost = np.concatenate(([self.run_start is not None], lost[:-1]))
+        start_times = t[lost & ~previous_lost]
+        if self.run_start is not None:
+            start_times = np.concatenate(([self.run_start], start_times))
+        end_times = t[~lost & previous_lost]
+        durations = end_times - start_times[:len(end_times)]
+
+        periods = []
+        for start, end, duration in zip(start_times, end_times, durations):
+            if duration > self.max_blink:
+                periods.append((float(start), float(end), 'loss'))
+                self.n_losses += 1
+            elif duration >= self.min_blink:
+                periods.append((float(start), float(end), 'blink'))
+                self.n_blinks += 1
+        self.periods.extend(periods)
+
+        if len(end_times) > 0:
+            self.mask_end = end_times[-1] + self.padding
+        self.run_start = start_times[-1] if lost[-1] else None
+        self.lost = bool(lost[-1])
+        self.last_time = t[-1]
+        return periods
@@ -28,6 +28,7 @@ from pygaze.keyboard import Keyboard
 from pygaze.sound import Sound
 from .EyeLinkCoreGraphicsPsychoPy import EyeLinkCoreGraphicsPsychoPy as EyelinkGraphics
 from .baseeyetracker import BaseEyeTracker
+from .gazeevents import GazeEventEngine, EyelinkSampleSource, BlinkMonitor
 
 # we try importing the copy_docstr function, but as we do not really need it
 # for a proper functioning of the code, we simply ignore it when it fails to
@@ -47,14 +48,41 @@ except:
         print("Failed to import PIL.")
 
 import pylink
-import copy
 import math
 import sys
+import time
+import threading
+import functools
 import os.path
 
 _eyelink = None
 
 
+def reads_link_buffer(method):
+
+    """
+	Decorator for methods that read samples or events from the link buffer
+	themselves. A running blink monitor (see libeyelink.blink_monitor) drains
+	the same buffer, so it is paused while the method runs.
+	"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        monitor = self._blink_monitor
+        # a nested call finds the monitor paused already, and leaves it to
+        # the outer call to resume it
+        paused = monitor is not None and monitor.running()
+        if paused:
+            monitor.pause()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            if paused:
+                monitor.resume()
+
+    return wrapper
+
+
 def deg2pix(cmdist, angle, pixpercm):
     """Returns the value in pixels for given values (internal use)
 
@@ -126,6 +154,11 @@ class libeyelink(BaseEyeTracker):
         self.pupil_size_mode = pupil_size_mode
         self.prevsample = (-1, -1)
         self.prevps = -1
+        self._sample_source = None
+        self._blink_monitor = None
+        # pylink is not thread-safe: every call on the link from a thread that can run alongside others (such
+        # as a BlinkMonitor or the marker bus) is made with this lock held
+        self.link_lock = threading.RLock()
 
         # event detection properties
         # degrees; maximal distance from fixation start (if gaze wanders beyond
@@ -238,26 +271,30 @@ class libeyelink(BaseEyeTracker):
 
         """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
 
-        pylink.getEYELINK().sendCommand(cmd)
+        with self.link_lock:
+            pylink.getEYELINK().sendCommand(cmd)
 
     def log(self, msg):
 
         """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
 
-        pylink.getEYELINK().sendMessage(msg)
+        with self.link_lock:
+            pylink.getEYELINK().sendMessage(msg)
 
     def status_msg(self, msg):
 
         """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
 
         print('status message: %s' % msg)
-        pylink.getEYELINK().sendCommand("record_status_message '%s'" % msg)
+        with self.link_lock:
+            pylink.getEYELINK().sendCommand("record_status_message '%s'" % msg)
 
     def connected(self):
 
         """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
 
-        return pylink.getEYELINK().isConnected()
+        with self.link_lock:
+            return pylink.getEYELINK().isConnected()
 
     def calibrate(self):
 
@@ -275,7 +312,8 @@ class libeyelink(BaseEyeTracker):
             # attempt calibrate; confirm abort when esc pressed
             while True:
                 self.eyelink_graphics.esc_pressed = False
-                pylink.getEYELINK().doTrackerSetup()
+                with self.link_lock:
+                    pylink.getEYELINK().doTrackerSetup()
                 if not self.eyelink_graphics.esc_pressed:
                     break
                 self.confirm_abort_experiment()
@@ -428,6 +466,7 @@ class libeyelink(BaseEyeTracker):
                 "WARNING libeyelink.libeyelink.prepare_drift_correction(): "
                 "Failed to perform drift correction (waitForBlockStart error)")
 
+    @reads_link_buffer
     def fix_triggered_drift_correction(self, pos=None, min_samples=30,
                                        max_dev=60, reset_threshold=10):
 
@@ -445,6 +484,10 @@ class libeyelink(BaseEyeTracker):
         self.draw_drift_correction_target(pos[0], pos[1])
 
         # loop until we have enough samples
+        if self._sample_source is None:
+            self._sample_source = EyelinkSampleSource(self)
+        sample_source = self._sample_source
+        sample_source.flush()
         lx = []
         ly = []
         while len(lx) < min_samples:
@@ -459,8 +502,9 @@ class libeyelink(BaseEyeTracker):
                     "'q' pressed")
                 return False
 
-            # pressing escape enters the calibration screen
-            resp = self.kb.get_key(keylist=["escape", "q"], timeout=1)[0]
+            # pressing escape enters the calibration screen (checked without
+            # waiting; the loop sleeps below until new samples arrive)
+            resp = self.kb.get_key(keylist=["escape", "q"], timeout=0)[0]
             if resp == 'escape':
                 self.recording = False
                 self.confirm_abort_experiment()
@@ -475,9 +519,16 @@ class libeyelink(BaseEyeTracker):
                     "libeyelink.libeyelink.fix_triggered_drift_correction(): "
                     "'q' pressed")
                 return False
-            # collect a sample
-            x, y = self.sample()
-            if len(lx) == 0 or x != lx[-1] or y != ly[-1]:
+            # collect all samples since the previous iteration
+            t, xs, ys = sample_source.read()
+            if len(t) == 0:
+                time.sleep(0.001)
+            for x, y in zip(xs, ys):
+                if len(lx) == min_samples:
+                    break
+                if not self.is_valid_sample((x, y)) or \
+                        (len(lx) > 0 and x == lx[-1] and y == ly[-1]):
+                    continue
                 # if present sample deviates too much from previous sample,
                 # start from scratch.
                 if len(lx) > 0 and (abs(x - lx[-1]) > reset_threshold or \
@@ -530,7 +581,8 @@ class libeyelink(BaseEyeTracker):
         while True:
             # params: write samples, write event, send samples, send events
             print(u'starting recording ...')
-            error = pylink.getEYELINK().startRecording(1, 1, 1, 1)
+            with self.link_lock:
+                error = pylink.getEYELINK().startRecording(1, 1, 1, 1)
             print(u'returned %s' % error)
             if not error:
                 break
@@ -552,7 +604,9 @@ class libeyelink(BaseEyeTracker):
         # wait a bit until samples start coming in
         print(u'Wait for block start ...')
         pylink.msecDelay(100)
-        if not pylink.getEYELINK().waitForBlockStart(100, 1, 0):
+        with self.link_lock:
+            block_started = pylink.getEYELINK().waitForBlockStart(100, 1, 0)
+        if not block_started:
             raise Exception(
                 "Error in libeyelink.libeyelink.start_recording(): Failed to "
                 "start recording (waitForBlockStart error)!")
@@ -565,7 +619,8 @@ class libeyelink(BaseEyeTracker):
         print(u'stopping recording ...')
         self.recording = False
         pylink.endRealTimeMode()
-        pylink.getEYELINK().setOfflineMode()
+        with self.link_lock:
+            pylink.getEYELINK().setOfflineMode()
         pylink.msecDelay(500)
         print(u'done ...')
 
@@ -598,7 +653,8 @@ class libeyelink(BaseEyeTracker):
 
         """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
 
-        self.eye_used = pylink.getEYELINK().eyeAvailable()
+        with self.link_lock:
+            self.eye_used = pylink.getEYELINK().eyeAvailable()
         if self.eye_used == self.right_eye:
             self.log_var("eye_used", "right")
         elif self.eye_used == self.left_eye or self.eye_used == self.binocular:
@@ -620,7 +676,8 @@ class libeyelink(BaseEyeTracker):
         if self.eye_used == None:
             self.set_eye_used()
         # get newest sample
-        s = pylink.getEYELINK().getNewestSample()
+        with self.link_lock:
+            s = pylink.getEYELINK().getNewestSample()
         # check if sample is new
         if s != None:
             # right eye
@@ -649,7 +706,8 @@ class libeyelink(BaseEyeTracker):
                 "started before collecting eyelink data!")
         if self.eye_used == None:
             self.set_eye_used()
-        s = pylink.getEYELINK().getNewestSample()
+        with self.link_lock:
+            s = pylink.getEYELINK().getNewestSample()
         if s != None:
             if self.eye_used == self.right_eye and s.isRightSample():
                 gaze = s.getRightEye().getGaze()
@@ -683,8 +741,10 @@ class libeyelink(BaseEyeTracker):
 		Returns:
 		The tracker time minus the clock time
 		"""
-        return pylink.getEYELINK().trackerTime() - clock.get_time()
+        with self.link_lock:
+            return pylink.getEYELINK().trackerTime() - clock.get_time()
 
+    @reads_link_buffer
     def wait_for_event(self, event):
 
         """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
@@ -701,9 +761,10 @@ class libeyelink(BaseEyeTracker):
             # accumulated in the buffer -- so ignore events that are old:
             t0 = clock.get_time()  # time of call
             while True:
-                d = pylink.getEYELINK().getNextData()
+                with self.link_lock:
+                    d = pylink.getEYELINK().getNextData()
+                    float_data = pylink.getEYELINK().getFloatData() if d == event else None
                 if d == event:
-                    float_data = pylink.getEYELINK().getFloatData()
                     # corresponding clock_time
                     tc = float_data.getTime() - self._get_eyelink_clock_async()
                     if tc > t0:
@@ -727,9 +788,37 @@ class libeyelink(BaseEyeTracker):
                  "is not supported") % event)
         return outcome
 
-    def wait_for_saccade_start(self):
+    def gaze_event_engine(self, poll_interval=0.001):
+        """
+		Returns the engine for the PyGaze event detection (see gazeevents), with
+		the current thresholds. The engine reads the link sample buffer, so that
+		no samples are missed, and sleeps between reads instead of spinning.
+		"""
+        if self._sample_source is None:
+            self._sample_source = EyelinkSampleSource(self)
+        return GazeEventEngine(self._sample_source, self.pxdsttresh,
+                               self.weightdist, self.pxspdtresh, self.pxacctresh,
+                               self.pxfixtresh, self.fixtimetresh,
+                               self.blink_threshold, poll_interval=poll_interval)
+
+    def blink_monitor(self, **args):
+        """
+		Returns a gazeevents.BlinkMonitor (not yet started) on the link samples
+		of the eye used, with their pupil sizes. keyword arguments are passed on
+		to BlinkMonitor. While it runs, it drains the link sample buffer, so it
+		is paused by the methods that read the buffer themselves (see
+		reads_link_buffer).
+		"""
+        self._blink_monitor = BlinkMonitor(EyelinkSampleSource(self), **args)
+        return self._blink_monitor
+
+    @reads_link_buffer
+    def wait_for_saccade_start(self, timeout=None):
 
-        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker
+
+		With the PyGaze method, returns None if no saccade started within
+		timeout (ms; None waits indefinitely)."""
 
         # # # # #
         # EyeLink method
@@ -743,54 +832,14 @@ class libeyelink(BaseEyeTracker):
         # PyGaze method
 
         else:
+            return self.gaze_event_engine().wait_for_saccade_start(timeout)
 
-            # get starting position (no blinks)
-            newpos = self.sample()
-            while not self.is_valid_sample(newpos):
-                newpos = self.sample()
-            # get starting time, position, intersampledistance, and velocity
-            t0 = clock.get_time()
-            prevpos = newpos[:]
-            s = 0
-            v0 = 0
-
-            # get samples
-            saccadic = False
-            while not saccadic:
-                # get new sample
-                newpos = self.sample()
-                t1 = clock.get_time()
-                if self.is_valid_sample(newpos) and newpos != prevpos:
-                    # check if distance is larger than precision error
-                    sx = newpos[0] - prevpos[0];
-                    sy = newpos[1] - prevpos[1]
-                    # weigthed distance: (sx/tx)**2 + (sy/ty)**2 > 1 means
-                    # movement larger than RMS noise
-                    if (sx / self.pxdsttresh[0]) ** 2 + (sy / self.pxdsttresh[1]) ** 2 \
-                            > self.weightdist:
-                        # calculate distance
-                        # intersampledistance = speed in pixels/ms
-                        s = ((sx) ** 2 + (sy) ** 2) ** 0.5
-                        # calculate velocity
-                        v1 = s / (t1 - t0)
-                        # calculate acceleration
-                        a = (v1 - v0) / (t1 - t0)  # acceleration in pixels/ms**2
-                        # check if either velocity or acceleration are above
-                        # threshold values
-                        if v1 > self.pxspdtresh or a > self.pxacctresh:
-                            saccadic = True
-                            spos = prevpos[:]
-                            stime = clock.get_time()
-                        # update previous values
-                        t0 = copy.copy(t1)
-                        v0 = copy.copy(v1)
-                    # udate previous sample
-                    prevpos = newpos[:]
-            return stime, spos
-
-    def wait_for_saccade_end(self):
+    @reads_link_buffer
+    def wait_for_saccade_end(self, timeout=None):
 
-        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker
+
+		With the PyGaze method, returns None on time-out."""
 
         # # # # #
         # EyeLink method
@@ -804,52 +853,14 @@ class libeyelink(BaseEyeTracker):
         # PyGaze method
 
         else:
+            return self.gaze_event_engine().wait_for_saccade_end(timeout)
 
-            # get starting position (no blinks)
-            t0, spos = self.wait_for_saccade_start()
-            # get valid sample
-            prevpos = self.sample()
-            while not self.is_valid_sample(prevpos):
-                prevpos = self.sample()
-            # get starting time, intersample distance, and velocity
-            t1 = clock.get_time()
-            # = intersample distance = speed in px/sample
-            s = ((prevpos[0] - spos[0]) ** 2 + (prevpos[1] - spos[1]) ** 2) ** 0.5
-            v0 = s / (t1 - t0)
-            # run until velocity and acceleration go below threshold
-            saccadic = True
-            while saccadic:
-                # get new sample
-                newpos = self.sample()
-                t1 = clock.get_time()
-                if self.is_valid_sample(newpos) and newpos != prevpos:
-                    # calculate distance
-                    # = speed in pixels/sample
-                    s = ((newpos[0] - prevpos[0]) ** 2 + \
-                         (newpos[1] - prevpos[1]) ** 2) ** 0.5
-                    # calculate velocity
-                    v1 = s / (t1 - t0)
-                    # calculate acceleration
-                    # acceleration in pixels/sample**2 (actually is
-                    # v1-v0 / t1-t0; but t1-t0 = 1 sample)
-                    a = (v1 - v0) / (t1 - t0)
-                    # check if velocity and acceleration are below threshold
-                    if v1 < self.pxspdtresh and (a > -1 * self.pxacctresh and \
-                                                             a < 0):
-                        saccadic = False
-                        epos = newpos[:]
-                        etime = clock.get_time()
-                    # update previous values
-                    t0 = copy.copy(t1)
-                    v0 = copy.copy(v1)
-                # udate previous sample
-                prevpos = newpos[:]
-
-            return etime, spos, epos
-
-    def wait_for_fixation_start(self):
+    @reads_link_buffer
+    def wait_for_fixation_start(self, timeout=None):
 
-        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker
+
+		With the PyGaze method, returns None on time-out."""
 
         # # # # #
         # EyeLink method
@@ -863,43 +874,16 @@ class libeyelink(BaseEyeTracker):
         # PyGaze method
 
         else:
+            # a 'fixation' has started when gaze position remains reasonably
+            # stable for self.fixtimetresh
+            return self.gaze_event_engine().wait_for_fixation_start(timeout)
 
-            # function assumes a 'fixation' has started when gaze position
-            # remains reasonably stable for self.fixtimetresh
-
-            # get starting position
-            spos = self.sample()
-            while not self.is_valid_sample(spos):
-                spos = self.sample()
-
-            # get starting time
-            t0 = clock.get_time()
-
-            # wait for reasonably stable position
-            moving = True
-            while moving:
-                # get new sample
-                npos = self.sample()
-                # check if sample is valid
-                if self.is_valid_sample(npos):
-                    # check if new sample is too far from starting position
-                    if (npos[0] - spos[0]) ** 2 + (npos[1] - spos[1]) ** 2 > \
-                                    self.pxfixtresh ** 2:  # Pythagoras
-                        # if not, reset starting position and time
-                        spos = copy.copy(npos)
-                        t0 = clock.get_time()
-                    # if new sample is close to starting sample
-                    else:
-                        # get timestamp
-                        t1 = clock.get_time()
-                        # check if fixation time threshold has been surpassed
-                        if t1 - t0 >= self.fixtimetresh:
-                            # return time and starting position
-                            return t1, spos
-
-    def wait_for_fixation_end(self):
+    @reads_link_buffer
+    def wait_for_fixation_end(self, timeout=None):
 
-        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker
+
+		With the PyGaze method, returns None on time-out."""
 
         # # # # #
         # EyeLink method
@@ -913,31 +897,16 @@ class libeyelink(BaseEyeTracker):
         # PyGaze method
 
         else:
+            # a 'fixation' has ended when a deviation of more than fixtresh
+            # from the initial 'fixation' position has been detected
+            return self.gaze_event_engine().wait_for_fixation_end(timeout)
 
-            # function assumes that a 'fixation' has ended when a deviation of
-            # more than fixtresh from the initial 'fixation' position has been
-            # detected
-
-            # get starting time and position
-            stime, spos = self.wait_for_fixation_start()
+    @reads_link_buffer
+    def wait_for_blink_start(self, timeout=None):
 
-            # loop until fixation has ended
-            while True:
-                # get new sample
-                npos = self.sample()  # get newest sample
-                # check if sample is valid
-                if self.is_valid_sample(npos):
-                    # check if sample deviates to much from starting position
-                    if (npos[0] - spos[0]) ** 2 + (npos[1] - spos[1]) ** 2 > \
-                                    self.pxfixtresh ** 2:  # Pythagoras
-                        # break loop if deviation is too high
-                        break
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker
 
-            return clock.get_time(), spos
-
-    def wait_for_blink_start(self):
-
-        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+		With the PyGaze method, returns None on time-out."""
 
         # # # # #
         # EyeLink method
@@ -951,27 +920,14 @@ class libeyelink(BaseEyeTracker):
         # PyGaze method
 
         else:
+            return self.gaze_event_engine().wait_for_blink_start(timeout)
 
-            blinking = False
-
-            # loop until there is a blink
-            while not blinking:
-                # get newest sample
-                gazepos = self.sample()
-                # check if it's a valid sample
-                if not self.is_valid_sample(gazepos):
-                    # get timestamp for possible blink start
-                    t0 = clock.get_time()
-                    # loop until a blink is determined, or a valid sample occurs
-                    while not self.is_valid_sample(self.sample()):
-                        # check if time has surpassed 150 ms
-                        if clock.get_time() - t0 >= self.blink_threshold:
-                            # return timestamp of blink start
-                            return t0
-
-    def wait_for_blink_end(self):
+    @reads_link_buffer
+    def wait_for_blink_end(self, timeout=None):
 
-        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker
+
+		With the PyGaze method, returns None on time-out."""
 
         # # # # #
         # EyeLink method
@@ -985,20 +941,7 @@ class libeyelink(BaseEyeTracker):
         # PyGaze method
 
         else:
-
-            blinking = True
-
-            # loop while there is a blink
-            while blinking:
-                # get newest sample
-                gazepos = self.sample()
-                # check if it's valid
-                if self.is_valid_sample(gazepos):
-                    # if it is a valid sample, blinking has stopped
-                    blinking = False
-
-            # return timestamp of blink end
-            return clock.get_time()
+            return self.gaze_event_engine().wait_for_blink_end(timeout)
 
     def set_draw_calibration_target_func(self, func):
 
@@ -1027,8 +970,9 @@ class libeyelink(BaseEyeTracker):
 						an invalid sample
 		"""
 
-        # return False if a sample is invalid
-        if gazepos == (-1, -1):
+        # return False if a sample is invalid (link samples have MISSING_DATA
+        # coordinates while tracking is lost, e.g. during a blink)
+        if tuple(gazepos) == (-1, -1) or pylink.MISSING_DATA in tuple(gazepos):
             return False
 
         # in any other case, the sample is valid
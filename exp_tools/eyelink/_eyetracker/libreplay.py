@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+Replay tracker: an eye tracker that plays back a recorded gaze trace, so that gaze-contingent code (saccade
+responses, tracker logging, whole eye-response blocks) can run, be benchmarked and regression-tested without an
+EyeLink, e.g. on a headless machine.
+
+Traces are stored as .npy files of a structured array with fields 't' (ms), 'x', 'y' (pixels, (-1, -1) if invalid)
+and 'pupil' (-1 if invalid); see save_replay_file() and convert_asc(). The trace is played at its recorded sample
+rate times speed, against time.time() or against any clock with a getTime() method in seconds, such as a
+VirtualClock that is advanced by hand to run faster than real time.
+
+Commands and log messages are kept (commands, messages) and the messages are written as an ASC-like text file on
+close().
+"""
+
+import os
+import time
+
+import numpy as np
+
+from .baseeyetracker import BaseEyeTracker
+from .gazeevents import GazeEventEngine, BlinkMonitor
+
+try:
+    from pygaze._misc.misc import copy_docstr
+except:
+    pass
+
+replay_dtype = np.dtype([('t', '<f8'), ('x', '<f4'), ('y', '<f4'), ('pupil', '<f4')])
+
+
+def save_replay_file(file_name, t, x, y, pupil=None):
+    """ Saves a gaze trace (times in ms, positions in pixels with (-1, -1) for invalid samples) as a replay file """
+
+    trace = np.zeros(len(t), dtype=replay_dtype)
+    trace['t'], trace['x'], trace['y'] = t, x, y
+    trace['pupil'] = -1 if pupil is None else pupil
+    np.save(file_name, trace)
+
+
+def load_replay_file(file_name):
+    """ Memory-maps a replay file """
+
+    trace = np.load(file_name, mmap_mode='r')
+    if trace.dtype != replay_dtype:
+        raise ValueError('%s is not a replay file (fields should be %s)' % (file_name, replay_dtype))
+    return trace
+
+
+def convert_asc(asc_file, replay_file, eye='R'):
+    """
+    Converts the samples of an EyeLink ASC file (edf2asc output) to a replay file. Of binocular recordings, the
+    samples of eye ('L' or 'R') are used. Missing data ('.') becomes an invalid sample
+    """
+
+    t, x, y, pupil = [], [], [], []
+    binocular = False
+    with open(asc_file) as f:
+        for line in f:
+            if line.startswith('SAMPLES'):
+                binocular = 'LEFT' in line and 'RIGHT' in line
+            if not line[:1].isdigit():
+                continue
+            fields = line.split()
+            columns = fields[4:7] if binocular and eye == 'R' else fields[1:4]
+            t.append(float(fields[0]))
+            if columns[0] == '.' or columns[1] == '.':
+                x.append(-1)
+                y.append(-1)
+                pupil.append(-1)
+            else:
+                x.append(float(columns[0]))
+                y.append(float(columns[1]))
+                pupil.append(float(columns[2]))
+    save_replay_file(replay_file, t, x, y, pupil)
+
+
+class VirtualClock(object):
+    """ A clock that only moves when advanced, e.g. by a simulated frame interval per frame """
+
+    def __init__(self, start_time=0.):
+        self.time = start_time
+
+    def getTime(self):
+        return self.time
+
+    def advance(self, seconds):
+        self.time += seconds
+
+
+class ReplaySampleSource(object):
+    """ Sample source (see gazeevents) of the samples a ReplayTracker has played since the last read """
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.next_sample = 0
+
+    def flush(self):
+        self.next_sample = self.tracker.sample_index() + 1
+
+    def read(self):
+        return self.read_with_pupil()[:3]
+
+    def read_with_pupil(self):
+        last_sample = self.tracker.sample_index()
+        samples = np.arange(max(self.next_sample, 0), last_sample + 1)
+        self.next_sample = last_sample + 1
+        trace = self.tracker.trace[samples % len(self.tracker.trace)]
+        return self.tracker.sample_times(samples), trace['x'].astype(float), trace['y'].astype(float), \
+               trace['pupil'].astype(float)
+
+
+class ReplayTracker(BaseEyeTracker):
+
+    def __init__(self, display, replay_file=None, speed=1.0, clock=None, loop=True,
+                 data_file='replay.edf', pixels_per_degree=40., blink_threshold=150, **args):
+
+        """
+		Initializes a ReplayTracker
+
+		arguments
+		display		--	a pygaze.display.Display instance (unused)
+
+		keyword arguments
+		replay_file		--	file name of the trace (see save_replay_file)
+		speed		--	playback speed relative to the recording
+		clock		--	object with a getTime() method (seconds) that is
+						used as time; default time.time()
+		loop		--	start again at the end of the trace; if False,
+						samples after the end are invalid
+		data_file		--	the message file is saved next to this file
+		pixels_per_degree	--	to set the event detection thresholds in
+						pixels
+		blink_threshold	--	minimal blink duration (ms)
+		"""
+
+        try:
+            copy_docstr(BaseEyeTracker, ReplayTracker)
+        except:
+            pass
+
+        self.display = display
+        self.trace = load_replay_file(replay_file)
+        self.speed = speed
+        self.clock = clock
+        self.loop = loop
+        self.local_data_file = data_file
+        self.recording = False
+        self.is_connected = True
+        self.start_time = None
+        self.commands = []
+        self.messages = []
+
+        # one loop of the trace lasts until the sample after the last one
+        self.trace_start = self.trace['t'][0]
+        self.trace_times = self.trace['t'] - self.trace_start
+        self.sample_interval = np.median(np.diff(self.trace_times)) if len(self.trace) > 1 else 1.
+        self.trace_duration = self.trace_times[-1] + self.sample_interval
+
+        # event detection thresholds (as in libeyelink), with the noise level estimated from the trace
+        valid = self.trace['x'] != -1
+        self.pxdsttresh = tuple([1.4826 * np.median(np.abs(np.diff(self.trace[c][valid]))) or 1.
+                                 for c in ['x', 'y']])
+        self.weightdist = 10
+        self.pxspdtresh = 35 * pixels_per_degree / 1000.
+        self.pxacctresh = 9500 * pixels_per_degree / 1000000.
+        self.pxfixtresh = 1.5 * pixels_per_degree
+        self.fixtimetresh = 100
+        self.blink_threshold = blink_threshold
+        self._sample_source = None
+
+    # Replay time
+    def get_time(self):
+        """ Replay clock time, in ms """
+        return (time.time() if self.clock is None else self.clock.getTime()) * 1000
+
+    def sample_index(self):
+        """ (Unwrapped) index of the newest sample that has been played; -1 before the first """
+        if self.start_time is None:
+            return -1
+        cycle, position = divmod((self.get_time() - self.start_time) * self.speed, self.trace_duration)
+        if cycle > 0 and not self.loop:
+            return -1
+        return int(cycle) * len(self.trace) + np.searchsorted(self.trace_times, position, side='right') - 1
+
+    def sample_times(self, samples):
+        """ Replay clock times (ms) of samples (unwrapped indices) """
+        cycle, index = np.divmod(samples, len(self.trace))
+        return self.start_time + (cycle * self.trace_duration + self.trace_times[index]) / self.speed
+
+    def _newest(self):
+        index = self.sample_index()
+        if index < 0 or not self.recording:
+            return None
+        return self.trace[index % len(self.trace)]
+
+    # Tracker interface
+    def calibrate(self):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        return True
+
+    def close(self):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        if self.recording:
+            self.stop_recording()
+        self.is_connected = False
+        with open(os.path.splitext(self.local_data_file)[0] + '_replay.asc', 'w') as f:
+            for t, msg in self.messages:
+                f.write('MSG\t%.1f\t%s\n' % (t, msg))
+
+    def connected(self):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        return self.is_connected
+
+    def drift_correction(self, pos=None, fix_triggered=False):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        return True
+
+    def fix_triggered_drift_correction(self, pos=None, min_samples=30, max_dev=60, reset_threshold=10):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        return True
+
+    def get_eyetracker_clock_async(self):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        return 0
+
+    def log(self, msg):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        self.messages.append((self.get_time(), msg))
+
+    def status_msg(self, msg):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        self.send_command("record_status_message '%s'" % msg)
+
+    def send_command(self, cmd):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        self.commands.append(cmd)
+
+    def set_eye_used(self):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        pass
+
+    def start_recording(self):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker
+
+		Playback starts at the first start_recording(), and runs on while
+		recording is stopped (e.g. during a recalibration)."""
+
+        if self.start_time is None:
+            self.start_time = self.get_time()
+        self.recording = True
+
+    def stop_recording(self):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        self.recording = False
+
+    def pupil_size(self):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        sample = self._newest()
+        return -1 if sample is None else float(sample['pupil'])
+
+    def sample(self):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        sample = self._newest()
+        return (-1, -1) if sample is None else (float(sample['x']), float(sample['y']))
+
+    # Event detection, as libeyelink's PyGaze method
+    def gaze_event_engine(self, poll_interval=0.001):
+        """ Returns a gazeevents.GazeEventEngine on the played samples """
+        if self._sample_source is None:
+            self._sample_source = ReplaySampleSource(self)
+        return GazeEventEngine(self._sample_source, self.pxdsttresh, self.weightdist, self.pxspdtresh,
+                               self.pxacctresh, self.pxfixtresh, self.fixtimetresh, self.blink_threshold,
+                               poll_interval=poll_interval)
+
+    def blink_monitor(self, **args):
+        """ Returns a gazeevents.BlinkMonitor (not yet started) on the played samples; see libeyelink """
+        return BlinkMonitor(ReplaySampleSource(self), **args)
+
+    def wait_for_saccade_start(self, timeout=None):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        return self.gaze_event_engine().wait_for_saccade_start(timeout)
+
+    def wait_for_saccade_end(self, timeout=None):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        return self.gaze_event_engine().wait_for_saccade_end(timeout)
+
+    def wait_for_fixation_start(self, timeout=None):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        return self.gaze_event_engine().wait_for_fixation_start(timeout)
+
+    def wait_for_fixation_end(self, timeout=None):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        return self.gaze_event_engine().wait_for_fixation_end(timeout)
+
+    def wait_for_blink_start(self, timeout=None):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        return self.gaze_event_engine().wait_for_blink_start(timeout)
+
+    def wait_for_blink_end(self, timeout=None):
+
+        """See pygaze._eyetracker.baseeyetracker.BaseEyeTracker"""
+
+        return self.gaze_event_engine().wait_for_blink_end(timeout)
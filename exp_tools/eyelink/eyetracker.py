@@ -44,19 +44,21 @@ class EyeTracker(BaseEyeTracker):
 		
 		trackertype		--	the type of eye tracker; choose from:
 						'dumbdummy', 'dummy', 'eyelink', 'smi',
-						'tobii', 'eyetribe' (default = TRACKERTYPE)
+						'tobii', 'eyetribe', 'replay' (default =
+						TRACKERTYPE); 'replay' plays back a recorded
+						gaze trace (see _eyetracker.libreplay)
 		**args		--	A keyword-argument dictionary that contains
 						eye-tracker-specific options
 		"""
 
 		# set trackertype to dummy in dummymode
-		if settings.DUMMYMODE:
+		if settings.DUMMYMODE and trackertype != u'replay':
 			trackertype = u'dummy'
 	
 		# correct wrong input
-		if trackertype not in [u'dumbdummy', u'dummy', u'eyelink', u'smi', u'tobii', u'eyetribe']:
+		if trackertype not in [u'dumbdummy', u'dummy', u'eyelink', u'smi', u'tobii', u'eyetribe', u'replay']:
 			raise Exception( \
-				u"Error in eyetracker.EyeTracker: trackertype '%s' not recognized; it should be one of 'dumbdummy', 'dummy', 'eyelink', 'smi', 'tobii', 'eyetribe'" % trackertype)
+				u"Error in eyetracker.EyeTracker: trackertype '%s' not recognized; it should be one of 'dumbdummy', 'dummy', 'eyelink', 'smi', 'tobii', 'eyetribe', 'replay'" % trackertype)
 
 		# EyeLink
 		if trackertype == u'eyelink':
@@ -67,6 +69,15 @@ class EyeTracker(BaseEyeTracker):
 			# initialize
 			self.__class__.__init__(self, display, **args)
 			
+		# recorded gaze trace
+		elif trackertype == u'replay':
+			# import libraries
+			from _eyetracker.libreplay import ReplayTracker
+			# morph class
+			self.__class__ = ReplayTracker
+			# initialize
+			self.__class__.__init__(self, display, **args)
+
 		# SMI
 		elif trackertype == u'smi':
 			# import libraries
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Tools to turn the designs in designs/pp_xxx into FSL-accepted formats: 3-column EV files, design.fsf files and
+(optionally) first-level FEAT runs.
+
+The .fsf-files of pp_001 are made by hand in the FSL gui. They are parsed *once* into a keyed structure
+(``fmri(...)``, ``feat_files(...)`` entries), after which a design.fsf for every other participant and block is
+rendered by only replacing the entries that differ between participants: the output directory, the input
+(feat_files) directory, and the paths of the custom EV files.
+"""
+from __future__ import division
+import os
+import subprocess
+from glob import glob
+from multiprocessing import Pool, cpu_count
+import numpy as np
+import pandas as pd
+
+# Block directory suffixes (relative to pp_xxx/) for which a design.fsf is made
+block_names = ['all_blocks', '_type_localizer', '_type_cognitive_hand', '_type_cognitive_eye', '_type_limbic_hand',
+               '_type_limbic_eye']
+
+
+class FSFTemplate(object):
+    """
+    A parsed FEAT design.fsf-file.
+
+    Comment and empty lines are kept as-is, every ``set <key> <value>`` line is stored as a [key, value] pair.
+    Values are kept as the raw strings found in the file (i.e., including quotes for paths).
+
+    Parameters
+    ----------
+    lines: list
+        Lines of the design.fsf file (as returned by readlines())
+    """
+
+    def __init__(self, lines):
+        self.entries = []   # Either a [key, value] list, or a string (comments/empty lines)
+        self.keys = {}      # key -> index in self.entries
+
+        for line in lines:
+            if line.startswith('set '):
+                key, value = line[4:].rstrip('\n').split(' ', 1)
+                self.keys[key] = len(self.entries)
+                self.entries.append([key, value])
+            else:
+                self.entries.append(line)
+
+    @classmethod
+    def from_file(cls, file_name):
+        """ Reads and parses a design.fsf file """
+        with open(file_name, 'r') as f:
+            return cls(f.readlines())
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def get(self, key, unquote=True):
+        """ Returns the value of key. By default, surrounding quotes are removed. """
+        value = self.entries[self.keys[key]][1]
+        if unquote:
+            value = value.strip('"')
+        return value
+
+    def custom_ev_keys(self):
+        """ Returns the keys of all custom (3-column) EV files, in EV order """
+        ev_keys = [key for key in self.keys if key.startswith('fmri(custom')]
+        return sorted(ev_keys, key=lambda x: int(x[len('fmri(custom'):-1]))
+
+    def render(self, values):
+        """
+        Renders this template as a string, replacing the values of the keys in values.
+
+        Parameters
+        ----------
+        values: dict
+            key -> new value. Strings are written quoted (as FSL does for paths), anything else as is.
+        """
+
+        # Index the overrides only once, so that rendering is a single pass over the entries
+        overrides = {}
+        for key, value in values.items():
+            if key not in self.keys:
+                raise(KeyError('%s is not an entry of this .fsf-template' % key))
+            if isinstance(value, str):
+                value = '"%s"' % value
+            overrides[self.keys[key]] = 'set %s %s\n' % (key, value)
+
+        out = []
+        for i, entry in enumerate(self.entries):
+            if i in overrides:
+                out.append(overrides[i])
+            elif isinstance(entry, list):
+                out.append('set %s %s\n' % (entry[0], entry[1]))
+            else:
+                out.append(entry)
+
+        return ''.join(out)
+
+    def render_for_directory(self, design_dir, values=None):
+        """
+        Renders this template for the block directory design_dir: sets the output directory, the input directory
+        (if any) and points all custom EVs to design_dir/evs/, keeping the EV file names of the template.
+        """
+
+        design_dir = os.path.abspath(design_dir)
+        new_values = {'fmri(outputdir)': design_dir}
+
+        if 'feat_files(1)' in self and self.get('feat_files(1)') != '':
+            new_values['feat_files(1)'] = design_dir
+
+        for key in self.custom_ev_keys():
+            new_values[key] = os.path.join(design_dir, 'evs', os.path.basename(self.get(key)))
+
+        if values is not None:
+            new_values.update(values)
+
+        return self.render(new_values)
+
+
+def create_evs(design, global_timing=True):
+    """
+    Creates all EVs (onset, duration, weight) of a single block directory.
+
+    Modelled are:
+    - Localizer: cue and response, by direction (left/right) x response modality (eye/hand)
+    - Decision-making blocks: cue type (spd/acc or left/neu/right), and stimulus by stimulus direction x cue type
+
+    Parameters
+    ----------
+    design: pd.DataFrame
+        Contents of a trials.csv file
+    global_timing: bool
+        If True, use the timing relative to the start of the experiment (all_blocks and localizer), otherwise use the
+        timing relative to the start of the block
+
+    Returns
+    -------
+    evs: dict
+        EV name -> np.array of shape (n_events, 3)
+    """
+
+    if global_timing:
+        stim_onset_col = 'stimulus_onset_time'
+        cue_onset_col = 'cue_onset_time'
+    else:
+        stim_onset_col = 'stimulus_onset_time_block'
+        cue_onset_col = 'cue_onset_time_block'
+
+    # Get rid of all null trials. Weights of all EVs are 1
+    design = design.loc[design['null_trial'] != True].copy()
+    design['weight'] = 1
+
+    evs = {}
+
+    # For the localizer block
+    if 0 in design['block'].unique():
+        subs = design.loc[design['block'] == 0]
+
+        for effector in subs['response_modality'].unique():
+            for cue in subs['cue'].unique():
+                idx = (subs['response_modality'] == effector) & (subs['cue'] == cue)
+                evs['ev_resp_%s_%s' % (effector, cue)] = subs.loc[idx, [stim_onset_col, 'phase_4',
+                                                                        'weight']].values.astype(float)
+                evs['ev_cue_%s_%s' % (effector, cue)] = subs.loc[idx, [cue_onset_col, 'phase_2',
+                                                                       'weight']].values.astype(float)
+
+        # Get rid of localizer block here
+        design = design.loc[design['block'] > 0]
+
+    for cue_type in design['cue'].unique():
+        evs['ev_cue_%s' % cue_type] = design.loc[design['cue'] == cue_type, [cue_onset_col, 'phase_2',
+                                                                             'weight']].values.astype(float)
+
+    for stim_type in design['correct_answer'].unique():
+        if np.isnan(stim_type):  # a nan stimtype corresponds to a null trial, so skip these
+            continue
+
+        for cue_type in design['cue'].unique():
+            idx = (design['correct_answer'] == stim_type) & (design['cue'] == cue_type)
+            evs['ev_stimulus_%d_%s' % (stim_type, cue_type)] = design.loc[idx, [stim_onset_col, 'phase_4',
+                                                                                'weight']].values.astype(float)
+
+    return evs
+
+
+def write_evs(design_dir):
+    """ Writes all EVs of the block directory design_dir as 3-column .txt-files in design_dir/evs/ """
+
+    global_timing = 'all_blocks' in design_dir or 'localizer' in design_dir
+    evs = create_evs(pd.read_csv(os.path.join(design_dir, 'trials.csv')), global_timing=global_timing)
+
+    output_dir = os.path.join(design_dir, 'evs')
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    for ev_name, ev in evs.items():
+        np.savetxt(os.path.join(output_dir, ev_name + '.txt'), ev, fmt='%g', delimiter='\t')
+
+    return evs
+
+
+def load_templates(design_path, template_pp=1):
+    """ Parses the design.fsf of every block of the template participant, returns block_name -> FSFTemplate """
+
+    templates = {}
+    for block_name in block_names:
+        fn = glob(os.path.join(design_path, 'pp_' + str(template_pp).zfill(3), '*' + block_name, 'design.fsf'))[0]
+        templates[block_name] = FSFTemplate.from_file(fn)
+
+    return templates
+
+
+def render_participants(design_path, participants, templates=None, template_pp=1, evs=True):
+    """
+    Writes the EV files and design.fsf of every block of every participant in participants.
+
+    Parameters
+    ----------
+    design_path: str
+        Directory containing all pp_xxx directories
+    participants: iterable of int
+    templates: dict or None
+        block_name -> FSFTemplate, as returned by load_templates(). If None, these are loaded from template_pp.
+    evs: bool
+        Also (re)write the 3-column EV files?
+
+    Returns
+    -------
+    fsf_files: list
+        Paths to all written design.fsf files
+    """
+
+    if templates is None:
+        templates = load_templates(design_path, template_pp=template_pp)
+
+    fsf_files = []
+    for pp in participants:
+        for block_name in block_names:
+            design_dir = glob(os.path.join(design_path, 'pp_' + str(pp).zfill(3), '*' + block_name))[0]
+
+            if evs:
+                write_evs(design_dir)
+
+            fsf_fn = os.path.join(design_dir, 'design.fsf')
+            with open(fsf_fn, 'w') as f:
+                f.write(templates[block_name].render_for_directory(design_dir))
+            fsf_files.append(fsf_fn)
+
+    return fsf_files
+
+
+def _run_feat_single(fsf_fn):
+    """ Runs feat on a single design.fsf file, in the directory of that file """
+    return subprocess.call(['feat', os.path.basename(fsf_fn)], cwd=os.path.dirname(os.path.abspath(fsf_fn)))
+
+
+def run_feat(fsf_files, n_processes=None):
+    """
+    Runs FEAT for all fsf_files in a bounded pool of processes (instead of chdir + os.system one-by-one).
+
+    Parameters
+    ----------
+    fsf_files: list
+        Paths to design.fsf files
+    n_processes: int or None
+        Maximum number of simultaneous FEAT runs. Defaults to the number of CPUs minus 1.
+
+    Returns
+    -------
+    return_codes: list
+        Return code of feat for every file in fsf_files
+    """
+
+    if n_processes is None:
+        n_processes = max(1, cpu_count() - 1)
+
+    pool = Pool(processes=min(n_processes, max(1, len(fsf_files))))
+    try:
+        return_codes = pool.map(_run_feat_single, fsf_files)
+    finally:
+        pool.close()
+        pool.join()
+
+    for fsf_fn, return_code in zip(fsf_files, return_codes):
+        if return_code != 0:
+            print('feat returned %d for %s' % (return_code, fsf_fn))
+
+    return return_codes
@@ -1,27 +1,6 @@
 from FlashSession import *
 from psychopy import core
 
-# Kill all background processes (macOS only)
-try:
-    import appnope
-    appnope.nope()
-except:
-    pass
-
-try:
-    # Kill Finder during execution (this will be fun)
-    applescript="\'tell application \"Finder\" to quit\'"
-    shellCmd = 'osascript -e '+ applescript
-    os.system(shellCmd)
-except:
-    pass
-
-# Set nice to -20: extremely high PID priority
-new_nice = -20
-sysErr = os.system("sudo renice -n %s %s" % (new_nice, os.getpid()))
-if sysErr:
-    print('Warning: Failed to renice, probably you arent authorized as superuser')
-
 
 def main():
     initials = raw_input('Your initials: ')
@@ -123,6 +102,9 @@ def main():
         # Run without simulated scanner (useful for a behavioral session with eye-tracking)
         sess = FlashSession(subject_initials=initials, index_number=pp_nr, scanner=scanner, tracker_on=tracker_on,
                             language=language, mirror=mirror, start_block=block_n, start_score=start_score)
+
+    # Real-time scheduling, CPU pinning and memory locking of the render thread (Linux), checked by a jitter self-test
+    sess.setup_realtime()
     sess.run()
 
 
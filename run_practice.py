@@ -2,24 +2,6 @@ from FlashSession import *
 from psychopy.hardware.emulator import launchScan
 from psychopy import core
 
-# Kill all background processes (macOS only)
-try:
-    import appnope
-    appnope.nope()
-except:
-    pass
-
-# Kill Finder during execution (this will be fun)
-applescript="\'tell application \"Finder\" to quit\'"
-shellCmd = 'osascript -e '+ applescript
-os.system(shellCmd)
-
-# Set nice to -20: extremely high PID priority
-new_nice = -20
-sysErr = os.system("sudo renice -n %s %s" % (new_nice, os.getpid()))
-if sysErr:
-    print('Warning: Failed to renice, probably you arent authorized as superuser')
-
 
 def main():
     initials = raw_input('Your initials: ')
@@ -45,6 +27,8 @@ def main():
     # Launch dummy scanner
     sess.scanner = launchScan(win=sess.screen, settings={'TR': TR, 'volumes': 10000, 'sync': 't'}, mode='Test')
 
+    # Real-time scheduling, CPU pinning and memory locking of the render thread (Linux), checked by a jitter self-test
+    sess.setup_realtime()
     sess.run()
 
 
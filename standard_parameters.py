@@ -5,9 +5,10 @@ import os
 # Parameters of the flashing circles
 parameters = {
     'n_flashers': 2,        # Number of choice options
-    'increment_length': 7,  # Duration of a flash + pause ('increment'), in frames. 7 is default on 60Hz
+    'increment_duration': 116.67,  # Duration of a flash + pause ('increment'), in ms (7 frames on 60Hz)
     'flasher_size': 0.6,    # Size of flashing circles (radius) in degrees
-    'flash_length': 3,      # Duration of the flash itself in frames. 3 is default on 60Hz.
+    'flash_duration': 50,   # Duration of the flash itself in ms (3 frames on 60Hz). Both durations are rounded to
+                            # whole frames of the measured refresh rate at the start of the session.
     'prop_correct': 0.7,    # Probability of flashing on every increment for the correct answer
     'prop_incorrect': 0.4,  # Probability of flashing on every increment for the incorrect answers
     'radius_deg': 1.5,      # Radius: distance of flashers from center in degrees
@@ -47,6 +48,11 @@ design_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'designs'
 # Do you want to keep track of frame lengths? Recommended
 record_intervals = True
 
+# Where do key presses and scanner pulses come from? 'iohub' (polled at 1kHz in a separate process, millisecond-precise
+# response times; pulses of the launchScan emulator are read from psychopy.event) or 'psychopy' (psychopy.event only,
+# response times bound to the frame rate). If ioHub cannot be started, 'psychopy' is used.
+input_backend = 'iohub'
+
 # Check the following: if the current user is ME, we assume that we're running on my laptop for programming
 if 'USER' in os.environ and os.environ['USER'] == 'steven':
     monitor_name = 'u2715h'
@@ -93,10 +99,6 @@ elif 'HOMEPATH' in os.environ and os.environ['USERNAME'] == 'psyuser':
     monitor_name = 'asus'
     response_keys = ['z', 'slash']
 
-    # Adjust for 120Hz
-    parameters['increment_length'] = parameters['increment_length'] * 2
-    parameters['flash_length'] = parameters['flash_length'] * 2
-
 else:
     # Assumes we are running on the actual, experimental set-up (i.e. 7T-MRI scanner)
     from psychopy.monitors import Monitor
@@ -112,10 +114,6 @@ else:
     monitor_name = 'boldscreen'
     response_keys = ['e', 'b']  # Button box keys
 
-    # Adjust for 120Hz
-    parameters['increment_length'] = parameters['increment_length'] * 2
-    parameters['flash_length'] = parameters['flash_length'] * 2
-
 
 # # The following settings are used for screenshots ONLY (they increase all sizes).
 # fix_cross_parameters = {
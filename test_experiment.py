@@ -6,24 +6,6 @@ from psychopy import core
 import os
 from standard_parameters import *
 
-# Kill all background processes (macOS only)
-try:
-    import appnope
-    appnope.nope()
-except:
-    pass
-
-# Kill Finder during execution (this will be fun)
-# applescript="\'tell application \"Finder\" to quit\'"
-# shellCmd = 'osascript -e '+applescript
-# os.system(shellCmd)
-
-# Set nice to -20: extremely high PID priority
-new_nice = -20
-sysErr = os.system("sudo renice -n %s %s" % (new_nice, os.getpid()))
-if sysErr:
-    print('Warning: Failed to renice, probably you arent authorized as superuser')
-
 # Initialize Session
 sess = FlashSession(subject_initials='SM', index_number=1, scanner='n', tracker_on=True, language='nl',
                     mirror=False, start_block=0, start_score=0)
@@ -35,6 +17,9 @@ if sess.dummy_tracker:  # annoyingly, launchScan sets mouseVisible to False - se
     sess.screen.setMouseVisible(True)
 
 
+# Real-time scheduling, CPU pinning and memory locking of the render thread (Linux), checked by a jitter self-test
+sess.setup_realtime()
+
 # RUN
 sess.run()
 
@@ -0,0 +1,12 @@
+"""
+The modules under test are imported by their file name (importing the exp_tools package imports psychopy, and the
+eye tracker package pygaze), so their directories are put on the path.
+"""
+
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in [root, os.path.join(root, 'exp_tools'), os.path.join(root, 'exp_tools', 'eyelink')]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
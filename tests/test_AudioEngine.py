@@ -0,0 +1,83 @@
+from __future__ import division
+import os
+import time
+
+import numpy as np
+from scipy.io import wavfile
+
+from AudioEngine import AudioEngine, NullAudioSink
+
+
+def tone(n_frames, amplitude=10000, period=50):
+    return (amplitude * np.sin(2 * np.pi * np.arange(n_frames) / period)).astype(np.int16)
+
+
+def record(engine, sink, sounds, wait=0.2):
+    """ Plays sounds (arrays) through a started engine, and returns what the sink recorded """
+    engine.start()
+    for sound in sounds:
+        engine.play_array(sound)
+    time.sleep(wait)
+    engine.stop()
+    return sink.recorded()
+
+
+def test_sound_is_played_unchanged():
+    sink = NullAudioSink(frames_per_buffer=64, record=True)
+    engine = AudioEngine(frames_per_buffer=64, sink=sink)
+    sound = tone(1000)
+    output = record(engine, sink, [sound])
+
+    assert sink.n_buffers > 0
+    start = np.flatnonzero(output)[0]
+    start -= start % 64   # sounds start at a buffer boundary (the first sample of the tone is 0)
+    np.testing.assert_array_equal(output[start:start + len(sound)], sound)
+    assert not np.any(output[start + len(sound):])
+
+
+def test_overlapping_sounds_are_mixed_and_clipped():
+    engine = AudioEngine(frames_per_buffer=64, sink=NullAudioSink(frames_per_buffer=64))
+    engine.play_array(np.full(64, 20000, dtype=np.int16))
+    engine.play_array(np.full(64, 20000, dtype=np.int16))
+    engine.play_array(np.full(32, -5000, dtype=np.int16))
+    output = np.frombuffer(engine.render(64), dtype=np.int16)
+
+    np.testing.assert_array_equal(output[:32], 32767)   # 35000 would wrap around to a negative value
+    np.testing.assert_array_equal(output[32:], 32767)
+    assert not np.any(np.frombuffer(engine.render(64), dtype=np.int16))
+
+
+def test_longest_playing_voice_is_cut():
+    engine = AudioEngine(frames_per_buffer=16, max_voices=2, sink=NullAudioSink(frames_per_buffer=16))
+    engine.play_array(np.full(64, 1, dtype=np.int16))
+    engine.render(16)
+    engine.play_array(np.full(64, 10, dtype=np.int16))
+    engine.render(16)
+    engine.play_array(np.full(64, 100, dtype=np.int16))   # replaces the first voice
+    output = np.frombuffer(engine.render(16), dtype=np.int16)
+
+    np.testing.assert_array_equal(output, 110)
+
+
+def test_stop_all():
+    engine = AudioEngine(frames_per_buffer=16, sink=NullAudioSink(frames_per_buffer=16))
+    engine.play_array(np.full(64, 1, dtype=np.int16))
+    engine.render(16)
+    engine.play_array(np.full(64, 1, dtype=np.int16))
+    engine.stop_all()
+
+    assert not np.any(np.frombuffer(engine.render(16), dtype=np.int16))
+
+
+def test_load_mixes_down_and_resamples(tmpdir):
+    file_name = os.path.join(str(tmpdir), 'stereo.wav')
+    left = np.linspace(-.5, .5, 22050).astype(np.float32)
+    wavfile.write(file_name, 22050, np.column_stack([left, left / 2]))
+
+    engine = AudioEngine(sample_rate=44100, sink='null')
+    engine.load(file_name, 'sound')
+    sound = engine.sounds['sound']
+
+    assert sound.dtype == np.int16 and sound.flags['C_CONTIGUOUS']
+    assert len(sound) == 44100
+    np.testing.assert_allclose(sound[[0, -1]], [-.375 * 32767, .375 * 32767], atol=2)
@@ -0,0 +1,63 @@
+from __future__ import division
+import itertools
+
+import numpy as np
+import pytest
+
+from EvidenceSampler import total_distributions, sample_increments, sample_increments_batch, \
+    rejection_sample_increments, compare_samplers
+
+
+def test_totals_distribution_by_enumeration():
+    # All 2 ** 12 evidence streams of 2 flashers of 6 increments, weighted by their probability
+    n_increments, prop_correct, prop_incorrect = 6, .7, .4
+    p_correct_total = np.zeros(n_increments + 1)
+    for streams in itertools.product([0, 1], repeat=2 * n_increments):
+        correct, incorrect = np.array(streams[:n_increments]), np.array(streams[n_increments:])
+        if correct.sum() >= incorrect.sum():
+            p_correct_total[correct.sum()] += (prop_correct ** correct.sum() *
+                                               (1 - prop_correct) ** (n_increments - correct.sum()) *
+                                               prop_incorrect ** incorrect.sum() *
+                                               (1 - prop_incorrect) ** (n_increments - incorrect.sum()))
+
+    correct_cdf, incorrect_cdf = total_distributions(n_increments, prop_correct, prop_incorrect, 2)
+    np.testing.assert_allclose(correct_cdf, np.cumsum(p_correct_total) / p_correct_total.sum())
+
+
+def test_correct_flasher_has_most_evidence():
+    random_state = np.random.RandomState(0)
+    for correct_answer in range(3):
+        for _ in range(200):
+            increments = sample_increments(20, .55, .45, 3, correct_answer, random_state)
+            assert increments.shape == (3, 20) and increments.dtype == np.int8
+            totals = increments.sum(axis=1)
+            assert (totals[correct_answer] >= totals).all()
+
+
+def test_batch():
+    correct_answers = np.random.RandomState(0).randint(0, 2, 500)
+    increments = sample_increments_batch(20, .6, .4, 2, correct_answers, np.random.RandomState(1))
+    assert increments.shape == (500, 2, 20) and increments.dtype == np.int8
+
+    totals = increments.sum(axis=2)
+    assert (totals[np.arange(500), correct_answers] >= totals.max(axis=1)).all()
+
+
+@pytest.mark.parametrize('n_increments, prop_correct, prop_incorrect, n_flashers', [
+    (20, .8, .2, 2), (20, .55, .45, 2), (30, .55, .45, 4), (10, .5, .5, 3)])
+def test_same_distribution_as_rejection_sampler(n_increments, prop_correct, prop_incorrect, n_flashers):
+    result = compare_samplers(n_increments, prop_correct, prop_incorrect, n_flashers, n_samples=3000,
+                              random_state=np.random.RandomState(0))
+    assert result['p_totals'] > .001
+    assert result['p_positions'] > .001
+
+
+def test_rejection_sampler_counts_attempts():
+    increments, n_attempts = rejection_sample_increments(10, .5, .5, 3, 1, np.random.RandomState(0))
+    totals = increments.sum(axis=1)
+    assert (totals[1] >= totals).all() and n_attempts >= 1
+
+
+def test_impossible_difficulty():
+    with pytest.raises(ValueError):
+        total_distributions(10, 0., 1., 2)
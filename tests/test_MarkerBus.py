@@ -0,0 +1,94 @@
+from __future__ import division
+import os
+import threading
+import time
+
+from MarkerBus import MarkerBus, FileSink, TriggerSink
+
+
+class ListSink(object):
+    """ Keeps all markers; write() takes pause seconds per marker, like the paced EDF messages """
+
+    def __init__(self, pause=0.):
+        self.pause = pause
+        self.markers = []
+        self.threads = set()
+
+    def write(self, codes, times, labels):
+        self.threads.add(threading.current_thread())
+        for marker in zip(codes, times, labels):
+            self.markers.append(tuple(marker))
+            time.sleep(self.pause)
+
+
+class FakeDispatcher(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, trigger, t=None):
+        self.sent.append((trigger, t, time.time()))
+
+
+def test_every_sink_gets_every_marker_in_order(tmpdir):
+    file_name = os.path.join(str(tmpdir), 'markers.tsv')
+    sinks = [ListSink(), ListSink(), FileSink(file_name)]
+    bus = MarkerBus(sinks, capacity=64, interval=.001)
+    bus.start()
+    for i in range(200):
+        bus.mark(MarkerBus.KEY_EVENT, i / 100, 'key\t%d' % i)
+        if i % 20 == 0:
+            time.sleep(.005)
+    bus.stop()
+
+    expected = [(MarkerBus.KEY_EVENT, i / 100, 'key\t%d' % i) for i in range(200)]
+    assert sinks[0].markers == expected and sinks[1].markers == expected
+    assert bus.n_lost == [0, 0, 0]
+    # each sink has its own thread (stop() delivers the last markers from the calling thread)
+    assert not (sinks[0].threads & sinks[1].threads) - set([threading.current_thread()])
+    with open(file_name) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == 'time\tcode\tlabel' and lines[1] == '0.000000\t3\tkey 0' and len(lines) == 201
+
+
+def test_slow_sink_does_not_delay_others():
+    slow, fast = ListSink(pause=.01), ListSink()
+    bus = MarkerBus([slow, fast], interval=.001)
+    bus.start()
+    for i in range(20):
+        bus.mark(MarkerBus.TEXT, i, str(i))
+    time.sleep(.05)
+
+    assert len(fast.markers) == 20
+    assert len(slow.markers) < 20
+    bus.stop()
+    assert len(slow.markers) == 20
+
+
+def test_lost_markers_are_counted_per_sink():
+    slow, fast = ListSink(pause=.002), ListSink()
+    bus = MarkerBus([slow, fast], capacity=8, interval=.001)
+    bus.start()
+    for i in range(100):
+        bus.mark(MarkerBus.TEXT, i)
+        time.sleep(.0002)
+    bus.stop()
+
+    assert bus.n_lost[1] == 0 and len(fast.markers) == 100
+    assert bus.n_lost[0] > 0 and len(slow.markers) + bus.n_lost[0] == 100
+    times = [t for code, t, label in slow.markers]
+    assert times == sorted(times)
+
+
+def test_triggers_are_sent_at_mark():
+    dispatcher = FakeDispatcher()
+    bus = MarkerBus([ListSink(pause=.01), TriggerSink(dispatcher)], interval=1.)
+    bus.start()
+    bus.mark(MarkerBus.TRIAL_START, 1.5, 'trial 1 started')
+    bus.mark(MarkerBus.TEXT, 1.5, 'trial 1 parameter')   # text-only: no trigger
+    bus.mark(MarkerBus.PHASE_START + 1, 1.6)
+
+    assert [(trigger, t) for trigger, t, sent in dispatcher.sent] == [(MarkerBus.TRIAL_START, 1.5),
+                                                                      (MarkerBus.PHASE_START + 1, 1.6)]
+    bus.stop()
+    assert len(dispatcher.sent) == 2
@@ -0,0 +1,109 @@
+from __future__ import division
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from SimulatedObserver import load_design, simulate, summarize
+
+parameters = {'n_flashers': 2, 'increment_duration': 116.67, 'flash_duration': 50, 'prop_correct': .7,
+              'prop_incorrect': .4}
+sat = {'speed_max_time': 1., 'acc_max_time': 1.5}
+
+
+def make_design(n_trials=40):
+    """ A cognitive block (SPD / ACC cues) and a limbic block (LEFT / RIGHT / NEU cues) in which every tenth trial is a
+    null trial, and some localizer trials """
+    trials = pd.DataFrame({
+        'block_type': ['cognitive_hand'] * n_trials + ['limbic_eye'] * n_trials + ['localizer'] * 4,
+        'null_trial': [i % 10 == 9 for i in range(2 * n_trials)] + [False] * 4,
+        'correct_answer': np.arange(2 * n_trials + 4) % 2,
+        'cue': ['SPD', 'ACC'] * (n_trials // 2) + ['LEFT', 'RIGHT', 'NEU', 'NEU'] * (n_trials // 4) + ['LEFT'] * 4,
+        'trial_type': list(np.arange(n_trials) % 2) + list(np.arange(n_trials) % 6) + [0] * 4,
+        'response_modality': ['hand'] * n_trials + ['eye'] * n_trials + ['hand'] * 4,
+        'phase_4': 1.5,
+    })
+    return trials
+
+
+def test_load_design_keeps_decision_trials():
+    trials = load_design(make_design())
+    assert len(trials) == 72
+    assert (trials['block_type'] != 'localizer').all() and not trials['null_trial'].any()
+    assert (trials.index == np.arange(72)).all()
+
+
+def test_results():
+    trials, results = simulate(make_design(), n_simulations=30, parameters=parameters, chunk_size=10, n_processes=1,
+                               seed=0)
+    for key in ['choice', 'rt', 'response_type', 'feedback_type']:
+        assert results[key].shape == (30, len(trials))
+    assert results['score'].shape == (30, )
+
+    responded = ~np.isnan(results['rt'])
+    assert ((results['choice'] == -1) == ~responded).all()
+    assert (results['response_type'][~responded] == 0).all()
+    assert (results['rt'][responded] < 1.5).all()
+    assert (results['feedback_type'][responded & (results['rt'] < .15)] == 3).all()
+
+    # Only SPD trials get 'too slow' feedback after a response
+    too_slow = responded & (results['feedback_type'] == 0)
+    assert (trials['cue'].values[too_slow.any(axis=0)] == 'SPD').all()
+
+
+def test_score_counts_rewards_of_correct_limbic_trials():
+    trials, results = simulate(make_design(), n_simulations=20, parameters=parameters, n_processes=1, seed=0)
+    rewards = np.where(trials['block_type'] == 'limbic_eye',
+                       trials['trial_type'].map({2: 8, 5: 8, 3: 2, 4: 2}).fillna(0), 0)
+    np.testing.assert_array_equal(results['score'], ((results['response_type'] == 1) * rewards).sum(axis=1))
+
+
+def test_reproducible_with_seed_and_in_parallel():
+    args = dict(n_simulations=20, parameters=parameters, chunk_size=10, seed=3)
+    _, results = simulate(make_design(), n_processes=1, **args)
+    _, results_again = simulate(make_design(), n_processes=1, **args)
+    _, results_parallel = simulate(make_design(), n_processes=2, **args)
+    for key in results:
+        np.testing.assert_array_equal(results[key], results_again[key])
+        np.testing.assert_array_equal(results[key], results_parallel[key])
+
+
+def test_accuracy_follows_difficulty():
+    observer = {'cue_bias': 0.}
+    accuracies = []
+    for prop_correct, prop_incorrect in [(.5, .5), (.9, .1)]:
+        these_parameters = dict(parameters, prop_correct=prop_correct, prop_incorrect=prop_incorrect)
+        _, results = simulate(make_design(), n_simulations=50, observer=observer, parameters=these_parameters,
+                              n_processes=1, seed=0)
+        responded = ~np.isnan(results['rt'])
+        accuracies.append((results['response_type'] == 1).sum() / responded.sum())
+
+    # With equal flash probabilities, the correct flasher still flashes at least as often as the other (see
+    # EvidenceSampler), so accuracy is above chance
+    assert .5 < accuracies[0] < .8
+    assert accuracies[1] > .95
+
+
+def test_race_model():
+    design = make_design()
+    design['correct_answer'] = np.arange(len(design)) % 3
+    design['cue'] = design['cue'].replace({'LEFT': 'NEU', 'RIGHT': 'NEU'})
+    three_flashers = dict(parameters, n_flashers=3)
+
+    _, results = simulate(design, n_simulations=10, observer={'model': 'race'}, parameters=three_flashers,
+                          n_processes=1, seed=0)
+    assert set(np.unique(results['choice'])) <= set([-1, 0, 1, 2])
+
+    with pytest.raises(ValueError):
+        simulate(design, n_simulations=10, parameters=three_flashers, n_processes=1, seed=0)
+
+
+def test_summarize():
+    trials, results = simulate(make_design(), n_simulations=20, parameters=parameters, n_processes=1, seed=0)
+    conditions, payout = summarize(trials, results, sat=sat)
+
+    assert len(conditions) == len(trials.groupby(['block_type', 'cue', 'trial_type']))
+    assert conditions['n_trials'].sum() == len(trials)
+    assert ((conditions['accuracy'] >= 0) & (conditions['accuracy'] <= 1)).all()
+    assert payout['mean'] == results['score'].mean()
+    assert payout['euro'] == pytest.approx(payout['mean'] * 10 / 400)
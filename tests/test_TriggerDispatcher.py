@@ -0,0 +1,108 @@
+from __future__ import division
+import socket
+import time
+
+import pytest
+
+from TriggerDispatcher import TriggerDispatcher, FakeNICServer
+
+
+def wait_until(condition, timeout=2.):
+    end_time = time.time() + timeout
+    while not condition() and time.time() < end_time:
+        time.sleep(.005)
+    return condition()
+
+
+@pytest.fixture
+def server():
+    server = FakeNICServer()
+    yield server
+    server.close()
+
+
+def test_triggers_arrive_in_order(server):
+    dispatcher = TriggerDispatcher(host=server.host, port=server.port)
+    assert dispatcher.start()
+    for trigger in range(1, 101):
+        assert dispatcher.send(trigger)
+    dispatcher.stop()
+
+    assert wait_until(lambda: len(server.triggers) == 100)
+    assert [trigger for trigger, t in server.triggers] == list(range(1, 101))
+    summary = dispatcher.latency()
+    assert summary['n_sent'] == 100 and summary['n_dropped'] == 0
+    assert [status for trigger, called, sent, status in dispatcher.log] == ['sent'] * 100
+
+
+def test_send_never_blocks_and_drops_when_full():
+    # Nothing listens: the dispatcher keeps trying to connect, and triggers pile up
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    dispatcher = TriggerDispatcher(host='127.0.0.1', port=port, max_queue=10, reconnect_interval=.05)
+    assert not dispatcher.start(wait_connected=.05)
+    start = time.time()
+    results = [dispatcher.send(trigger) for trigger in range(20)]
+    assert time.time() - start < .05
+
+    assert results == [True] * 10 + [False] * 10
+    assert dispatcher.n_dropped == 10
+    dispatcher.stop(timeout=.1)
+
+
+def test_reconnects_and_resends(server):
+    dispatcher = TriggerDispatcher(host=server.host, port=server.port, reconnect_interval=.05)
+    assert dispatcher.start()
+    dispatcher.send(1)
+    assert wait_until(lambda: len(server.triggers) == 1)
+
+    server.drop_connections()
+    # The first write after the receiver closed may still succeed (TCP reports the broken connection at the next
+    # write), so keep sending until the dispatcher notices and reconnects
+    trigger = 2
+    while dispatcher.n_reconnects == 0 and trigger < 200:
+        dispatcher.send(trigger)
+        trigger += 1
+        time.sleep(.01)
+    assert dispatcher.n_reconnects > 0
+    assert wait_until(lambda: dispatcher.connected.is_set())
+
+    dispatcher.send(1000)
+    assert wait_until(lambda: server.triggers and server.triggers[-1][0] == 1000)
+    dispatcher.stop()
+
+    # In order, and the trigger that failed is sent again: only what was written into the broken connection is lost
+    received = [trigger for trigger, t in server.triggers]
+    assert received == sorted(received)
+    lost = set(trigger for trigger, called, sent, status in dispatcher.log if status == 'sent') - set(received)
+    assert len(lost) <= 2
+
+
+def test_stop_returns_with_a_full_queue():
+    dispatcher = TriggerDispatcher(host='127.0.0.1', port=1, max_queue=5, connect_timeout=.01, reconnect_interval=.05)
+    dispatcher.start(wait_connected=0)
+    for trigger in range(10):
+        dispatcher.send(trigger)
+    start = time.time()
+    dispatcher.stop(timeout=.1)
+
+    assert time.time() - start < 1.
+    assert not dispatcher._thread.is_alive()
+
+
+def test_slow_receiver_does_not_slow_down_send():
+    server = FakeNICServer(delay=.05)
+    try:
+        dispatcher = TriggerDispatcher(host=server.host, port=server.port)
+        assert dispatcher.start()
+        start = time.time()
+        for trigger in range(50):
+            dispatcher.send(trigger)
+        assert time.time() - start < .05
+        dispatcher.stop()
+        assert wait_until(lambda: len(server.triggers) == 50)
+    finally:
+        server.close()
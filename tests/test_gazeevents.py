@@ -0,0 +1,164 @@
+from __future__ import division
+import time
+
+import numpy as np
+
+from _eyetracker.gazeevents import GazeEventEngine, RecordedSampleSource, BlinkMonitor
+
+# Thresholds as libeyelink sets them for 40 pixels per degree
+THRESHOLDS = dict(pxdsttresh=(3., 3.), weightdist=10, pxspdtresh=1.4, pxacctresh=.38, pxfixtresh=60.,
+                  fixtimetresh=100., blink_threshold=50.)
+
+
+def make_trace(seed=0):
+    """
+    1 kHz trace: fixation at (500, 500) until 300 ms, a 30 ms saccade to (800, 500), fixation until a blink (invalid
+    samples) from 630 to 780 ms, and fixation until 1000 ms
+    """
+    t = np.arange(1000.)
+    x = np.where(t < 300, 500., 800.)
+    saccade = (t >= 300) & (t < 330)
+    x[saccade] = 500 + 300 * (1 - np.cos(np.pi * (t[saccade] - 300) / 30)) / 2
+    y = np.full(len(t), 500.)
+    noise = np.random.RandomState(seed).normal(0, .3, (2, len(t)))
+    x, y = x + noise[0], y + noise[1]
+    blink = (t >= 630) & (t < 780)
+    x[blink] = y[blink] = -1
+    return t, x, y
+
+
+def engine(chunk_size=50, trace=None):
+    t, x, y = make_trace() if trace is None else trace
+    return GazeEventEngine(RecordedSampleSource(t, x, y, chunk_size=chunk_size), **THRESHOLDS)
+
+
+def test_saccade_start():
+    saccade_time, start_pos = engine().wait_for_saccade_start()
+    assert 300 <= saccade_time <= 315
+    assert abs(start_pos[0] - 500) < 60 and abs(start_pos[1] - 500) < 5
+
+
+def test_saccade_end():
+    end_time, start_pos, end_pos = engine().wait_for_saccade_end()
+    assert 320 <= end_time <= 345
+    assert abs(end_pos[0] - 800) < 10 and abs(end_pos[1] - 500) < 5
+
+
+def test_fixation_start():
+    fixation_time, position = engine().wait_for_fixation_start()
+    assert fixation_time == 100
+    assert abs(position[0] - 500) < 2
+
+
+def test_blink():
+    assert engine().wait_for_blink_start() == 630
+    assert engine().wait_for_blink_end() == 0   # the first valid sample
+    events = [(event.name, event.time) for event in engine().events(kinds=('blink', ))]
+    assert events == [('blink_start', 630), ('blink_end', 780)]
+
+
+def test_short_dropout_is_not_a_blink():
+    t, x, y = make_trace()
+    x[630:780] = y[630:780] = x[0]
+    x[500:520] = y[500:520] = -1
+    assert engine(trace=(t, x, y)).wait_for_blink_start() is None   # source exhausted
+
+
+def test_events_in_order():
+    events = list(engine(chunk_size=1000).events())
+    names = [event.name for event in events]
+    assert names[:4] == ['fixation_start', 'saccade_start', 'fixation_end', 'saccade_end']
+    assert [event.time for event in events] == sorted(event.time for event in events)
+    assert ('blink_start', 630) in [(event.name, event.time) for event in events]
+
+
+def test_events_do_not_depend_on_chunk_size():
+    reference = list(engine(chunk_size=1000).events())
+    for chunk_size in [1, 7, 50]:
+        assert list(engine(chunk_size=chunk_size).events()) == reference
+
+
+def test_poll_calls_callbacks():
+    gaze_engine = engine(chunk_size=100)
+    saccades = []
+    gaze_engine.on('saccade_start', saccades.append)
+    events = []
+    while not gaze_engine.source.exhausted:
+        events.extend(gaze_engine.poll())
+
+    assert len(saccades) == 1 and saccades[0] in events
+    assert 300 <= saccades[0].time <= 315
+
+
+def make_pupil_trace():
+    """
+    1 kHz trace with pupil sizes (1000 when open): a blink from 1000 to 1100 ms (the pupil shrinks from 990 ms and
+    recovers at 1110 ms), a 20 ms dropout at 2000 ms and a 700 ms loss of tracking at 3000 ms
+    """
+    t = np.arange(5000.)
+    x = np.full(len(t), 500.)
+    y = np.full(len(t), 500.)
+    pupil = np.full(len(t), 1000.)
+    pupil[990:1000] = pupil[1100:1110] = 400
+    for start, end in [(1000, 1100), (2000, 2020), (3000, 3700)]:
+        x[start:end] = y[start:end] = -1
+        pupil[start:end] = 0
+    return t, x, y, pupil
+
+
+def test_blink_monitor_classifies_lost_samples():
+    t, x, y, pupil = make_pupil_trace()
+    monitor = BlinkMonitor(RecordedSampleSource(t, x, y, pupil=pupil))
+    periods = []
+    for start in range(0, len(t), 33):
+        periods.extend(monitor.process(t[start:start + 33], x[start:start + 33], y[start:start + 33],
+                                       pupil[start:start + 33]))
+
+    assert periods == [(990., 1110., 'blink'), (3000., 3700., 'loss')]
+    assert (monitor.n_blinks, monitor.n_losses) == (1, 1)
+
+
+def test_blink_monitor_masks_during_and_after_lost_samples():
+    t, x, y, pupil = make_pupil_trace()
+    monitor = BlinkMonitor(RecordedSampleSource(t, x, y, pupil=pupil), padding=100)
+    masked = []
+    for start in range(0, 2200, 10):
+        monitor.process(t[start:start + 10], x[start:start + 10], y[start:start + 10], pupil[start:start + 10])
+        masked.append((t[start + 9], monitor.masked()))
+
+    assert [time for time, is_masked in masked if is_masked] == \
+        list(np.arange(999., 1210., 10)) + list(np.arange(2009., 2120., 10))
+
+
+def test_blink_monitor_thread():
+    t, x, y, pupil = make_pupil_trace()
+    source = RecordedSampleSource(t, x, y, pupil=pupil, chunk_size=100)
+    monitor = BlinkMonitor(source, interval=.001)
+    monitor.start()
+    for i in range(1000):
+        if source.exhausted:
+            break
+        time.sleep(.001)
+    monitor.stop()
+
+    assert source.exhausted
+    assert (monitor.n_blinks, monitor.n_losses) == (1, 1)
+
+
+def test_paused_blink_monitor_does_not_read():
+    t, x, y, pupil = make_pupil_trace()
+    source = RecordedSampleSource(t, x, y, pupil=pupil, chunk_size=10)
+    monitor = BlinkMonitor(source, interval=.001)
+    monitor.start()
+    time.sleep(.01)
+    monitor.pause()
+    assert not monitor.running()
+    position = source.position
+    time.sleep(.01)
+    assert source.position == position
+
+    monitor.resume()
+    assert monitor.running()
+    time.sleep(.01)
+    monitor.stop()
+    assert source.position > position and not monitor.running()
@@ -0,0 +1,127 @@
+from __future__ import division
+import os
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('pygaze')
+from _eyetracker.libreplay import save_replay_file, load_replay_file, convert_asc, ReplayTracker, VirtualClock
+
+
+@pytest.fixture
+def replay_file(tmpdir):
+    """ 1 kHz trace of 1 s: fixation at (500, 500), a 30 ms saccade to (800, 500) at 300 ms, and a blink (invalid
+    samples) from 630 to 780 ms. Pupil size is the sample number. The noise is small enough that sample-to-sample
+    jitter stays below the acceleration threshold of the saccade detection """
+    t = 5000 + np.arange(1000.)
+    x = np.where(t < 5300, 500., 800.)
+    saccade = (t >= 5300) & (t < 5330)
+    x[saccade] = 500 + 300 * (1 - np.cos(np.pi * (t[saccade] - 5300) / 30)) / 2
+    y = np.full(len(t), 500.)
+    noise = np.random.RandomState(0).normal(0, .05, (2, len(t)))
+    x, y = x + noise[0], y + noise[1]
+    x[630:780] = y[630:780] = -1
+    file_name = os.path.join(str(tmpdir), 'trace.npy')
+    save_replay_file(file_name, t, x, y, pupil=np.arange(1000.))
+    return file_name
+
+
+def test_replay_file_round_trip(replay_file):
+    trace = load_replay_file(replay_file)
+    assert len(trace) == 1000 and trace['t'][0] == 5000
+    assert trace['x'][700] == -1 and trace['pupil'][10] == 10
+
+
+def test_load_rejects_other_arrays(tmpdir):
+    file_name = os.path.join(str(tmpdir), 'other.npy')
+    np.save(file_name, np.zeros((10, 4)))
+    with pytest.raises(ValueError):
+        load_replay_file(file_name)
+
+
+def test_convert_asc(tmpdir):
+    asc_file = os.path.join(str(tmpdir), 'test.asc')
+    with open(asc_file, 'w') as f:
+        f.write('MSG\t100\tstart\n'
+                'SAMPLES\tGAZE\tLEFT\tRIGHT\tRATE\t1000.00\n'
+                '100\t10.0\t20.0\t900.0\t11.0\t21.0\t950.0\t.....\n'
+                '101\t.\t.\t0.0\t12.0\t22.0\t960.0\t.....\n'
+                '102\t10.0\t20.0\t900.0\t.\t.\t0.0\t.....\n')
+    replay_file = os.path.join(str(tmpdir), 'test.npy')
+
+    convert_asc(asc_file, replay_file, eye='R')
+    trace = load_replay_file(replay_file)
+    np.testing.assert_array_equal(trace['t'], [100, 101, 102])
+    np.testing.assert_array_equal(trace['x'], [11, 12, -1])
+    np.testing.assert_array_equal(trace['pupil'], [950, 960, -1])
+
+    convert_asc(asc_file, replay_file, eye='L')
+    np.testing.assert_array_equal(load_replay_file(replay_file)['x'], [10, -1, 10])
+
+
+def test_playback_follows_the_clock(replay_file):
+    clock = VirtualClock()
+    tracker = ReplayTracker(None, replay_file=replay_file, clock=clock, speed=2.)
+    assert tracker.sample() == (-1, -1)
+
+    tracker.start_recording()
+    clock.advance(.0051)
+    trace = load_replay_file(replay_file)
+    assert tracker.sample() == (float(trace['x'][10]), float(trace['y'][10]))
+    assert tracker.pupil_size() == 10
+
+    clock.advance(.5)   # 1010 ms into the trace: it starts again
+    assert tracker.pupil_size() == 10
+
+    tracker.stop_recording()
+    assert tracker.sample() == (-1, -1)
+
+
+def test_playback_without_loop(replay_file):
+    clock = VirtualClock()
+    tracker = ReplayTracker(None, replay_file=replay_file, clock=clock, loop=False)
+    tracker.start_recording()
+    clock.advance(1.5)
+    assert tracker.sample() == (-1, -1)
+
+
+def test_sample_source_reads_every_played_sample_once(replay_file):
+    clock = VirtualClock()
+    tracker = ReplayTracker(None, replay_file=replay_file, clock=clock)
+    source = tracker.gaze_event_engine().source
+    tracker.start_recording()
+    source.flush()
+
+    times = []
+    for i in range(30):
+        clock.advance(.0437)
+        times.append(source.read()[0])
+    times = np.concatenate(times)
+    np.testing.assert_array_equal(np.diff(times), 1.)   # also across the end of the trace
+    assert times[0] == 1 and times[-1] == 1311
+
+
+def test_detects_the_recorded_saccade(replay_file):
+    # Real time: at a higher speed, velocities would be higher too
+    tracker = ReplayTracker(None, replay_file=replay_file)
+    tracker.start_recording()
+    saccade = tracker.wait_for_saccade_start(timeout=1000)
+
+    assert saccade is not None
+    saccade_time = saccade[0] - tracker.start_time
+    assert 300 <= saccade_time <= 315
+    assert abs(saccade[1][0] - 500) < 60
+
+
+def test_messages_are_written_on_close(replay_file, tmpdir):
+    data_file = os.path.join(str(tmpdir), 'session.edf')
+    tracker = ReplayTracker(None, replay_file=replay_file, clock=VirtualClock(1.), data_file=data_file)
+    tracker.log('trial 1 started')
+    tracker.status_msg('Trial 1')
+    tracker.close()
+
+    assert tracker.commands == ["record_status_message 'Trial 1'"]
+    with open(os.path.join(str(tmpdir), 'session_replay.asc')) as f:
+        assert f.read() == 'MSG\t1000.0\ttrial 1 started\n'
+    assert not tracker.connected()